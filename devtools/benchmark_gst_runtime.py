@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measure the GStreamer overhead of a processing task, with and without
+reusing the per-process runtime.
+
+A "cold" task does what every task did before the runtime: build a
+Discoverer and the thumbnail pipeline.  Each cold run happens in a fresh
+thread, which has no Discoverer or pipeline template yet.  A "warm" task
+reuses those of the thread it runs in, as a celery worker process does
+after preinitialization.  Initializing GStreamer only costs anything the
+first time in a process, and is measured on its own; celery workers now
+do it as they start rather than in their first task.
+
+Usage: ./devtools/benchmark_gst_runtime.py [-n RUNS] [VIDEO]
+
+Without VIDEO, a short test clip is made and used.
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+
+def make_clip(path):
+    from mediagoblin.media_types.tools import get_gst_runtime
+    Gst = get_gst_runtime().Gst
+    pipeline = Gst.parse_launch(
+        'videotestsrc num-buffers=30 ! vp8enc ! webmmux ! '
+        f'filesink location={path}')
+    pipeline.set_state(Gst.State.PLAYING)
+    pipeline.get_bus().timed_pop_filtered(
+        10 * Gst.SECOND, Gst.MessageType.ERROR | Gst.MessageType.EOS)
+    pipeline.set_state(Gst.State.NULL)
+
+
+def task(path):
+    from mediagoblin.media_types.tools import get_gst_runtime
+    from mediagoblin.media_types.video.transcoders import capture_frames
+    get_gst_runtime().discoverer().discover_uri(f'file://{path}')
+    capture_frames(path, [0.5], width=180)
+
+
+def cold_task(path):
+    thread = threading.Thread(target=task, args=(path,))
+    thread.start()
+    thread.join()
+
+
+def timed(func, path, runs):
+    start = time.perf_counter()
+    for idx in range(runs):
+        func(path)
+    return (time.perf_counter() - start) / runs * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure the per-task GStreamer overhead')
+    parser.add_argument('-n', '--runs', type=int, default=50)
+    parser.add_argument('video', nargs='?')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    from mediagoblin.media_types.tools import get_gst_runtime
+    get_gst_runtime()
+    print('GStreamer initialization: {:.1f} ms'.format(
+        (time.perf_counter() - start) * 1000))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = args.video
+        if not path:
+            path = os.path.join(tmp_dir, 'clip.webm')
+            make_clip(path)
+        path = os.path.abspath(path)
+
+        # Warm up the decoders, which both kinds of task share
+        task(path)
+        cold = timed(cold_task, path, args.runs)
+        warm = timed(task, path, args.runs)
+
+    print(f'Cold task: {cold:.1f} ms')
+    print(f'Warm task: {warm:.1f} ms')
+    print(f'Saved per task: {cold - warm:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -60,6 +60,20 @@ add_route(
     match_slash=False
 )
 
+add_route(
+    "mediagoblin.api.user.upload_sessions",
+    "/api/user/<string:username>/uploads/sessions/",
+    "mediagoblin.api.views:upload_sessions_endpoint",
+    match_slash=False
+)
+
+add_route(
+    "mediagoblin.api.user.upload_session",
+    "/api/user/<string:username>/uploads/sessions/<string:upload_id>/",
+    "mediagoblin.api.views:upload_session_endpoint",
+    match_slash=False
+)
+
 add_route(
     "mediagoblin.api.inbox",
     "/api/user/<string:username>/inbox/",
@@ -14,23 +14,35 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import base64
+import binascii
+import datetime
 import json
-import io
 import mimetypes
 
 from werkzeug.datastructures import FileStorage
+from werkzeug.http import parse_content_range_header
+
+from mediagoblin import mg_globals
 
 from mediagoblin.decorators import oauth_required
 from mediagoblin.api.decorators import user_has_privilege
 from mediagoblin.db.models import (
     LocalUser, MediaEntry, TextComment, Activity, Location)
+from mediagoblin.db.util import query_validator
 from mediagoblin.tools.federation import create_activity, create_generator
 from mediagoblin.tools.routing import extract_url_arguments
 from mediagoblin.tools.response import (
-    redirect, json_response, json_error, render_to_response)
+    Response, redirect, json_response, json_error, render_to_response,
+    not_modified, set_validators)
 from mediagoblin.meddleware.csrf import csrf_exempt
 from mediagoblin.submit.lib import new_upload_entry, api_upload_request, \
                                     api_add_to_feed
+from mediagoblin.submit.chunked import (
+    CHECKSUM_ALGORITHMS, ChunkRejected, UploadIncomplete, UploadTooLarge,
+    UploadVerificationError, new_upload_session, get_upload_session,
+    store_chunk, open_upload, discard_upload_session)
+from mediagoblin.media_types import FileTypeNotSupported
 
 # MediaTypes
 from mediagoblin.media_types.image import MEDIA_TYPE as IMAGE_MEDIA_TYPE
@@ -127,7 +139,7 @@ def uploads_endpoint(request):
             filename = f'unknown{filenames[0]}'
 
         file_data = FileStorage(
-            stream=io.BytesIO(request.data),
+            stream=request.stream,
             filename=filename,
             content_type=mimetype
         )
@@ -139,6 +151,186 @@ def uploads_endpoint(request):
 
     return json_error("Not yet implemented", 501)
 
+def _positive_int(value):
+    """ Value as an int if it's a positive number, None if it's None """
+    if value is None:
+        return None
+    value = int(value)
+    if value <= 0:
+        raise ValueError(f"{value} is not a positive number")
+    return value
+
+def _chunk_position(request, session):
+    """
+    Works out the byte offset a chunk is PUT at, from the "offset" or
+    "chunk" query arguments or a Content-Range header.
+
+    A Content-Range also tells us the size of the whole upload if the
+    client didn't say so before.
+    """
+    if "offset" in request.args:
+        return int(request.args["offset"])
+
+    if "chunk" in request.args:
+        if session.chunk_size is None:
+            raise ValueError("Upload has no chunkSize to count chunks in")
+        return int(request.args["chunk"]) * session.chunk_size
+
+    content_range = parse_content_range_header(
+        request.headers.get("Content-Range"))
+    if content_range is None or content_range.units != "bytes":
+        raise ValueError("Missing offset, chunk or Content-Range")
+    if content_range.length is not None and session.total_size is None:
+        session.total_size = content_range.length
+    return content_range.start
+
+def _chunk_md5(request):
+    """ The Content-MD5 of a chunk as hex, either base64 or hex is sent """
+    md5 = request.headers.get("Content-MD5")
+    if md5 is None or len(md5) == 32:
+        return md5
+    try:
+        return base64.b64decode(md5, validate=True).hex()
+    except binascii.Error:
+        raise ValueError(f"Invalid Content-MD5 {md5!r}")
+
+@oauth_required
+@csrf_exempt
+@user_has_privilege('uploader')
+def upload_sessions_endpoint(request):
+    """
+    Starts a resumable upload - /api/user/<username>/uploads/sessions
+
+    Takes a JSON object with the "filename" and, if known, "contentType",
+    "size" and "chunkSize" of the upload, as well as the "md5", "sha1" or
+    "sha256" of the whole file, which is checked once it's all there.
+    """
+    username = request.matchdict["username"]
+    requested_user = LocalUser.query.filter(LocalUser.username==username).first()
+
+    if requested_user is None:
+        return json_error(f"No such 'user' with id '{username}'", 404)
+
+    if request.method != "POST":
+        return json_error("Not yet implemented", 501)
+
+    if requested_user.id != request.user.id:
+        return json_error(
+            "Not able to upload as another user.",
+            status=403
+        )
+
+    try:
+        data = json.loads(request.data.decode())
+    except ValueError:
+        return json_error("Invalid JSON provided.")
+
+    filename = data.get("filename")
+    if not filename:
+        return json_error("Must supply a 'filename' to upload.")
+
+    try:
+        total_size = _positive_int(data.get("size"))
+        chunk_size = _positive_int(data.get("chunkSize"))
+    except (TypeError, ValueError) as e:
+        return json_error(f"Invalid size: {e}")
+
+    max_file_size = mg_globals.app_config.get("max_file_size")
+    if max_file_size and total_size \
+            and total_size >= max_file_size * 1024 * 1024:
+        return json_error("Sorry, the file size is too big.", 413)
+
+    checksum = None
+    for algorithm in CHECKSUM_ALGORITHMS:
+        if data.get(algorithm):
+            checksum = f"{algorithm}:{data[algorithm]}"
+
+    try:
+        session = new_upload_session(
+            request.user, filename,
+            content_type=data.get("contentType"),
+            total_size=total_size,
+            chunk_size=chunk_size,
+            checksum=checksum)
+    except ValueError as e:
+        return json_error(str(e))
+
+    return json_response(session.serialize(request), status=201)
+
+@oauth_required
+@csrf_exempt
+@user_has_privilege('uploader')
+def upload_session_endpoint(request):
+    """
+    A resumable upload - /api/user/<username>/uploads/sessions/<id>
+
+    GET gives the status of the upload and PUT sends one chunk of it,
+    chunks may come in any order and at the same time.  Once nothing is
+    missing a POST puts the upload together, the response is the same
+    as for /api/user/<username>/uploads.  DELETE gives up on the upload.
+    """
+    session = None
+    if request.matchdict["username"] == request.user.username:
+        session = get_upload_session(
+            request.user, request.matchdict["upload_id"])
+
+    if session is None:
+        return json_error("No such upload.", 404)
+
+    queue_store = request.app.queue_store
+
+    if request.method == "GET":
+        return json_response(session.serialize(request))
+
+    if request.method == "DELETE":
+        discard_upload_session(queue_store, session)
+        return Response(status=204)
+
+    if request.method == "PUT":
+        try:
+            position = _chunk_position(request, session)
+            md5 = _chunk_md5(request)
+        except ValueError as e:
+            return json_error(str(e))
+
+        try:
+            store_chunk(queue_store, session, position, request.stream, md5)
+        except UploadTooLarge as e:
+            return json_error(str(e), 413)
+        except ChunkRejected as e:
+            return json_error(str(e))
+
+        return json_response(session.serialize(request))
+
+    if request.method == "POST":
+        try:
+            upload = open_upload(queue_store, session)
+        except UploadIncomplete:
+            return json_error("Upload is not complete yet.", 409)
+
+        file_data = FileStorage(
+            stream=upload,
+            filename=session.filename,
+            content_type=session.content_type
+        )
+
+        entry = new_upload_entry(request.user)
+        try:
+            response = api_upload_request(request, file_data, entry)
+        except UploadVerificationError as e:
+            discard_upload_session(queue_store, session)
+            return json_error(str(e))
+        except FileTypeNotSupported as e:
+            discard_upload_session(queue_store, session)
+            return json_error(str(e), 415)
+        finally:
+            upload.close()
+
+        discard_upload_session(queue_store, session)
+        return response
+
+    return json_error("Not yet implemented", 501)
+
 @oauth_required
 @csrf_exempt
 def inbox_endpoint(request, inbox=None):
@@ -167,6 +359,12 @@ def inbox_endpoint(request, inbox=None):
     if inbox is None:
         inbox = Activity.query
 
+    etag, last_modified = query_validator(
+        inbox, Activity.updated, user.updated, request.url)
+    response = not_modified(request, etag, last_modified)
+    if response is not None:
+        return response
+
     # Count how many items for the "totalItems" field
     total_items = inbox.count()
 
@@ -210,7 +408,7 @@ def inbox_endpoint(request, inbox=None):
             # should just skip them.
             pass
 
-    return json_response(feed)
+    return set_validators(json_response(feed), etag, last_modified)
 
 @oauth_required
 @csrf_exempt
@@ -440,6 +638,7 @@ def feed_endpoint(request, outbox=None):
                         f"Invalid 'image' with id '{obj_id}'"
                     )
                 image.generate_slug()
+                image.updated = datetime.datetime.utcnow()
                 image.save()
 
                 # Create an update activity
@@ -560,6 +759,19 @@ def feed_endpoint(request, outbox=None):
             status=501
         )
 
+    # Create outbox
+    if outbox is None:
+        outbox = Activity.query.filter_by(actor=requested_user.id)
+    else:
+        outbox = outbox.filter_by(actor=requested_user.id)
+
+    etag, last_modified = query_validator(
+        outbox, Activity.updated, request.user.id, request.user.updated,
+        request.url)
+    response = not_modified(request, etag, last_modified)
+    if response is not None:
+        return response
+
     feed = {
         "displayName": "Activities by {user}@{host}".format(
             user=request.user.username,
@@ -572,12 +784,6 @@ def feed_endpoint(request, outbox=None):
         "items": [],
     }
 
-    # Create outbox
-    if outbox is None:
-        outbox = Activity.query.filter_by(actor=requested_user.id)
-    else:
-        outbox = outbox.filter_by(actor=requested_user.id)
-
     # We want the newest things at the top (issue: #1055)
     outbox = outbox.order_by(Activity.published.desc())
 
@@ -615,7 +821,7 @@ def feed_endpoint(request, outbox=None):
             pass
     feed["totalItems"] = len(feed["items"])
 
-    return json_response(feed)
+    return set_validators(json_response(feed), etag, last_modified)
 
 @oauth_required
 def feed_minor_endpoint(request):
@@ -175,6 +175,10 @@ class MediaGoblinApp:
         self.meddleware = [common.import_component(m)(self)
                            for m in meddleware.ENABLED_MEDDLEWARE]
 
+        # Compile the templates now, rather than on the first requests
+        if self.app_config['warm_up_templates']:
+            template.warm_up_templates(self)
+
     @contextmanager
     def gen_context(self, ctx=None, **kwargs):
         """
@@ -0,0 +1,223 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Cheaper ways to count things than running COUNT(*) on every request.
+
+ - MediaCounter rows hold the number of media entries per state, per
+   uploader and state, and per tag and state.  They are adjusted
+   whenever media entries are added, changed or deleted through the ORM,
+   and read with get_media_count().
+ - cached_count() remembers the result of other COUNT(*) queries for
+   count_cache_ttl seconds.
+ - count_rows() additionally uses PostgreSQL's table statistics for
+   unfiltered queries over a whole table when approximate_counts is on.
+"""
+
+import collections
+import logging
+
+from sqlalchemy import event, inspect, Table
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import text
+
+from mediagoblin import mg_globals
+from mediagoblin.db.models import MediaCounter, MediaEntry, MediaTag, Tag
+from mediagoblin.tools.cache import TTLCache
+
+_log = logging.getLogger(__name__)
+
+DEFAULT_MEDIA_STATE = MediaEntry.__table__.c.state.default.arg
+
+_count_cache = TTLCache(maxsize=1024)
+
+
+def media_counter_name(state, actor=None, tag=None):
+    """
+    Name of the MediaCounter for entries in state, optionally restricted
+    to the uploader with id actor or to the tag with slug tag.
+    """
+    if actor is not None:
+        return f'user:{actor}:{state}'
+    elif tag is not None:
+        return f'tag:{tag}:{state}'
+    return f'state:{state}'
+
+
+def media_counter_names(state, actor, tag_slugs):
+    """
+    Names of all counters a media entry with these properties counts in
+    """
+    names = [media_counter_name(state), media_counter_name(state, actor)]
+    names.extend(media_counter_name(state, tag=slug) for slug in tag_slugs)
+    return names
+
+
+def get_media_count(state, actor=None, tag=None):
+    """
+    Number of media entries in state, see media_counter_name()
+    """
+    count = MediaCounter.query.with_entities(MediaCounter.count).filter_by(
+        name=media_counter_name(state, actor, tag)).scalar()
+    return count or 0
+
+
+def _stored_counter_names(session, entry_id, state=None):
+    """
+    Counter names of the media entry as currently stored in the database,
+    optionally pretending it was in state.
+    """
+    stored = session.query(MediaEntry.state, MediaEntry.actor).filter(
+        MediaEntry.id == entry_id).first()
+    if stored is None:
+        return []
+    stored_state, actor = stored
+    slugs = [slug for (slug,) in session.query(Tag.slug).join(
+        MediaTag, MediaTag.tag == Tag.id).filter(
+            MediaTag.media_entry == entry_id)]
+    return media_counter_names(state or stored_state, actor, slugs)
+
+
+def _current_counter_names(entry):
+    return media_counter_names(
+        entry.state or DEFAULT_MEDIA_STATE, entry.actor,
+        [media_tag.slug for media_tag in entry.tags_helper])
+
+
+def _counts_changed(entry):
+    attrs = inspect(entry).attrs
+    return any(attrs[key].history.has_changes()
+               for key in ('state', 'actor', 'tags_helper'))
+
+
+def adjust_media_counters(session, deltas):
+    """
+    Add deltas, a mapping of counter names to changes, to the counters
+    """
+    table = MediaCounter.__table__
+    connection = session.connection()
+    for name, delta in deltas.items():
+        if not delta:
+            continue
+        update = table.update().where(table.c.name == name).values(
+            count=table.c.count + delta)
+        if connection.execute(update).rowcount:
+            continue
+
+        # Another transaction may create the counter at the same time, so
+        # insert in a savepoint and update its counter if that fails
+        savepoint = connection.begin_nested()
+        try:
+            connection.execute(
+                table.insert().values(name=name, count=max(delta, 0)))
+        except IntegrityError:
+            savepoint.rollback()
+            connection.execute(update)
+        else:
+            savepoint.commit()
+
+
+def count_state_change(session, entry_id, new_state):
+    """
+    Adjust the counters for a state change written around the ORM, eg by
+    mediagoblin.db.util.atomic_update().  Call before writing the change.
+    """
+    deltas = collections.Counter()
+    deltas.subtract(_stored_counter_names(session, entry_id))
+    deltas.update(_stored_counter_names(session, entry_id, new_state))
+    adjust_media_counters(session, deltas)
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_media_counter_deltas(session, flush_context, instances):
+    deltas = collections.Counter()
+
+    for obj in session.new:
+        if isinstance(obj, MediaEntry):
+            deltas.update(_current_counter_names(obj))
+
+    for obj in session.dirty:
+        if isinstance(obj, MediaEntry) and _counts_changed(obj):
+            deltas.subtract(_stored_counter_names(session, obj.id))
+            deltas.update(_current_counter_names(obj))
+
+    for obj in session.deleted:
+        if isinstance(obj, MediaEntry):
+            deltas.subtract(_stored_counter_names(session, obj.id))
+
+    session.info['media_counter_deltas'] = deltas
+
+
+@event.listens_for(Session, 'after_flush')
+def _apply_media_counter_deltas(session, flush_context):
+    deltas = session.info.pop('media_counter_deltas', None)
+    if deltas:
+        adjust_media_counters(session, deltas)
+
+
+def _cache_key(query):
+    bind = query.session.get_bind()
+    statement = query.statement.compile(bind=bind)
+    return (id(bind), str(statement), repr(sorted(statement.params.items())))
+
+
+def cached_count(query, ttl=None):
+    """
+    query.count(), remembered for ttl (default: count_cache_ttl) seconds
+    """
+    if ttl is None:
+        ttl = mg_globals.app_config['count_cache_ttl']
+    if not ttl:
+        return query.count()
+    return _count_cache.get_or_set(_cache_key(query), query.count, ttl)
+
+
+def approximate_count(query):
+    """
+    Estimate the number of rows an unfiltered query over a single table
+    returns from PostgreSQL's planner statistics.
+
+    Returns None whenever that is not possible, eg on other databases or
+    for tables that were never analyzed.
+    """
+    bind = query.session.get_bind()
+    if bind.dialect.name != 'postgresql' or query.whereclause is not None:
+        return None
+
+    froms = query.statement.froms
+    if len(froms) != 1 or not isinstance(froms[0], Table):
+        return None
+
+    estimate = query.session.execute(
+        text('SELECT reltuples FROM pg_class '
+             'WHERE oid = CAST(:table AS regclass)'),
+        {'table': froms[0].name}).scalar()
+    if estimate is None or estimate < 0:
+        return None
+    return int(estimate)
+
+
+def count_rows(query):
+    """
+    Number of rows of query, estimated if approximate_counts is enabled
+    and cached for count_cache_ttl seconds.
+    """
+    if mg_globals.app_config['approximate_counts']:
+        estimate = approximate_count(query)
+        if estimate is not None:
+            return estimate
+    return cached_count(query)
@@ -0,0 +1,258 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Cache of the records every request needs to work out who is asking.
+
+Resolving the user of a request (from the session cookie or an OAuth
+access token) and checking their privileges and bans used to take
+several queries per request.  The column values of users and access
+tokens, the privilege names of users and the list of bans are
+remembered here for
+identity_cache_ttl seconds; cached rows are attached to the request's
+session without touching the database.
+
+Entries are dropped whenever a flush in this process inserts, changes
+or deletes a user, a privilege or an access token, so other processes
+may see stale data for up to identity_cache_ttl seconds.
+"""
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session as SessionClass, make_transient_to_detached
+from sqlalchemy.orm.attributes import manager_of_class
+from sqlalchemy.orm.util import identity_key
+
+from mediagoblin import mg_globals
+from mediagoblin.db.base import Session
+from mediagoblin.db.models import (
+    AccessToken, Privilege, PrivilegeUserAssociation, User, UserBan)
+from mediagoblin.tools.cache import TTLCache
+
+
+_user_cache = TTLCache(maxsize=1000)
+_token_cache = TTLCache(maxsize=1000)
+_privilege_cache = TTLCache(maxsize=1000)
+_ban_cache = TTLCache(maxsize=1)
+
+
+def _ttl():
+    return mg_globals.app_config['identity_cache_ttl']
+
+
+def _snapshot(instance):
+    state = inspect(instance)
+    values = {attr.key: getattr(instance, attr.key)
+              for attr in state.mapper.column_attrs}
+    return state.class_, values
+
+
+def _restore(session, snapshot):
+    cls, values = snapshot
+    instance = manager_of_class(cls).new_instance()
+    for key, value in values.items():
+        setattr(instance, key, value)
+    # Make it look like a freshly loaded row
+    make_transient_to_detached(instance)
+    session.add(instance)
+    return instance
+
+
+def _get_cached(cache, model, ident):
+    # The session cookie may well hand us the id as a string
+    try:
+        ident = inspect(model).primary_key[0].type.python_type(ident)
+    except (TypeError, ValueError):
+        return None
+
+    session = Session()
+    instance = session.identity_map.get(identity_key(model, ident))
+    if instance is not None:
+        return instance
+
+    ttl = _ttl()
+    bind = id(session.get_bind())
+    cached = cache.get(ident) if ttl else None
+    if cached is not None and cached[0] == bind:
+        return _restore(session, cached[1])
+
+    instance = model.query.get(ident)
+    if instance is not None and ttl:
+        cache.set(ident, (bind, _snapshot(instance)), ttl)
+    return instance
+
+
+def get_user(user_id):
+    """
+    Return the User with the given id (or None), from the cache if possible
+    """
+    return _get_cached(_user_cache, User, user_id)
+
+
+def get_access_token(token):
+    """
+    Return the AccessToken for the given token string (or None), from the
+    cache if possible
+    """
+    return _get_cached(_token_cache, AccessToken, token)
+
+
+def _load_privilege_names(session, user_id):
+    query = session.query(Privilege.privilege_name).join(
+        PrivilegeUserAssociation,
+        PrivilegeUserAssociation.privilege == Privilege.id).filter(
+            PrivilegeUserAssociation.user == user_id)
+    return frozenset(name for name, in query)
+
+
+def privilege_names(user):
+    """
+    Return the names of all privileges the user holds as a frozenset
+
+    The result is also remembered on the user object itself, which lives
+    as long as the request does.
+    """
+    state = inspect(user)
+    if user.id is None or state.modified or state.session is None:
+        # Unsaved changes, the database doesn't know about these yet
+        return frozenset(priv.privilege_name for priv in user.all_privileges)
+
+    names = user.__dict__.get('_privilege_names')
+    if names is not None:
+        return names
+
+    ttl = _ttl()
+    bind = id(state.session.get_bind())
+    cached = _privilege_cache.get(user.id) if ttl else None
+    if cached is not None and cached[0] == bind:
+        names = cached[1]
+    else:
+        names = _load_privilege_names(state.session, user.id)
+        if ttl:
+            _privilege_cache.set(user.id, (bind, names), ttl)
+
+    user.__dict__['_privilege_names'] = names
+    return names
+
+
+def _forget_privilege_names(user, *args):
+    # Expiring may happen after the object itself was garbage collected
+    if user is not None:
+        user.__dict__.pop('_privilege_names', None)
+
+
+event.listen(User, 'expire', _forget_privilege_names, propagate=True)
+event.listen(User, 'refresh', _forget_privilege_names, propagate=True)
+
+
+def _load_ban_expiry(session):
+    return dict(session.query(UserBan.user_id, UserBan.expiration_date))
+
+
+def ban_expiry():
+    """
+    Return a dict mapping the ids of all banned users to the date their
+    ban ends (None if it never does)
+    """
+    session = Session()
+    ttl = _ttl()
+    if not ttl:
+        return _load_ban_expiry(session)
+
+    bind = id(session.get_bind())
+    cached = _ban_cache.get('bans')
+    if cached is not None and cached[0] == bind:
+        return cached[1]
+
+    bans = _load_ban_expiry(session)
+    _ban_cache.set('bans', (bind, bans), ttl)
+    return bans
+
+
+def is_banned(user_id):
+    if not _ttl():
+        return Session().query(UserBan).get(user_id) is not None
+    return user_id in ban_expiry()
+
+
+def refresh_bans():
+    """
+    Forget the cached bans, call this after banning or unbanning a user
+    """
+    _ban_cache.clear()
+
+
+def invalidate_user(user_id):
+    _user_cache.invalidate(user_id)
+    _privilege_cache.invalidate(user_id)
+
+
+def invalidate_access_token(token):
+    _token_cache.invalidate(token)
+
+
+def clear():
+    for cache in (_user_cache, _token_cache, _privilege_cache, _ban_cache):
+        cache.clear()
+
+
+def _changed_identities(session):
+    users, tokens = set(), set()
+    for obj in set(session.new) | set(session.dirty) | set(session.deleted):
+        if isinstance(obj, User):
+            users.add(obj.id)
+            _forget_privilege_names(obj)
+        elif isinstance(obj, UserBan):
+            users.add(obj.user_id)
+            refresh_bans()
+        elif isinstance(obj, AccessToken):
+            tokens.add(obj.token)
+        elif isinstance(obj, Privilege):
+            # Privileges were granted from the other side of the relation
+            users.add(None)
+    return users, tokens
+
+
+def _forget(users, tokens):
+    if None in users:
+        _privilege_cache.clear()
+        refresh_bans()
+    for user_id in users:
+        invalidate_user(user_id)
+    for token in tokens:
+        invalidate_access_token(token)
+
+
+@event.listens_for(SessionClass, 'after_flush')
+def _invalidate_flushed_identities(session, flush_context):
+    users, tokens = _changed_identities(session)
+    if users or tokens:
+        _forget(users, tokens)
+        pending = session.info.setdefault('identity_changes', (set(), set()))
+        pending[0].update(users)
+        pending[1].update(tokens)
+
+
+@event.listens_for(SessionClass, 'after_commit')
+def _invalidate_committed_identities(session):
+    # Again, in case another request cached the old rows in the meantime
+    pending = session.info.pop('identity_changes', None)
+    if pending:
+        _forget(*pending)
+
+
+@event.listens_for(SessionClass, 'after_rollback')
+def _discard_identity_changes(session):
+    session.info.pop('identity_changes', None)
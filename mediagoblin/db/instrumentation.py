@@ -0,0 +1,161 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Opt-in counting and timing of SQL queries.
+
+instrument_engine() hooks into an engine so that every query run while
+a QueryStats collection is active on the current thread (see
+collect_query_stats()) is counted and timed, and queries slower than a
+threshold are logged.  Finished collections can be added to per
+controller aggregates with record_query_stats().
+"""
+
+import logging
+import threading
+import time
+
+from sqlalchemy import event
+
+_log = logging.getLogger(__name__)
+
+_local = threading.local()
+
+_aggregates = {}
+_aggregates_lock = threading.Lock()
+
+
+class QueryStats:
+    """
+    Number and total duration (in seconds) of the queries run for one
+    unit of work, usually a request.
+    """
+    def __init__(self, name=None):
+        self.name = name
+        self.count = 0
+        self.duration = 0.0
+        self.slow_count = 0
+
+    def add(self, duration, slow=False):
+        self.count += 1
+        self.duration += duration
+        if slow:
+            self.slow_count += 1
+
+    def server_timing(self):
+        """
+        Value for a Server-Timing header describing these queries
+        """
+        return 'db;dur={:.1f};desc="{} queries"'.format(
+            self.duration * 1000, self.count)
+
+
+def collect_query_stats(name=None):
+    """
+    Start counting the queries run on this thread into a new QueryStats,
+    which is returned.
+    """
+    stats = QueryStats(name)
+    _local.stats = stats
+    return stats
+
+
+def stop_collecting_query_stats():
+    """
+    Stop counting queries on this thread, returning the QueryStats if
+    there was one.
+    """
+    stats = getattr(_local, 'stats', None)
+    _local.stats = None
+    return stats
+
+
+def current_query_stats():
+    return getattr(_local, 'stats', None)
+
+
+def instrument_engine(engine, slow_query_threshold=None):
+    """
+    Count and time the queries run on engine.
+
+    :param slow_query_threshold: log queries taking at least this many
+        seconds, None to log none.
+    """
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _start_timer(conn, cursor, statement, parameters, context,
+                     executemany):
+        conn.info.setdefault('query_start_time', []).append(
+            time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _stop_timer(conn, cursor, statement, parameters, context,
+                    executemany):
+        duration = time.perf_counter() - conn.info['query_start_time'].pop()
+        slow = (slow_query_threshold is not None
+                and duration >= slow_query_threshold)
+
+        stats = current_query_stats()
+        if stats is not None:
+            stats.add(duration, slow)
+
+        if slow:
+            _log.warning(
+                'Slow query (%.1f ms) in %s: %s',
+                duration * 1000,
+                stats.name if stats is not None else 'unknown controller',
+                statement)
+
+
+def record_query_stats(stats):
+    """
+    Add a finished QueryStats to the running aggregates for its name
+    """
+    with _aggregates_lock:
+        aggregate = _aggregates.setdefault(stats.name, {
+            'requests': 0,
+            'queries': 0,
+            'max_queries': 0,
+            'duration': 0.0,
+            'max_duration': 0.0,
+            'slow_queries': 0})
+        aggregate['requests'] += 1
+        aggregate['queries'] += stats.count
+        aggregate['max_queries'] = max(aggregate['max_queries'], stats.count)
+        aggregate['duration'] += stats.duration
+        aggregate['max_duration'] = max(
+            aggregate['max_duration'], stats.duration)
+        aggregate['slow_queries'] += stats.slow_count
+
+
+def get_aggregate_query_stats():
+    """
+    Copy of the running aggregates, by name, with per request averages
+    """
+    with _aggregates_lock:
+        result = {}
+        for name, aggregate in _aggregates.items():
+            aggregate = dict(aggregate)
+            aggregate['avg_queries'] = (
+                aggregate['queries'] / aggregate['requests'])
+            aggregate['avg_duration'] = (
+                aggregate['duration'] / aggregate['requests'])
+            result[name] = aggregate
+        return result
+
+
+def reset_aggregate_query_stats():
+    with _aggregates_lock:
+        _aggregates.clear()
@@ -0,0 +1,62 @@
+"""add upload session tables
+
+Revision ID: 5b1c2e8f04d7
+Revises: 980f10e618b7
+Create Date: 2026-10-17 14:02:31.507322
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5b1c2e8f04d7'
+down_revision = '980f10e618b7'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    """
+    Resumable uploads: a session per upload and a row for each chunk
+    which has been stored in the queue; see mediagoblin.submit.chunked.
+    """
+    op.create_table(
+        'core__upload_sessions',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('upload_id', sa.Unicode(), nullable=False),
+        sa.Column('actor', sa.Integer(), nullable=False),
+        sa.Column('filename', sa.Unicode(), nullable=False),
+        sa.Column('content_type', sa.Unicode(), nullable=True),
+        sa.Column('total_size', sa.Integer(), nullable=True),
+        sa.Column('chunk_size', sa.Integer(), nullable=True),
+        sa.Column('indexed', sa.Boolean(), nullable=False),
+        sa.Column('checksum', sa.Unicode(), nullable=True),
+        sa.Column('created', sa.DateTime(), nullable=False),
+        sa.Column('updated', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['actor'], ['core__users.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('upload_id'))
+    op.create_index(
+        op.f('ix_core__upload_sessions_actor'),
+        'core__upload_sessions', ['actor'], unique=False)
+
+    op.create_table(
+        'core__upload_chunks',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('session_id', sa.Integer(), nullable=False),
+        sa.Column('position', sa.Integer(), nullable=False),
+        sa.Column('size', sa.Integer(), nullable=False),
+        sa.Column('md5', sa.Unicode(), nullable=False),
+        sa.Column('file_path', sa.Unicode(), nullable=False),
+        sa.ForeignKeyConstraint(['session_id'], ['core__upload_sessions.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('session_id', 'position'))
+
+
+def downgrade():
+    op.drop_table('core__upload_chunks')
+    op.drop_index(
+        op.f('ix_core__upload_sessions_actor'),
+        table_name='core__upload_sessions')
+    op.drop_table('core__upload_sessions')
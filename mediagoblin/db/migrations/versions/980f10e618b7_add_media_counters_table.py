@@ -0,0 +1,50 @@
+"""add media counters table
+
+Revision ID: 980f10e618b7
+Revises: cc3651803714
+Create Date: 2026-10-17 10:12:45.218664
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '980f10e618b7'
+down_revision = 'cc3651803714'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    """
+    Denormalized media entry counts, so listings don't need a COUNT(*)
+    over core__media_entries on every request.  The counters are
+    filled in from the existing entries here and kept up to date by
+    mediagoblin.db.counters from then on.
+    """
+    op.create_table(
+        'core__media_counters',
+        sa.Column('name', sa.Unicode(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('name'))
+
+    op.execute(
+        "INSERT INTO core__media_counters (name, count) "
+        "SELECT 'state:' || state, COUNT(*) "
+        "FROM core__media_entries GROUP BY state")
+    op.execute(
+        "INSERT INTO core__media_counters (name, count) "
+        "SELECT 'user:' || CAST(actor AS VARCHAR) || ':' || state, COUNT(*) "
+        "FROM core__media_entries GROUP BY actor, state")
+    op.execute(
+        "INSERT INTO core__media_counters (name, count) "
+        "SELECT 'tag:' || t.slug || ':' || m.state, COUNT(*) "
+        "FROM core__media_entries m "
+        "JOIN core__media_tags mt ON mt.media_entry = m.id "
+        "JOIN core__tags t ON t.id = mt.tag "
+        "GROUP BY t.slug, m.state")
+
+
+def downgrade():
+    op.drop_table('core__media_counters')
@@ -0,0 +1,50 @@
+"""add content hash columns
+
+Revision ID: e0d0b8a2c6f1
+Revises: 5b1c2e8f04d7
+Create Date: 2026-10-17 16:41:09.118254
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e0d0b8a2c6f1'
+down_revision = '5b1c2e8f04d7'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    """
+    The sha256 of uploaded originals, to find duplicate uploads, and on
+    media files which are shared between such duplicates.
+    """
+    op.add_column(
+        'core__media_entries',
+        sa.Column('content_hash', sa.Unicode(), nullable=True))
+    op.create_index(
+        op.f('ix_core__media_entries_content_hash'),
+        'core__media_entries', ['content_hash'], unique=False)
+
+    op.add_column(
+        'core__mediafiles',
+        sa.Column('content_hash', sa.Unicode(), nullable=True))
+    op.create_index(
+        op.f('ix_core__mediafiles_content_hash'),
+        'core__mediafiles', ['content_hash'], unique=False)
+
+
+def downgrade():
+    op.drop_index(
+        op.f('ix_core__mediafiles_content_hash'),
+        table_name='core__mediafiles')
+    with op.batch_alter_table('core__mediafiles') as batch_op:
+        batch_op.drop_column('content_hash')
+
+    op.drop_index(
+        op.f('ix_core__media_entries_content_hash'),
+        table_name='core__media_entries')
+    with op.batch_alter_table('core__media_entries') as batch_op:
+        batch_op.drop_column('content_hash')
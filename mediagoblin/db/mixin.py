@@ -328,6 +328,36 @@ class MediaEntryMixin(GenerateSlugMixin, GeneratePublicIDMixin):
             self.media_files["original"]
             )
 
+    def get_srcsets(self, keynames=None):
+        """
+        Return a list of (mimetype, srcset) for the sized versions of the
+        media, best compressing formats first, for <picture> <source>s.
+
+        Only the files made from the keynames given are used, if any are.
+        """
+        srcsets = {}
+        for media_file in self.media_files_helper.values():
+            file_metadata = media_file.file_metadata or {}
+            if not ('scaled_width' in file_metadata
+                    and file_metadata.get('mimetype')):
+                continue
+            if keynames is not None \
+                    and file_metadata.get('variant_of') not in keynames:
+                continue
+            widths = srcsets.setdefault(file_metadata['mimetype'], {})
+            widths.setdefault(
+                file_metadata['scaled_width'],
+                self._app.public_store.file_url(media_file.file_path))
+
+        order = ['image/avif', 'image/webp']
+        return [
+            (mimetype, ', '.join(
+                f'{url} {width}w'
+                for width, url in sorted(srcsets[mimetype].items())))
+            for mimetype in sorted(
+                srcsets, key=lambda m: (
+                    order.index(m) if m in order else len(order), m))]
+
     @property
     def icon_url(self):
         '''Return the icon URL (for usage in templates) if it exists'''
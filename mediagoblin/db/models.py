@@ -306,10 +306,12 @@ class User(Base, UserMixin):
                                 even if the user hasn't been given the
                                 privilege. (defaults to True)
         """
-        priv = Privilege.query.filter_by(privilege_name=privilege).one()
-        if priv in self.all_privileges:
+        # TODO: import here due to cyclic imports
+        from mediagoblin.db.identity import privilege_names
+        names = privilege_names(self)
+        if privilege in names:
             return True
-        elif allow_admin and self.has_privilege('admin', allow_admin=False):
+        elif allow_admin and 'admin' in names:
             return True
 
         return False
@@ -321,7 +323,9 @@ class User(Base, UserMixin):
             :returns                True if self is banned
             :returns                False if self is not
         """
-        return UserBan.query.get(self.id) is not None
+        # TODO: import here due to cyclic imports
+        from mediagoblin.db.identity import is_banned
+        return is_banned(self.id)
 
     def serialize(self, request):
         published = UTC.localize(self.created)
@@ -531,6 +535,8 @@ class MediaEntry(Base, MediaEntryMixin, CommentingMixin):
         # or use sqlalchemy.types.Enum?
     license = Column(Unicode)
     file_size = Column(Integer, default=0)
+    # sha256 of the uploaded original, hex encoded
+    content_hash = Column(Unicode, index=True)
     location = Column(Integer, ForeignKey("core__locations.id"))
     get_location = relationship("Location", lazy="joined")
 
@@ -881,6 +887,9 @@ class MediaFile(Base):
     name_id = Column(SmallInteger, ForeignKey(FileKeynames.id), nullable=False)
     file_path = Column(PathTupleWithSlashes)
     file_metadata = Column(MutationDict.as_mutable(JSONEncoded))
+    # content_hash of the entries sharing this file, see
+    # mediagoblin.processing.reuse_processed_media
+    content_hash = Column(Unicode, index=True)
 
     __table_args__ = (
         PrimaryKeyConstraint('media_entry', 'name_id'),
@@ -977,6 +986,20 @@ class MediaTag(Base):
         """A dict like view on this object"""
         return DictReadAttrProxy(self)
 
+class MediaCounter(Base):
+    """
+    Denormalized number of media entries per uploader, state and tag.
+
+    The name identifies what is counted, eg "user:12:processed",
+    "state:failed" or "tag:cats:processed".  Rows are kept in sync as
+    media entries are flushed; see mediagoblin.db.counters.
+    """
+    __tablename__ = "core__media_counters"
+
+    name = Column(Unicode, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
 class Comment(Base):
     """
     Link table between a response and another object that can have replies.
@@ -1285,6 +1308,118 @@ class ProcessingMetaData(Base):
         return DictReadAttrProxy(self)
 
 
+class UploadSession(Base):
+    """
+    A resumable upload which is still coming in chunk by chunk.
+
+    Chunks are kept in the queue store until the upload is complete,
+    see mediagoblin.submit.chunked.  Chunk positions are byte offsets,
+    unless the session is indexed, in which case they are just numbers
+    giving the order of the chunks (as piwigo clients send them).
+    """
+    __tablename__ = 'core__upload_sessions'
+
+    id = Column(Integer, primary_key=True)
+    upload_id = Column(Unicode, nullable=False, unique=True)
+    actor = Column(Integer, ForeignKey(User.id), nullable=False, index=True)
+    filename = Column(Unicode, nullable=False)
+    content_type = Column(Unicode)
+    total_size = Column(Integer)
+    chunk_size = Column(Integer)
+    indexed = Column(Boolean, nullable=False, default=False)
+    # "<algorithm>:<hex digest>" of the whole file, if the client told us
+    checksum = Column(Unicode)
+    created = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+    updated = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+    get_actor = relationship(User,
+        backref=backref('upload_sessions', cascade='all, delete-orphan'))
+
+    def received_ranges(self):
+        """
+        The (start, end) byte ranges received so far, merged and sorted
+        """
+        ranges = []
+        for chunk in self.chunks:
+            start, end = chunk.position, chunk.position + chunk.size
+            if ranges and start <= ranges[-1][1]:
+                ranges[-1] = (ranges[-1][0], max(ranges[-1][1], end))
+            else:
+                ranges.append((start, end))
+        return ranges
+
+    def missing_ranges(self):
+        """
+        The (start, end) byte ranges still to be sent.  If the total size
+        isn't known yet the last range ends with None.
+        """
+        missing = []
+        position = 0
+        for start, end in self.received_ranges():
+            if start > position:
+                missing.append((position, start))
+            position = end
+        if self.total_size is None:
+            missing.append((position, None))
+        elif position < self.total_size:
+            missing.append((position, self.total_size))
+        return missing
+
+    def missing_chunks(self):
+        """The chunk numbers absent from an indexed session"""
+        positions = {chunk.position for chunk in self.chunks}
+        return sorted(set(range(max(positions, default=-1) + 1)) - positions)
+
+    def is_complete(self):
+        if self.indexed:
+            return bool(self.chunks) and not self.missing_chunks()
+        # Without a total size the upload ends wherever the client stopped
+        return bool(self.chunks) and all(
+            end is None for start, end in self.missing_ranges())
+
+    def serialize(self, request):
+        """ Status of this upload for the API """
+        context = {
+            "id": self.upload_id,
+            "url": request.urlgen(
+                "mediagoblin.api.user.upload_session",
+                username=self.get_actor.username,
+                upload_id=self.upload_id,
+                qualified=True),
+            "filename": self.filename,
+            "contentType": self.content_type,
+            "size": self.total_size,
+            "chunkSize": self.chunk_size,
+            "received": [list(r) for r in self.received_ranges()],
+            "missing": [list(r) for r in self.missing_ranges()],
+            "complete": self.is_complete(),
+            "published": self.created.isoformat(),
+            "updated": self.updated.isoformat(),
+        }
+        return context
+
+
+class UploadChunk(Base):
+    """ A chunk of an UploadSession that is safely in the queue store """
+    __tablename__ = 'core__upload_chunks'
+
+    id = Column(Integer, primary_key=True)
+    session_id = Column(Integer, ForeignKey(UploadSession.id), nullable=False)
+    position = Column(Integer, nullable=False)
+    size = Column(Integer, nullable=False)
+    md5 = Column(Unicode, nullable=False)
+    file_path = Column(PathTupleWithSlashes, nullable=False)
+
+    session = relationship(UploadSession,
+        backref=backref('chunks',
+                        order_by='UploadChunk.position',
+                        cascade='all, delete-orphan'))
+
+    __table_args__ = (
+        UniqueConstraint('session_id', 'position'),
+        {})
+
+
 class CommentSubscription(Base):
     __tablename__ = 'core__comment_subscriptions'
     id = Column(Integer, primary_key=True)
@@ -1638,8 +1773,10 @@ class Graveyard(Base):
         return context
 MODELS = [
     LocalUser, RemoteUser, User, MediaEntry, Tag, MediaTag, Comment, TextComment,
-    Collection, CollectionItem, MediaFile, FileKeynames, MediaAttachmentFile, MediaSubtitleFile,
-    ProcessingMetaData, Notification, Client, CommentSubscription, Report,
+    MediaCounter, Collection, CollectionItem, MediaFile, FileKeynames,
+    MediaAttachmentFile, MediaSubtitleFile,
+    ProcessingMetaData, UploadSession, UploadChunk, Notification, Client,
+    CommentSubscription, Report,
     UserBan, Privilege, PrivilegeUserAssociation, RequestToken, AccessToken,
     NonceTimestamp, Activity, Generator, Location, GenericModelReference, Graveyard]
 
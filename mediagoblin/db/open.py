@@ -129,6 +129,10 @@ else:
 
 def load_models(app_config):
     import mediagoblin.db.models
+    # Registers the flush hooks keeping the media counters up to date
+    import mediagoblin.db.counters
+    # ... and the ones dropping stale users and tokens from the identity cache
+    import mediagoblin.db.identity
 
     for plugin in mg_globals.global_config.get('plugins', {}).keys():
         _log.debug("Loading %s.models", plugin)
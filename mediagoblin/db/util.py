@@ -14,10 +14,15 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
 import sys
 
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload, selectinload, with_polymorphic
+
 from mediagoblin import mg_globals as mgg
-from mediagoblin.db.models import MediaEntry, Tag, MediaTag, Collection
+from mediagoblin.db.models import (MediaEntry, Tag, MediaTag, Collection,
+                                   User)
 from mediagoblin.gmg_commands.dbupdate import gather_database_data
 
 from mediagoblin.tools.transition import DISABLE_GLOBALS
@@ -53,6 +58,20 @@ def media_entries_for_tag_slug(dummy_db, tag_slug):
             & (Tag.slug == tag_slug))
 
 
+def with_gallery_loading(query):
+    """
+    Eager-load everything rendering a media entry in a gallery or feed
+    touches (uploader for url_for_self(), media files for thumb_url, tags),
+    so a whole page takes a fixed number of queries instead of a few per
+    entry.
+    """
+    return query.options(
+        joinedload(MediaEntry.get_actor.of_type(
+            with_polymorphic(User, '*', flat=True))),
+        selectinload(MediaEntry.media_files_helper),
+        selectinload(MediaEntry.tags_helper).joinedload(MediaTag.tag_helper))
+
+
 def clean_orphan_tags(commit=True):
     """Search for unused MediaTags and delete them"""
     q1 = Session.query(Tag).outerjoin(MediaTag).filter(MediaTag.id==None)
@@ -66,6 +85,22 @@ def clean_orphan_tags(commit=True):
         Session.commit()
 
 
+def query_validator(query, updated_column, *extra):
+    """
+    Compute cheap cache validators for a document built from query.
+
+    Returns an (etag, last_modified) tuple derived from the number of
+    rows and the newest value of updated_column, plus any extra values
+    the document depends on.  The etag changes whenever a row is added,
+    removed or updated; last_modified doesn't move when rows are removed.
+    """
+    count, last_modified = query.order_by(None).with_entities(
+        func.count(), func.max(updated_column)).one()
+    key = ':'.join(str(part) for part in (count, last_modified) + extra)
+    etag = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return etag, last_modified
+
+
 def check_collection_slug_used(creator_id, slug, ignore_c_id):
     filt = (Collection.actor == creator_id) \
         & (Collection.slug == slug)
@@ -23,8 +23,8 @@ from urllib.parse import urljoin
 
 from mediagoblin import mg_globals as mgg
 from mediagoblin import messages
-from mediagoblin.db.models import (
-    MediaEntry, LocalUser, AccessToken, Comment)
+from mediagoblin.db.identity import get_access_token, get_user
+from mediagoblin.db.models import MediaEntry, LocalUser, Comment
 from mediagoblin.tools.response import (
     redirect, render_404,
     render_user_banned, json_response)
@@ -405,12 +405,19 @@ def oauth_required(controller):
             return json_response({"error": error}, status=400)
 
 
+        # Only form encoded bodies are part of the signature, anything
+        # else (like an upload) is left in the stream for the view
+        if request.mimetype == "application/x-www-form-urlencoded":
+            body = request.data
+        else:
+            body = ""
+
         request_validator = GMGRequestValidator()
         resource_endpoint = ResourceEndpoint(request_validator)
         valid, r = resource_endpoint.validate_protected_resource_request(
                 uri=request.url,
                 http_method=request.method,
-                body=request.data,
+                body=body,
                 headers=dict(request.headers),
                 )
 
@@ -420,10 +427,9 @@ def oauth_required(controller):
 
         # Fill user if not already
         token = authorization["oauth_token"]
-        request.access_token = AccessToken.query.filter_by(token=token).first()
+        request.access_token = get_access_token(token)
         if request.access_token is not None and request.user is None:
-            user_id = request.access_token.actor
-            request.user = LocalUser.query.filter_by(id=user_id).first()
+            request.user = get_user(request.access_token.actor)
 
         return controller(request, *args, **kwargs)
 
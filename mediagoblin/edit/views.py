@@ -84,6 +84,7 @@ def edit_media(request, media):
 
             media.license = str(form.license.data) or None
             media.slug = slug
+            media.updated = datetime.utcnow()
             media.save()
 
             return redirect_obj(request, media)
@@ -164,6 +165,7 @@ def edit_attachments(request, media):
                     created=datetime.utcnow(),
                     ))
 
+            media.updated = datetime.utcnow()
             media.save()
 
             messages.add_message(
@@ -383,6 +385,7 @@ def edit_collection(request, collection):
             collection.title = str(form.title.data)
             collection.description = str(form.description.data)
             collection.slug = str(form.slug.data)
+            collection.updated = datetime.utcnow()
 
             collection.save()
 
@@ -518,6 +521,7 @@ def edit_metadata(request, media):
         json_ld_metadata = None
         json_ld_metadata = compact_and_validate(metadata_dict)
         media.media_metadata = json_ld_metadata
+        media.updated = datetime.utcnow()
         media.save()
         return redirect_obj(request, media)
 
@@ -78,6 +78,10 @@ SUBCOMMAND_MAP = {
         'setup': 'mediagoblin.gmg_commands.batchaddmedia:parser_setup',
         'func': 'mediagoblin.gmg_commands.batchaddmedia:batchaddmedia',
         'help': 'Add many media entries at once'},
+    'compile_templates': {
+        'setup': 'mediagoblin.gmg_commands.compile_templates:parser_setup',
+        'func': 'mediagoblin.gmg_commands.compile_templates:compile_templates',
+        'help': 'Compile all templates into the template cache'},
     'alembic': {
         'setup': 'mediagoblin.gmg_commands.alembic_commands:parser_setup',
         'func': 'mediagoblin.gmg_commands.alembic_commands:raw_alembic_cli',
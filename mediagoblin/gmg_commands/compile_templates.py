@@ -0,0 +1,46 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import sys
+
+from mediagoblin.gmg_commands import util as commands_util
+from mediagoblin.tools.template import compile_templates as _compile_templates
+
+
+def parser_setup(subparser):
+    subparser.add_argument(
+        '--locale', default='en',
+        help='Locale of the template environment to compile with')
+
+
+def compile_templates(args):
+    """
+    Compile all core, theme and plugin templates into the template cache
+    """
+    app = commands_util.setup_app(args)
+
+    if not app.app_config.get('template_cache_dir'):
+        print('template_cache_dir is not set, compiled templates '
+              'would not be kept.')
+        sys.exit(1)
+
+    compiled, failed = _compile_templates(app, args.locale)
+    for name, exc in failed:
+        print(f'Could not compile {name}: {exc}')
+    print(f'Compiled {compiled} templates into '
+          f'{app.app_config["template_cache_dir"]}.')
+    sys.exit(1 if failed else 0)
@@ -91,6 +91,10 @@ def setup_self(check_environ_for_conf=True, module_name=OUR_MODULENAME,
         settings_module=module_name,
         set_environ=False)
 
+    # Let plugins and media types prepare the worker processes
+    from celery import current_app
+    hook_runall('celery_setup', current_app)
+
 
 if os.environ['CELERY_CONFIG_MODULE'] == OUR_MODULENAME:
     setup_self()
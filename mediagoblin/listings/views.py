@@ -16,12 +16,15 @@
 
 from mediagoblin import mg_globals
 from mediagoblin.db.models import MediaEntry
-from mediagoblin.db.util import media_entries_for_tag_slug
+from mediagoblin.db.util import (media_entries_for_tag_slug, query_validator,
+                                 with_gallery_loading)
 from mediagoblin.decorators import uses_pagination
+from mediagoblin.meddleware.page_cache import page_cacheable
 from mediagoblin.plugins.api.tools import get_media_file_paths
 from mediagoblin.tools.feeds import AtomFeedWithLinks
-from mediagoblin.tools.pagination import Pagination
-from mediagoblin.tools.response import render_to_response
+from mediagoblin.tools.pagination import KeysetPagination
+from mediagoblin.tools.response import (
+    render_to_response, not_modified, set_validators)
 from mediagoblin.tools.translate import pass_to_ugettext as _
 
 from werkzeug.wrappers import Response
@@ -43,6 +46,7 @@ def _get_tag_name_from_entries(media_entries, tag_slug):
     return tag_name
 
 
+@page_cacheable
 @uses_pagination
 def tag_listing(request, page):
     """'Gallery'/listing for this tag slug"""
@@ -50,8 +54,11 @@ def tag_listing(request, page):
 
     cursor = media_entries_for_tag_slug(request.db, tag_slug)
     cursor = cursor.order_by(MediaEntry.created.desc())
+    cursor = with_gallery_loading(cursor)
 
-    pagination = Pagination(page, cursor)
+    pagination = KeysetPagination(
+        page, cursor,
+        before=request.GET.get('before'), after=request.GET.get('after'))
     media_entries = pagination()
 
     tag_name = _get_tag_name_from_entries(media_entries, tag_slug)
@@ -83,7 +90,15 @@ def atom_feed(request):
         feed_title += " for all recent items"
         link = request.urlgen('index', qualified=True)
         cursor = MediaEntry.query.filter_by(state='processed')
+
+    etag, last_modified = query_validator(
+        cursor, MediaEntry.updated, request.url)
+    response = not_modified(request, etag, last_modified)
+    if response is not None:
+        return response
+
     cursor = cursor.order_by(MediaEntry.created.desc())
+    cursor = with_gallery_loading(cursor)
     cursor = cursor.limit(ATOM_DEFAULT_NR_OF_UPDATED_ITEMS)
 
     """
@@ -134,4 +149,4 @@ def atom_feed(request):
         feed.writeString(encoding='utf-8'),
         mimetype='application/atom+xml'
     )
-    return response
+    return set_validators(response, etag, last_modified)
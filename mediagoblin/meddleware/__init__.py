@@ -16,6 +16,8 @@
 
 ENABLED_MEDDLEWARE = [
     'mediagoblin.meddleware.csrf:CsrfMeddleware',
+    'mediagoblin.meddleware.page_cache:PageCacheMeddleware',
+    'mediagoblin.meddleware.sqlstats:SQLStatsMeddleware',
     ]
 
 
@@ -0,0 +1,293 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Cache of whole pages rendered for anonymous visitors.
+
+Controllers marked with @page_cacheable are served from the cache when
+the visitor isn't logged in and has nothing in their session.  Cached
+pages are keyed on the URL, locale and theme, carry an ETag and a
+Last-Modified header, and are all thrown away once a transaction
+changing media, comments, collections or users is committed.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+import uuid
+import weakref
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from werkzeug.http import http_date
+
+from mediagoblin import mg_globals
+from mediagoblin.db.models import (
+    Collection, CollectionItem, Comment, MediaEntry, TextComment, User)
+from mediagoblin.meddleware import BaseMeddleware
+from mediagoblin.tools.cache import TTLCache
+from mediagoblin.tools.common import import_component
+from mediagoblin.tools.response import Response
+
+_log = logging.getLogger(__name__)
+
+
+def page_cacheable(controller):
+    """Allow anonymous responses of a controller to be cached."""
+
+    controller.page_cache_enabled = True
+    return controller
+
+
+class MemoryPageCache:
+    """
+    Keep cached pages in the memory of this process.
+
+    Only changes made by this process clear it, so pages stay stale for
+    up to page_cache_ttl after eg the celery worker finishes processing
+    media, or when the site is served by several processes.  Use the
+    filesystem backend for those setups.
+    """
+
+    # Whether other processes see (and clear) the same pages
+    shared = False
+
+    def __init__(self, app_config):
+        self.ttl = app_config['page_cache_ttl']
+        self._cache = TTLCache(
+            ttl=self.ttl or None, maxsize=app_config['page_cache_size'])
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def set(self, key, page):
+        self._cache.set(key, page)
+
+    def clear(self):
+        self._cache.clear()
+
+
+class FileSystemPageCache:
+    """
+    Keep cached pages in page_cache_dir, so all processes share them.
+
+    Every page is a file holding a line of JSON with the status and
+    headers, followed by the body.  Clearing the cache only replaces the
+    generation stored in GENERATION_FILE; pages of older generations are
+    ignored, and removed when they are next looked up.
+    """
+
+    GENERATION_FILE = 'generation'
+    shared = True
+
+    def __init__(self, app_config):
+        self.ttl = app_config['page_cache_ttl']
+        self.directory = app_config['page_cache_dir']
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _write(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, path)
+
+    def _generation(self):
+        try:
+            with open(self._path(self.GENERATION_FILE)) as generation_file:
+                return generation_file.read()
+        except OSError:
+            return ''
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as page_file:
+                meta = json.loads(page_file.readline().decode('utf-8'))
+                body = page_file.read()
+        except (OSError, ValueError):
+            return None
+
+        if meta.pop('generation', None) != self._generation():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        if self.ttl and meta['stored'] + self.ttl < time.time():
+            return None
+        meta['body'] = body
+        return meta
+
+    def set(self, key, page):
+        meta = dict(page, generation=self._generation())
+        body = meta.pop('body')
+        self._write(
+            self._path(key), json.dumps(meta).encode('utf-8') + b'\n' + body)
+
+    def clear(self):
+        self._write(
+            self._path(self.GENERATION_FILE), uuid.uuid4().hex.encode('ascii'))
+
+
+PAGE_CACHE_BACKENDS = {
+    'memory': MemoryPageCache,
+    'filesystem': FileSystemPageCache,
+}
+
+# The caches set up in this process, so changes can be propagated to them
+_page_caches = weakref.WeakSet()
+
+
+def _page_cache_class(app_config):
+    backend = app_config['page_cache']
+    if not backend:
+        return None
+    if backend in PAGE_CACHE_BACKENDS:
+        return PAGE_CACHE_BACKENDS[backend]
+    return import_component(backend)
+
+
+def page_cache_from_config(app_config):
+    """
+    Set up the page cache configured with page_cache: one of
+    PAGE_CACHE_BACKENDS or the "module:Class" of a class taking the app
+    config and providing get(), set() and clear() like MemoryPageCache.
+    Backends whose pages are seen by other processes set shared = True.
+
+    Returns None if the page cache is off.
+    """
+    backend_class = _page_cache_class(app_config)
+    if backend_class is None:
+        return None
+
+    page_cache = backend_class(app_config)
+    _page_caches.add(page_cache)
+    return page_cache
+
+
+def invalidate_page_cache():
+    """Throw away all cached pages."""
+    page_caches = list(_page_caches)
+    if not page_caches and mg_globals.app_config:
+        # eg in the celery worker, which can only reach shared caches
+        backend_class = _page_cache_class(mg_globals.app_config)
+        if getattr(backend_class, 'shared', False):
+            page_caches = [page_cache_from_config(mg_globals.app_config)]
+
+    for page_cache in page_caches:
+        page_cache.clear()
+
+
+CACHE_INVALIDATING_MODELS = (
+    MediaEntry, Comment, TextComment, Collection, CollectionItem, User)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_pages(session, flush_context):
+    changed = set(session.new) | set(session.dirty) | set(session.deleted)
+    if any(isinstance(obj, CACHE_INVALIDATING_MODELS) for obj in changed):
+        session.info['page_cache_invalid'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed_pages(session):
+    # Releasing a savepoint isn't the end of the transaction yet
+    if session.transaction is not None and session.transaction.nested:
+        return
+    if session.info.pop('page_cache_invalid', False):
+        invalidate_page_cache()
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_changed_pages(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop('page_cache_invalid', None)
+
+
+class PageCacheMeddleware(BaseMeddleware):
+    """
+    Serve the pages of @page_cacheable controllers to anonymous visitors
+    from the configured page cache.
+    """
+
+    CACHEABLE_HTTP_METHODS = ("GET", "HEAD")
+
+    def __init__(self, mg_app):
+        super().__init__(mg_app)
+        self.page_cache = page_cache_from_config(mg_app.app_config)
+
+    def _cache_key(self, request):
+        key = '\n'.join([
+            request.host_url,
+            request.full_path,
+            request.query_string.decode('latin-1'),
+            request.locale,
+            self.app.app_config.get('theme') or ''])
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def process_request(self, request, controller):
+        if (self.page_cache is None
+                or not getattr(controller, 'page_cache_enabled', False)
+                or request.method not in self.CACHEABLE_HTTP_METHODS
+                or request.user
+                or request.session):
+            return
+
+        request.page_cache_key = self._cache_key(request)
+        page = self.page_cache.get(request.page_cache_key)
+        if page is None:
+            return
+
+        response = Response(
+            page['body'], status=page['status'], headers=page['headers'])
+        response.vary = ['Cookie']
+        return response.make_conditional(request)
+
+    def process_response(self, request, response):
+        key = getattr(request, 'page_cache_key', None)
+        if (key is None
+                or response.status_code != 200
+                or response.mimetype != 'text/html'
+                or response.is_streamed
+                or request.user
+                or request.session):
+            return
+
+        body = response.get_data()
+        csrf_token = request.environ.get('CSRF_TOKEN')
+        if csrf_token and csrf_token.encode('ascii') in body:
+            # Forms can't be shared between visitors
+            _log.debug('Not caching %s, it contains a form', request.path)
+            return
+
+        response.add_etag()
+        response.headers['Last-Modified'] = http_date(time.time())
+        headers = [(name, value) for name, value in response.headers
+                   if name.lower() not in ('set-cookie', 'content-length')]
+        self.page_cache.set(key, {
+            'status': response.status_code,
+            'headers': headers,
+            'body': body,
+            'stored': time.time()})
+
+        response.make_conditional(request)
@@ -0,0 +1,60 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from mediagoblin.db.instrumentation import (
+    instrument_engine, collect_query_stats, stop_collecting_query_stats,
+    record_query_stats)
+from mediagoblin.meddleware import BaseMeddleware
+from mediagoblin.tools.transition import DISABLE_GLOBALS
+
+
+class SQLStatsMeddleware(BaseMeddleware):
+    """
+    Count and time the SQL queries of each request when sql_stats is on.
+
+    The QueryStats are available as request.sql_stats while the request
+    is handled, are added to the per controller aggregates shown at
+    /mod/sql_stats/ and, with sql_server_timing, are reported in a
+    Server-Timing header.
+    """
+    def __init__(self, mg_app):
+        super().__init__(mg_app)
+        config = mg_app.app_config
+        self.enabled = config['sql_stats']
+        self.server_timing = config['sql_server_timing']
+
+        if self.enabled:
+            threshold = config['sql_slow_query_ms']
+            db = mg_app.db_manager if DISABLE_GLOBALS else mg_app.db
+            instrument_engine(
+                db.engine,
+                threshold / 1000.0 if threshold else None)
+
+    def process_request(self, request, controller):
+        if self.enabled:
+            request.sql_stats = collect_query_stats(request.controller_name)
+
+    def process_response(self, request, response):
+        if not self.enabled:
+            return
+
+        stats = stop_collecting_query_stats()
+        if stats is None:
+            return
+
+        record_query_stats(stats)
+        if self.server_timing:
+            response.headers.add('Server-Timing', stats.server_timing())
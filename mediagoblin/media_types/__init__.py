@@ -19,6 +19,8 @@ import logging
 import shutil
 import tempfile
 
+from werkzeug.datastructures import FileStorage
+
 from mediagoblin.tools.pluginapi import hook_handle
 from mediagoblin.tools.translate import lazy_pass_to_ugettext as _
 
@@ -136,19 +138,15 @@ def type_match_handler(media_file, filename):
     raise TypeNotFound(_('Sorry, I don\'t support that file type :('))
 
 
-def sniff_media(media_file, filename):
-    '''
-    Iterate through the enabled media types and find those suited
-    for a certain file.
-    '''
-    # copy the contents to a .name-enabled temporary file for further checks
-    # TODO: there are cases when copying is not required
-    tmp_media_file = tempfile.NamedTemporaryFile()
-    shutil.copyfileobj(media_file, tmp_media_file)
-    media_file.seek(0)
-    tmp_media_file.seek(0)
+def _is_on_disk(media_file):
+    '''Check if media_file is a file on disk the sniffers can open by .name'''
+    name = getattr(media_file, 'name', None)
+    return isinstance(name, str) and os.path.isfile(name)
+
+
+def _sniff_media(media_file, filename):
     try:
-        return type_match_handler(tmp_media_file, filename)
+        return type_match_handler(media_file, filename)
     except TypeNotFound as e:
         _log.info('No plugins using two-step checking found')
 
@@ -159,5 +157,30 @@ def sniff_media(media_file, filename):
         # again, no luck. Do it expensive way
         _log.info('No media handler found by file extension')
     _log.info('Doing it the expensive way...')
-    return sniff_media_contents(tmp_media_file, filename)
+    return sniff_media_contents(media_file, filename)
+
 
+def sniff_media(media_file, filename):
+    '''
+    Iterate through the enabled media types and find those suited
+    for a certain file.
+
+    Files on disk are checked in place, anything else (like an upload
+    stream) is copied to a temporary file first.
+    '''
+    if isinstance(media_file, FileStorage):
+        media_file = media_file.stream
+
+    if _is_on_disk(media_file):
+        media_file.seek(0)
+        try:
+            return _sniff_media(media_file, filename)
+        finally:
+            media_file.seek(0)
+
+    # copy the contents to a .name-enabled temporary file for further checks
+    with tempfile.NamedTemporaryFile() as tmp_media_file:
+        shutil.copyfileobj(media_file, tmp_media_file)
+        media_file.seek(0)
+        tmp_media_file.seek(0)
+        return _sniff_media(tmp_media_file, filename)
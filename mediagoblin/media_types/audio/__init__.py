@@ -15,6 +15,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from mediagoblin.media_types import MediaManagerBase
+from mediagoblin.media_types.tools import setup_celery
 from mediagoblin.media_types.audio.processing import AudioProcessingManager, \
     sniff_handler
 from mediagoblin.tools import pluginapi
@@ -44,6 +45,7 @@ hooks = {
     'setup': setup_plugin,
     'get_media_type_and_manager': get_media_type_and_manager,
     'sniff_handler': sniff_handler,
+    'celery_setup': setup_celery,
     ('media_manager', MEDIA_TYPE): lambda: AudioMediaManager,
     ('reprocess_manager', MEDIA_TYPE): lambda: AudioProcessingManager,
 }
@@ -44,6 +44,15 @@ SPECTROGRAM_WIDTH_PERSECOND = [(240, (  0,     20)),
 SPECTROGRAM_HEIGHT = 500
 
 class AudioBlocksFFT:
+    """
+    FFT amplitudes of the blocks of an audio file
+
+    The file is read in buffers of many blocks, which are transformed
+    together, so iterating gives 2-D arrays with one row per block.
+    """
+
+    # How many blocks to read and transform at once
+    BLOCKS_PER_READ = 256
 
     def __init__(self, fileName, blockSize, overlap, minFreq, maxFreq, numBins = None, windowFunction = numpy.hanning):
         self.audioData = soundfile.SoundFile(fileName, 'r')
@@ -74,62 +83,89 @@ class AudioBlocksFFT:
         """
         return self.totalSamples / self.sampleRate
 
+    def totalBlocks(self):
+        """
+        Number of blocks the file is split into, the last one possibly
+        padded with zeros
+        """
+        if self.totalSamples <= 0:
+            return 0
+        step = self.blockSize - self.overlap
+        return 1 + -(-max(0, self.totalSamples - self.blockSize) // step)
+
     def _filterFreqRange(self, fftAmplitude):
         """
-        Given a FFT amplitudes array keep only bins between minFreq, maxFreq
+        Given FFT amplitudes arrays, one per row, keep only bins between
+        minFreq, maxFreq
         """
         nyquistFreq = self.sampleRate // 2
-        numBins = len(fftAmplitude)
+        numBins = fftAmplitude.shape[-1]
         sliceWidth = nyquistFreq / numBins
         startIdx = int(self.minFreq / sliceWidth)
         endIdx = int(self.maxFreq / sliceWidth)
         if numBins <= endIdx:
-            fftAmplitude = numpy.pad(fftAmplitude, (0, 1 + endIdx - numBins), 'constant', constant_values=(0))
+            fftAmplitude = numpy.pad(fftAmplitude, ((0, 0), (0, 1 + endIdx - numBins)), 'constant', constant_values=(0))
         else:
-            fftAmplitude = fftAmplitude[:endIdx + 1]
-        return fftAmplitude[startIdx:]
+            fftAmplitude = fftAmplitude[:, :endIdx + 1]
+        return fftAmplitude[:, startIdx:]
 
     def _resizeAmplitudeArray(self, amplitudeValues, newSize):
         """
-        Resize amplitude values array
+        Resize the rows of an amplitude values array
         """
-        if len(amplitudeValues) == newSize:
+        size = amplitudeValues.shape[-1]
+        if size == newSize:
             return amplitudeValues
-        if newSize > len(amplitudeValues):
+        if newSize > size:
             # Resize up
-            result = numpy.zeros(newSize)
-            for idx in range(0, newSize):
-                srcIdx = (idx * len(amplitudeValues)) // newSize
-                result[idx] = amplitudeValues[srcIdx]
-            return result
-        # Resize down keeping peaks
-        result = numpy.zeros(newSize)
-        idx = 0
-        for slice in numpy.array_split(amplitudeValues, newSize):
-            result[idx] = slice.max()
-            idx = idx + 1
-        return result
+            return amplitudeValues[:, (numpy.arange(newSize) * size) // newSize]
+        # Resize down keeping peaks, in the slices numpy.array_split()
+        # would make
+        sliceSize, longSlices = divmod(size, newSize)
+        sliceStarts = numpy.arange(newSize) * sliceSize + numpy.minimum(numpy.arange(newSize), longSlices)
+        return numpy.maximum.reduceat(amplitudeValues, sliceStarts, axis=1)
+
+    def _blocksFFT(self, blocks):
+        """
+        Compute FFT amplitudes of the blocks, one per row
+        """
+        fftAmplitude = self._filterFreqRange(numpy.abs(numpy.fft.rfft(blocks * self.windowValues, axis=1)))
+        self.peakFFTValue = max(self.peakFFTValue, fftAmplitude.max())
+        # Resize if requested
+        if not self.numBins is None:
+            fftAmplitude = self._resizeAmplitudeArray(fftAmplitude, self.numBins)
+        return fftAmplitude
 
     def __iter__(self):
         """
-        Read a block of audio data and compute FFT amplitudes
+        Read buffers of audio data and compute FFT amplitudes of their
+        blocks
         """
+        step = self.blockSize - self.overlap
+        # Mixes all channels down to mono
+        mixDown = numpy.ones(self.numChannels)
         self.audioData.seek(0)
-        for fileBlock in self.audioData.blocks(blocksize = self.blockSize, overlap = self.overlap):
-            # Mix down all channels to mono
-            audioBlock = fileBlock[:,0]
-            for channel in range(1, self.numChannels):
-                audioBlock = numpy.add(audioBlock, fileBlock[:,channel])
-            # On the last block it may be necessary to pad with zeros
-            if len(audioBlock) < self.blockSize:
-                audioBlock = numpy.pad(audioBlock, (0, self.blockSize - len(audioBlock)), 'constant', constant_values=(0))
-            # Compute FFT amplitude of this block
-            fftAmplitude = self._filterFreqRange(numpy.abs(numpy.fft.rfft(audioBlock * self.windowValues)))
-            self.peakFFTValue = max(self.peakFFTValue, fftAmplitude.max())
-            # Resize if requested
-            if not self.numBins is None:
-                fftAmplitude = self._resizeAmplitudeArray(fftAmplitude, self.numBins)
-            yield (fftAmplitude, self.audioData.tell() / self.sampleRate)
+        pending = numpy.zeros(0)
+        firstBlock = True
+        while True:
+            fileData = self.audioData.read(self.BLOCKS_PER_READ * step + self.overlap, always_2d=True)
+            pending = numpy.concatenate((pending, fileData @ mixDown))
+            if len(pending) < self.blockSize:
+                break
+            numBlocks = 1 + (len(pending) - self.blockSize) // step
+            blocks = numpy.lib.stride_tricks.sliding_window_view(pending, self.blockSize)[::step][:numBlocks]
+            pending = pending[numBlocks * step:]
+            firstBlock = False
+            yield (self._blocksFFT(blocks), self.audioData.tell() / self.sampleRate)
+        # What is left are blocks running past the end, which are padded
+        # with zeros, like a file shorter than a block is
+        blocks = []
+        while len(pending) > (0 if firstBlock else self.overlap):
+            blocks.append(numpy.pad(pending[:self.blockSize], (0, self.blockSize - len(pending[:self.blockSize])), 'constant', constant_values=(0)))
+            pending = pending[step:]
+            firstBlock = False
+        if blocks:
+            yield (self._blocksFFT(numpy.array(blocks)), self.audioData.tell() / self.sampleRate)
 
 class SpectrogramColorMap:
 
@@ -155,29 +191,26 @@ class SpectrogramColorMap:
 
     def _buildColorPalette(self):
         """
-        Build color palette
+        Build color palette, as an array of RGB rows
         """
         colorPoints = SPECTROGRAM_COLORS
-        self.colors = []
+        colors = []
         for i in range(1, len(colorPoints)):
             for p in range(0, 200):
-                self.colors.append(self._colorBetween(colorPoints[i - 1], colorPoints[i], p / 200))
+                colors.append(self._colorBetween(colorPoints[i - 1], colorPoints[i], p / 200))
+        self.colors = numpy.array(colors, dtype=numpy.uint8)
 
     def getColorData(self, progressCallback = None):
         """
-        Map spectrogram data to pixel colors
+        Map spectrogram data to pixel colors, as a height x width x RGB
+        array for Image.fromarray
         """
-        pixels = [self.colors[0]] * (self.width * self.height)
-        for x in range(0, self.width):
-            for y in range(0, self.height):
-                idx = x + self.width * y
-                amplitudeVal = self.columnData[x][self.height - y - 1]
-                colorIdx = int(len(self.colors) * amplitudeVal)
-                colorIdx = colorIdx if colorIdx > 0 else 0
-                colorIdx = colorIdx if colorIdx < len(self.colors) else len(self.colors) - 1
-                pixels[idx] = self.colors[colorIdx]
-            if progressCallback:
-                progressCallback(100 * x / self.width)
+        # One row per frequency, the highest on top
+        amplitudes = numpy.asarray(self.columnData).T[::-1]
+        colorIdx = (len(self.colors) * amplitudes).astype(numpy.intp)
+        pixels = self.colors[colorIdx.clip(0, len(self.colors) - 1)]
+        if progressCallback:
+            progressCallback(100)
         return pixels
 
 def drawSpectrogram(audioFileName, imageFileName, fftSize = 1024, fftOverlap = 0, progressCallback = None):
@@ -210,27 +243,13 @@ def drawSpectrogram(audioFileName, imageFileName, fftSize = 1024, fftOverlap = 0
     imageWidthLookup = SPECTROGRAM_WIDTH_PERSECOND
     imageHeight = SPECTROGRAM_HEIGHT
 
-    # Load audio file and compute FFT amplitudes
+    # Load audio file
     fftBlocksSource = AudioBlocksFFT(audioFileName,
                                      fftSize, overlap = fftOverlap,
                                      minFreq = SPECTROGRAM_MIN_FREQUENCY, maxFreq = SPECTROGRAM_MAX_FREQUENCY,
                                      numBins = imageHeight)
     soundLength = fftBlocksSource.totalSeconds()
-    fftAmplitudeBlocks = []
-    for fftAmplitude, positionSeconds in fftBlocksSource:
-        fftAmplitudeBlocks.append(fftAmplitude)
-        wrapProgressCallback(STEP_PERCENTAGE_FFT * (positionSeconds / soundLength))
-
-    totalProgress = STEP_PERCENTAGE_FFT
-
-    # Normalize FFT amplitude and convert to log scale
-    specRange = SPECTROGRAM_DB_RANGE
-    for i in range(0, len(fftAmplitudeBlocks)):
-        normalized = numpy.divide(fftAmplitudeBlocks[i], fftBlocksSource.peakFFTAmplitude())
-        fftAmplitudeBlocks[i] = ((20*(numpy.log10(normalized + 1e-60))).clip(-specRange, 0.0) + specRange)/specRange
-        wrapProgressCallback(totalProgress + STEP_PERCENTAGE_NORMALIZE * (i / len(fftAmplitudeBlocks)))
-
-    totalProgress = totalProgress + STEP_PERCENTAGE_NORMALIZE
+    numBlocks = max(fftBlocksSource.totalBlocks(), 1)
 
     # Compute spectrogram width in pixels
     imageWidthPerSecond, lengthRage = imageWidthLookup[-1]
@@ -241,22 +260,44 @@ def drawSpectrogram(audioFileName, imageFileName, fftSize = 1024, fftOverlap = 0
             break
     imageWidth = int(imageWidthPerSecond * soundLength)
 
-    # Compute spectrogram values
-    columnValues = numpy.zeros(imageHeight)
+    # Compute FFT amplitudes, keeping the peak of the blocks falling in
+    # each column as they come
     spectrogram = []
-    x = 0
-    for idx in range(0, len(fftAmplitudeBlocks)):
-        newX = (idx * imageWidth) // len(fftAmplitudeBlocks)
-        if newX != x:
-            # Save column
-            spectrogram.append(numpy.copy(columnValues))
-            x = newX
-            columnValues.fill(0)
-        columnValues = numpy.maximum(columnValues, fftAmplitudeBlocks[idx])
-        wrapProgressCallback(totalProgress + STEP_PERCENTAGE_ACCUMULATE * (idx / len(fftAmplitudeBlocks)))
-    spectrogram.append(numpy.copy(columnValues))
-
-    totalProgress = totalProgress + STEP_PERCENTAGE_ACCUMULATE
+    columnValues = None
+    column = 0
+    blockIdx = 0
+    for fftAmplitude, positionSeconds in fftBlocksSource:
+        blockColumns = numpy.minimum(
+            (numpy.arange(blockIdx, blockIdx + len(fftAmplitude)) * imageWidth) // numBlocks,
+            max(imageWidth - 1, 0))
+        blockIdx = blockIdx + len(fftAmplitude)
+        columnStarts = numpy.concatenate(([0], numpy.flatnonzero(numpy.diff(blockColumns)) + 1))
+        columnPeaks = numpy.maximum.reduceat(fftAmplitude, columnStarts, axis=0)
+        if columnValues is not None:
+            if blockColumns[0] == column:
+                columnPeaks[0] = numpy.maximum(columnPeaks[0], columnValues)
+            else:
+                spectrogram.append(columnValues)
+        spectrogram.extend(columnPeaks[:-1])
+        columnValues = columnPeaks[-1]
+        column = blockColumns[-1]
+        wrapProgressCallback((STEP_PERCENTAGE_FFT + STEP_PERCENTAGE_ACCUMULATE) * (positionSeconds / soundLength))
+    if columnValues is not None:
+        spectrogram.append(columnValues)
+    else:
+        spectrogram.append(numpy.zeros(imageHeight))
+
+    totalProgress = STEP_PERCENTAGE_FFT + STEP_PERCENTAGE_ACCUMULATE
+
+    # Normalize FFT amplitude and convert to log scale
+    specRange = SPECTROGRAM_DB_RANGE
+    spectrogram = numpy.array(spectrogram)
+    peak = fftBlocksSource.peakFFTAmplitude()
+    normalized = numpy.divide(spectrogram, peak) if peak else spectrogram
+    spectrogram = ((20*(numpy.log10(normalized + 1e-60))).clip(-specRange, 0.0) + specRange)/specRange
+
+    totalProgress = totalProgress + STEP_PERCENTAGE_NORMALIZE
+    wrapProgressCallback(totalProgress)
 
     # Draw spectrogram
     imageWidth = len(spectrogram)
@@ -265,8 +306,7 @@ def drawSpectrogram(audioFileName, imageFileName, fftSize = 1024, fftOverlap = 0
     totalProgress = totalProgress + STEP_PERCENTAGE_DRAW
 
     # Save final image
-    image = Image.new('RGB', (imageWidth, imageHeight))
-    image.putdata(colorData)
+    image = Image.fromarray(colorData, 'RGB')
     image.save(imageFileName)
 
     if progressCallback:
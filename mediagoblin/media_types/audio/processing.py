@@ -27,6 +27,7 @@ from mediagoblin.processing import (
 
 from mediagoblin.media_types.audio.transcoders import (
     AudioTranscoder, AudioThumbnailer)
+from mediagoblin.media_types.audio.waveform import write_waveform
 from mediagoblin.media_types.tools import discover
 
 _log = logging.getLogger(__name__)
@@ -68,6 +69,9 @@ class CommonAudioProcessor(MediaProcessor):
         self.transcoder = AudioTranscoder()
         self.thumbnailer = AudioThumbnailer()
 
+        # OGG copy of the audio for soundfile, made when first needed
+        self.ogg_source = None
+
     def copy_original(self):
         if self.audio_config['keep_original']:
             copy_original(
@@ -103,6 +107,9 @@ class CommonAudioProcessor(MediaProcessor):
         elif keyname == 'thumb':
             if kwargs.get('size') != file_metadata.get('size'):
                 skip = False
+        elif keyname == 'waveform':
+            if kwargs.get('widths') != file_metadata.get('widths'):
+                skip = False
 
         return skip
 
@@ -123,6 +130,7 @@ class CommonAudioProcessor(MediaProcessor):
             webm_audio_tmp,
             quality=quality,
             progress_callback=progress_callback)
+        progress_callback.flush()
 
         self._keep_best()
 
@@ -132,6 +140,18 @@ class CommonAudioProcessor(MediaProcessor):
 
         self.entry.set_file_metadata('webm_audio', **{'quality': quality})
 
+    def get_ogg_source(self):
+        """
+        Transcode the audio to an OGG file soundfile can read, once
+        """
+        if self.ogg_source is None:
+            self.ogg_source = os.path.join(
+                self.workbench.dir, self.name_builder.fill('{basename}.ogg'))
+            _log.info('Creating OGG source for spectrogram and waveform')
+            self.transcoder.transcode(self.process_filename, self.ogg_source,
+                                      mux_name='oggmux')
+        return self.ogg_source
+
     def create_spectrogram(self, max_width=None, fft_size=None):
         if not max_width:
             max_width = mgg.global_config['media:medium']['max_width']
@@ -141,11 +161,7 @@ class CommonAudioProcessor(MediaProcessor):
         if self._skip_processing('spectrogram', max_width=max_width,
                                  fft_size=fft_size):
             return
-        wav_tmp = os.path.join(self.workbench.dir, self.name_builder.fill(
-            '{basename}.ogg'))
-        _log.info('Creating OGG source for spectrogram')
-        self.transcoder.transcode(self.process_filename, wav_tmp,
-                                  mux_name='oggmux')
+        wav_tmp = self.get_ogg_source()
         spectrogram_tmp = os.path.join(self.workbench.dir,
                                        self.name_builder.fill(
                                            '{basename}-spectrogram.jpg'))
@@ -163,6 +179,33 @@ class CommonAudioProcessor(MediaProcessor):
                          'fft_size': fft_size}
         self.entry.set_file_metadata('spectrogram', **file_metadata)
 
+    def create_waveform(self, widths=None):
+        """
+        Store the min/max peaks of the audio at a few zoom levels, for
+        players to draw a waveform with
+        """
+        if not widths:
+            widths = self.audio_config['waveform_widths']
+        if not widths:
+            return
+        widths = list(widths)
+
+        if self._skip_processing('waveform', widths=widths):
+            return
+
+        waveform_tmp = os.path.join(self.workbench.dir, self.name_builder.fill(
+            '{basename}-waveform.json'))
+        waveform = write_waveform(self.get_ogg_source(), waveform_tmp, widths)
+
+        _log.debug('Saving waveform...')
+        store_public(self.entry, 'waveform', waveform_tmp,
+                     self.name_builder.fill('{basename}.waveform.json'))
+
+        self.entry.set_file_metadata('waveform', **{
+            'widths': widths,
+            'samples_per_pixel': [
+                level['samples_per_pixel'] for level in waveform['levels']]})
+
     def generate_thumb(self, size=None):
         if not size:
             max_width = mgg.global_config['media:thumb']['max_width']
@@ -257,6 +300,7 @@ class InitialProcessor(CommonAudioProcessor):
 
         self.create_spectrogram(max_width=medium_width, fft_size=fft_size)
         self.generate_thumb(size=thumb_size)
+        self.create_waveform()
 
         self.delete_queue_file()
 
@@ -266,7 +310,7 @@ class Resizer(CommonAudioProcessor):
     Thumbnail and spectogram resizing process steps for processed audio
     """
     name = 'resize'
-    description = 'Resize thumbnail or spectogram'
+    description = 'Resize thumbnail, spectogram or waveform'
     thumb_size = 'thumb_size'
 
     @classmethod
@@ -301,25 +345,34 @@ class Resizer(CommonAudioProcessor):
             type=int,
             help='The width of the spectogram')
 
+        parser.add_argument(
+            '--waveform_widths',
+            nargs='+',
+            type=int,
+            help='The most peaks of each waveform zoom level')
+
         parser.add_argument(
             'file',
-            choices=['thumb', 'spectrogram'])
+            choices=['thumb', 'spectrogram', 'waveform'])
 
         return parser
 
     @classmethod
     def args_to_request(cls, args):
         return request_from_args(
-            args, ['thumb_size', 'file', 'fft_size', 'medium_width'])
+            args, ['thumb_size', 'file', 'fft_size', 'medium_width',
+                   'waveform_widths'])
 
     def process(self, file, thumb_size=None, fft_size=None,
-                medium_width=None):
+                medium_width=None, waveform_widths=None):
         self.common_setup()
 
         if file == 'thumb':
             self.generate_thumb(size=thumb_size)
         elif file == 'spectrogram':
             self.create_spectrogram(max_width=medium_width, fft_size=fft_size)
+        elif file == 'waveform':
+            self.create_waveform(widths=waveform_widths)
 
 
 class Transcoder(CommonAudioProcessor):
@@ -38,10 +38,10 @@ except ImportError:
 # uncomment this to get a lot of logs from gst
 # import os;os.environ['GST_DEBUG'] = '5,python:5'
 
-import gi
-gi.require_version('Gst', '1.0')
-from gi.repository import GObject, Gst
-Gst.init(None)
+from mediagoblin.media_types.tools import get_gst_runtime
+
+_gst = get_gst_runtime()
+GLib, Gst = _gst.GLib, _gst.Gst
 
 class Python3AudioThumbnailer:
     def __init__(self):
@@ -88,7 +88,7 @@ class AudioTranscoder:
         _log.info(f'Initializing {self.__class__.__name__}')
 
         # Instantiate MainLoop
-        self._loop = GObject.MainLoop()
+        self._loop = GLib.MainLoop()
         self._failed = None
 
     def transcode(self, src, dst, mux_name='webmmux',quality=0.3,
@@ -168,7 +168,7 @@ class AudioTranscoder:
             self.pipeline.set_state(Gst.State.NULL)
             del self.pipeline
         _log.info('Quitting MainLoop gracefully...')
-        GObject.idle_add(self._loop.quit)
+        GLib.idle_add(self._loop.quit)
 
 if __name__ == '__main__':
     import sys
@@ -0,0 +1,96 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+import math
+
+import numpy
+import soundfile
+
+# Peaks are stored as signed 8 bit values
+WAVEFORM_BITS = 8
+WAVEFORM_SCALE = 2 ** (WAVEFORM_BITS - 1) - 1
+
+# How many frames to read at once, in peaks of the finest zoom level
+PEAKS_PER_READ = 1024
+
+
+def waveform_peaks(filename, widths):
+    """
+    Compute min/max peaks of an audio file at several zoom levels
+
+    Each of the widths is the most peaks a zoom level may have.  The file
+    is read once, for the finest level, and the coarser levels are made
+    from that one, so their samples_per_pixel are multiples of it.
+
+    Returns a dict in the style of audiowaveform's JSON output, with one
+    entry in 'levels' for each width, finest first:
+
+        {'version': 2, 'channels': 1, 'sample_rate': 44100, 'bits': 8,
+         'levels': [{'samples_per_pixel': 512, 'length': 1000,
+                     'data': [min0, max0, min1, max1, ...]}, ...]}
+    """
+    widths = sorted(set(widths), reverse=True)
+    with soundfile.SoundFile(filename, 'r') as audio:
+        frames = audio.frames
+        finest_spp = max(1, math.ceil(frames / widths[0]))
+
+        mins = []
+        maxs = []
+        # Mixes all channels down to mono
+        mix_down = numpy.full(audio.channels, 1 / audio.channels)
+        for block in audio.blocks(blocksize=finest_spp * PEAKS_PER_READ,
+                                  always_2d=True):
+            mono = block @ mix_down
+            starts = numpy.arange(0, len(mono), finest_spp)
+            mins.append(numpy.minimum.reduceat(mono, starts))
+            maxs.append(numpy.maximum.reduceat(mono, starts))
+
+        waveform = {
+            'version': 2,
+            'channels': 1,
+            'sample_rate': audio.samplerate,
+            'bits': WAVEFORM_BITS,
+            'levels': []}
+
+    mins = numpy.concatenate(mins) if mins else numpy.zeros(0)
+    maxs = numpy.concatenate(maxs) if maxs else numpy.zeros(0)
+    for width in widths:
+        factor = max(1, math.ceil(widths[0] / width))
+        starts = numpy.arange(0, len(mins), factor)
+        if len(mins):
+            level_mins = numpy.minimum.reduceat(mins, starts)
+            level_maxs = numpy.maximum.reduceat(maxs, starts)
+        else:
+            level_mins = level_maxs = mins
+        data = numpy.empty(2 * len(starts), dtype=int)
+        data[0::2] = numpy.round(level_mins.clip(-1, 1) * WAVEFORM_SCALE)
+        data[1::2] = numpy.round(level_maxs.clip(-1, 1) * WAVEFORM_SCALE)
+        waveform['levels'].append({
+            'samples_per_pixel': finest_spp * factor,
+            'length': len(starts),
+            'data': data.tolist()})
+
+    return waveform
+
+
+def write_waveform(filename, dest, widths):
+    """ Write the waveform_peaks() of filename to dest, as JSON """
+    waveform = waveform_peaks(filename, widths)
+    with open(dest, 'w') as f:
+        json.dump(waveform, f, separators=(',', ':'))
+    return waveform
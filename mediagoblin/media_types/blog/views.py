@@ -37,6 +37,7 @@ from mediagoblin.tools.text import (
     cleaned_markdown_conversion)
 
 from mediagoblin.db.models import MediaEntry, LocalUser
+from mediagoblin.db.util import with_gallery_loading
 
 from mediagoblin.notifications import add_comment_subscription
 
@@ -232,7 +233,9 @@ def blog_dashboard(request, page, url_user=None):
             if not blog:
                 return render_404(request)
             else:
-                blog_posts_list = blog.get_all_blog_posts().order_by(MediaEntry.created.desc())
+                blog_posts_list = with_gallery_loading(
+                    blog.get_all_blog_posts().order_by(
+                        MediaEntry.created.desc()))
                 pagination = Pagination(page, blog_posts_list)
                 pagination.per_page = 15
                 blog_posts_on_a_page = pagination()
@@ -269,7 +272,9 @@ def blog_post_listing(request, page, url_user=None):
     if not blog:
         return render_404(request)
 
-    all_blog_posts = blog.get_all_blog_posts('processed').order_by(MediaEntry.created.desc())
+    all_blog_posts = with_gallery_loading(
+        blog.get_all_blog_posts('processed').order_by(
+            MediaEntry.created.desc()))
     pagination = Pagination(page, all_blog_posts)
     pagination.per_page = 8
     blog_posts_on_a_page = pagination()
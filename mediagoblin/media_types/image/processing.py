@@ -19,9 +19,15 @@ try:
     from PIL import Image
 except ImportError:
     import Image
+try:
+    # Teaches PIL to write AVIF, if it's installed
+    import pillow_avif
+except ImportError:
+    pass
 import os
 import logging
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 
 from mediagoblin import mg_globals as mgg
 from mediagoblin.db.models import Location
@@ -44,81 +50,89 @@ PIL_FILTERS = {
 
 MEDIA_TYPE = 'mediagoblin.media_types.image'
 
+# The extra formats derivatives can be stored in: PIL format, extension
+DERIVATIVE_FORMATS = {
+    'webp': ('WEBP', '.webp'),
+    'avif': ('AVIF', '.avif'),
+    'jpeg': ('JPEG', '.jpg')}
+
 
-def resize_image(entry, resized, keyname, target_name, new_size,
-                 exif_tags, workdir, quality, filter):
+def open_image(filename, exif_tags, draft_size=None):
     """
-    Store a resized version of an image and return its pathname.
-
-    Arguments:
-    proc_state -- the processing state for the image to resize
-    resized -- an image from Image.open() of the original image being resized
-    keyname -- Under what key to save in the db.
-    target_name -- public file path for the new resized image
-    exif_tags -- EXIF data for the original image
-    workdir -- directory path for storing converted image files
-    new_size -- 2-tuple size for the resized image
-    quality -- level of compression used when resizing images
-    filter -- One of BICUBIC, BILINEAR, NEAREST, ANTIALIAS
+    Decode an image, the right way up, for making smaller versions of it
+
+    JPEGs are decoded at the smallest scale at which they're still at
+    least draft_size, which is a lot quicker than decoding them at full
+    size.
+
+    Returns the image and the size of the file as stored.
     """
-    resized = exif_fix_image_orientation(resized, exif_tags)  # Fix orientation
+    try:
+        im = Image.open(filename)
+        stored_size = im.size
+        if draft_size and im.format == 'JPEG':
+            im.draft(im.mode, draft_size)
+        im.load()
+    except OSError:
+        raise BadMediaFail()
+
+    return exif_fix_image_orientation(im, exif_tags), stored_size
 
+
+def get_resize_filter(filter):
     try:
-        resize_filter = PIL_FILTERS[filter.upper()]
+        return PIL_FILTERS[filter.upper()]
     except KeyError:
         raise Exception('Filter "{}" not found, choose one of {}'.format(
             str(filter),
             ', '.join(PIL_FILTERS.keys())))
 
-    resized.thumbnail(new_size, resize_filter)
-
-    # Copy the new file to the conversion subdir, then remotely.
-    tmp_resized_filename = os.path.join(workdir, target_name)
-    resized.save(tmp_resized_filename, quality=quality)
-    store_public(entry, keyname, tmp_resized_filename, target_name)
-
-    # store the thumb/medium info
-    image_info = {'width': new_size[0],
-                  'height': new_size[1],
-                  'quality': quality,
-                  'filter': filter}
-
-    entry.set_file_metadata(keyname, **image_info)
-
-
-def resize_tool(entry,
-                force, keyname, orig_file, target_name,
-                conversions_subdir, exif_tags, quality, filter, new_size=None):
-    # Use the default size if new_size was not given
-    if not new_size:
-        max_width = mgg.global_config['media:' + keyname]['max_width']
-        max_height = mgg.global_config['media:' + keyname]['max_height']
-        new_size = (max_width, max_height)
-
-    # If thumb or medium is already the same quality and size, then don't
-    # reprocess
-    if _skip_resizing(entry, keyname, new_size, quality, filter):
-        _log.info('{} of same size and quality already in use, skipping '
-                  'resizing of media {}.'.format(keyname, entry.id))
-        return
-
-    # If the size of the original file exceeds the specified size for the desized
-    # file, a target_name file is created and later associated with the media
-    # entry.
-    # Also created if the file needs rotation, or if forced.
-    try:
-        im = Image.open(orig_file)
-    except OSError:
-        raise BadMediaFail()
-    if force \
-        or im.size[0] > new_size[0]\
-        or im.size[1] > new_size[1]\
-        or exif_image_needs_rotation(exif_tags):
-        resize_image(
-            entry, im, str(keyname), target_name,
-            tuple(new_size),
-            exif_tags, conversions_subdir,
-            quality, filter)
+
+def get_derivative_formats(names):
+    """
+    The names of the DERIVATIVE_FORMATS in names which PIL can write
+    """
+    Image.init()
+    formats = []
+    for name in names:
+        name = name.lower()
+        if name not in DERIVATIVE_FORMATS:
+            _log.warning(f'Unknown derivative format {name!r}, skipping')
+        elif DERIVATIVE_FORMATS[name][0] not in Image.SAVE:
+            _log.warning(f'PIL can not write {name}, skipping')
+        else:
+            formats.append(name)
+    return formats
+
+
+def get_image_format(filename):
+    """ The PIL format a file's extension stands for, or None """
+    Image.init()
+    return Image.registered_extensions().get(
+        os.path.splitext(filename)[1].lower())
+
+
+def encode_image(im, filename, quality, format=None, progressive=False):
+    """
+    Save im to filename, in format or the one the extension asks for
+
+    JPEGs are made progressive if asked to.
+    """
+    format = format or get_image_format(filename)
+    options = {'quality': quality}
+    if format == 'JPEG':
+        if progressive:
+            options.update(progressive=True, optimize=True)
+        if im.mode not in ('RGB', 'L', 'CMYK'):
+            im = im.convert('RGB')
+    elif format in ('WEBP', 'AVIF') and im.mode not in ('RGB', 'RGBA'):
+        im = im.convert('RGBA' if im.mode in ('LA', 'P', 'PA') else 'RGB')
+    im.save(filename, format=format, **options)
+    return filename
+
+
+def has_transparency(im):
+    return im.mode in ('RGBA', 'LA', 'PA') or 'transparency' in im.info
 
 
 def _skip_resizing(entry, keyname, size, quality, filter):
@@ -193,28 +207,144 @@ class CommonImageProcessor(MediaProcessor):
         # Exif extraction
         self.exif_tags = extract_exif(self.process_filename)
 
+        # Derivatives asked for, made by store_derivatives()
+        self.derivatives = []
+        self.derivative_formats = get_derivative_formats(
+            self.image_config['derivative_formats'])
+
     def generate_medium_if_applicable(self, size=None, quality=None,
                                       filter=None):
-        if not quality:
-            quality = self.image_config['quality']
-        if not filter:
-            filter = self.image_config['resize_filter']
-
-        resize_tool(self.entry, False, 'medium', self.process_filename,
-                    self.name_builder.fill('{basename}.medium{ext}'),
-                    self.conversions_subdir, self.exif_tags, quality,
-                    filter, size)
+        self.add_derivative(
+            'medium', self.name_builder.fill('{basename}.medium{ext}'),
+            size, quality, filter, force=False)
 
     def generate_thumb(self, size=None, quality=None, filter=None):
+        self.add_derivative(
+            'thumb', self.name_builder.fill('{basename}.thumbnail{ext}'),
+            size, quality, filter, force=True)
+
+    def generate_scaled_versions(self, quality=None, filter=None):
+        """
+        Ask for the extra sizes of the image browsers can choose from
+        """
+        for size in self.image_config['srcset_sizes']:
+            self.add_derivative(
+                f'scaled_{size}',
+                self.name_builder.fill('{basename}.%d{ext}' % size),
+                (size, size), quality, filter, force=False)
+
+    def add_derivative(self, keyname, target_name, size=None, quality=None,
+                       filter=None, force=False):
+        """
+        Ask for a scaled down version of the image, stored under keyname
+
+        Unless forced it's only made if the image is bigger than size or
+        needs to be rotated.
+        """
         if not quality:
             quality = self.image_config['quality']
         if not filter:
             filter = self.image_config['resize_filter']
+        # Use the default size if size was not given
+        if not size:
+            size = (mgg.global_config['media:' + keyname]['max_width'],
+                    mgg.global_config['media:' + keyname]['max_height'])
+        size = tuple(size)
+        get_resize_filter(filter)
+
+        # If thumb or medium is already the same quality and size, then
+        # don't reprocess
+        if _skip_resizing(self.entry, keyname, size, quality, filter):
+            _log.info('{} of same size and quality already in use, skipping '
+                      'resizing of media {}.'.format(keyname, self.entry.id))
+            return
+
+        self.derivatives.append(
+            (keyname, target_name, size, quality, filter, force))
+
+    def store_derivatives(self):
+        """
+        Make and store the derivatives asked for
 
-        resize_tool(self.entry, True, 'thumb', self.process_filename,
-                    self.name_builder.fill('{basename}.thumbnail{ext}'),
-                    self.conversions_subdir, self.exif_tags, quality,
-                    filter, size)
+        The image is decoded only once, at a reduced scale where that is
+        good enough, and each derivative is scaled down from the next
+        bigger one rather than from the original.  PIL lets go of the GIL
+        while encoding, so the derivatives are encoded in parallel.
+
+        Every derivative is also stored in each of the derivative_formats,
+        as <keyname>_<format>.
+        """
+        derivatives, self.derivatives = self.derivatives, []
+        if not derivatives:
+            return
+
+        # Biggest first, so the smaller ones can be made from them.  Twice
+        # the biggest size is what PIL's own thumbnail() would draft to,
+        # square as the image may still be turned on its side.
+        derivatives.sort(key=lambda d: d[2][0] * d[2][1], reverse=True)
+        draft = max(derivatives[0][2]) * 2
+        decoded, stored_size = open_image(
+            self.process_filename, self.exif_tags, (draft, draft))
+        needs_rotation = exif_image_needs_rotation(self.exif_tags)
+
+        progressive = self.image_config['progressive_jpeg']
+        source_format = get_image_format(self.process_filename)
+        formats = [
+            name for name in self.derivative_formats
+            if DERIVATIVE_FORMATS[name][0] != source_format
+            and not (DERIVATIVE_FORMATS[name][0] == 'JPEG'
+                     and has_transparency(decoded))]
+
+        encoded = []
+        with ThreadPoolExecutor(max_workers=len(derivatives)) as pool:
+            source, source_size = decoded, None
+            for keyname, target_name, size, quality, filter, force in \
+                    derivatives:
+                if not (force
+                        or stored_size[0] > size[0]
+                        or stored_size[1] > size[1]
+                        or needs_rotation):
+                    continue
+
+                if source_size is None or source_size[0] < size[0] \
+                        or source_size[1] < size[1]:
+                    source = decoded
+                resized = source.copy()
+                resized.thumbnail(size, get_resize_filter(filter))
+                source, source_size = resized, size
+
+                # Copy the new files to the conversion subdir, then
+                # remotely.
+                variants = [(keyname, target_name, source_format)]
+                for name in formats:
+                    format, ext = DERIVATIVE_FORMATS[name]
+                    variants.append((
+                        f'{keyname}_{name}',
+                        os.path.splitext(target_name)[0] + ext,
+                        format))
+                for variant, variant_name, format in variants:
+                    # Saving keeps its options on the image, so every
+                    # encoder gets an image of its own
+                    future = pool.submit(
+                        encode_image, resized.copy(),
+                        os.path.join(self.conversions_subdir, variant_name),
+                        quality, format, progressive)
+                    encoded.append((
+                        variant, variant_name, future,
+                        # store the thumb/medium info
+                        {'width': size[0],
+                         'height': size[1],
+                         'quality': quality,
+                         'filter': filter,
+                         'scaled_width': resized.size[0],
+                         'scaled_height': resized.size[1],
+                         'mimetype': Image.MIME.get(format),
+                         'variant_of': keyname}))
+
+            for keyname, target_name, future, image_info in encoded:
+                store_public(self.entry, keyname, future.result(),
+                             target_name)
+                self.entry.set_file_metadata(keyname, **image_info)
 
     def copy_original(self):
         copy_original(
@@ -235,15 +365,16 @@ class CommonImageProcessor(MediaProcessor):
         if len(exif_all):
             self.entry.media_data_init(exif_all=exif_all)
 
-        # Extract file metadata
+        # Extract file metadata, which only needs the image header
         try:
-            im = Image.open(self.process_filename)
+            with Image.open(self.process_filename) as im:
+                width, height = im.size
         except OSError:
             raise BadMediaFail()
 
         metadata = {
-            "width": im.size[0],
-            "height": im.size[1],
+            "width": width,
+            "height": height,
         }
 
         self.entry.set_file_metadata(file, **metadata)
@@ -312,6 +443,8 @@ class InitialProcessor(CommonImageProcessor):
         self.generate_medium_if_applicable(size=size, filter=filter,
                                            quality=quality)
         self.generate_thumb(size=thumb_size, filter=filter, quality=quality)
+        self.generate_scaled_versions(filter=filter, quality=quality)
+        self.store_derivatives()
         self.copy_original()
         self.extract_metadata('original')
         self.delete_queue_file()
@@ -380,6 +513,7 @@ class Resizer(CommonImageProcessor):
                                               quality=quality)
         elif file == 'thumb':
             self.generate_thumb(size=size, filter=filter, quality=quality)
+        self.store_derivatives()
 
         self.extract_metadata(file)
 
@@ -13,7 +13,15 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import datetime
+import hashlib
+import json
 import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
 
 from mediagoblin import mg_globals
 
@@ -27,20 +35,322 @@ def media_type_warning():
                      ' to plugins to continue using them.')
 
 
+# Discovery summaries of the last files discovered in this process
+DISCOVERY_CACHE_SIZE = 32
+_discovery_cache = OrderedDict()
+
+# How long discovery summaries are kept on disk
+DISCOVERY_CACHE_LIFETIME = datetime.timedelta(days=1)
+
+
+class DiscoveredTags:
+    """
+    The tags of a discovery summary, as far as GstTagList is used
+    """
+    def __init__(self, tags):
+        self.tags = tags
+
+    def get_string(self, tag):
+        value = self.tags.get(tag)
+        if isinstance(value, str):
+            return (True, value)
+        return (False, None)
+
+    def get_value_index(self, tag, index):
+        return self.tags[tag]
+
+    def foreach(self, func):
+        for tag in list(self.tags):
+            func(self, tag)
+
+
+class DiscoveredStream:
+    """
+    A stream of a discovery summary, in place of a DiscovererStreamInfo
+
+    Has a get_<field>() for each of the STREAM_FIELDS of its kind.
+    """
+    STREAM_FIELDS = {
+        'video': ('width', 'height', 'bitrate', 'depth',
+                  'framerate_num', 'framerate_denom'),
+        'audio': ('channels', 'bitrate', 'depth', 'language',
+                  'sample_rate')}
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def __getattr__(self, name):
+        if name.startswith('get_') and name[4:] in self.stream:
+            return lambda: self.stream[name[4:]]
+        raise AttributeError(name)
+
+    def get_tags(self):
+        return DiscoveredTags(self.stream['tags']) \
+            if self.stream['tags'] else None
+
+
+class DiscoveredInfo:
+    """
+    A summary of a successful discovery, in place of a DiscovererInfo
+
+    It only holds plain values, so it can be stored as JSON and shared by
+    every step processing the same file.
+    """
+    def __init__(self, summary):
+        self.summary = summary
+
+    def get_result(self):
+        return 0
+
+    def get_duration(self):
+        return self.summary['duration']
+
+    def get_tags(self):
+        return DiscoveredTags(self.summary['tags']) \
+            if self.summary['tags'] else None
+
+    def get_video_streams(self):
+        return [DiscoveredStream(s) for s in self.summary['video']]
+
+    def get_audio_streams(self):
+        return [DiscoveredStream(s) for s in self.summary['audio']]
+
+
+def _summarize_tags(taglist):
+    if not taglist:
+        return {}
+    tags = {}
+
+    def add_tag(taglist, tag):
+        value = taglist.get_value_index(tag, 0)
+        if hasattr(value, 'get_year'):
+            # GstDateTime
+            try:
+                value = datetime.datetime(
+                    value.get_year(), value.get_month(), value.get_day(),
+                    value.get_hour(), value.get_minute(),
+                    value.get_second(), value.get_microsecond()).isoformat()
+            except Exception:
+                value = None
+        elif hasattr(value, 'year') and hasattr(value, 'day'):
+            # GDate
+            value = f'{value.year}-{value.month}-{value.day}'
+        # only values json can store are kept
+        if isinstance(value, (str, int, float, bool, type(None))):
+            tags[tag] = value
+
+    taglist.foreach(add_tag)
+    return tags
+
+
+def summarize_discovery(info):
+    """
+    Turn a successful DiscovererInfo into a dict of plain values
+    """
+    return {
+        'duration': info.get_duration(),
+        'tags': _summarize_tags(info.get_tags()),
+        'video': [
+            dict({field: getattr(stream, 'get_' + field)()
+                  for field in DiscoveredStream.STREAM_FIELDS['video']},
+                 tags=_summarize_tags(stream.get_tags()))
+            for stream in info.get_video_streams()],
+        'audio': [
+            dict({field: getattr(stream, 'get_' + field)()
+                  for field in DiscoveredStream.STREAM_FIELDS['audio']},
+                 tags=_summarize_tags(stream.get_tags()))
+            for stream in info.get_audio_streams()]}
+
+
+def _discovery_cache_dir():
+    if mg_globals.workbench_manager is None:
+        return None
+    return os.path.join(
+        mg_globals.workbench_manager.base_workbench_dir, 'discovery')
+
+
+def _discovery_cache_key(src):
+    try:
+        stat = os.stat(src)
+    except OSError:
+        return None
+    return hashlib.sha1('\0'.join(
+        [os.path.abspath(src), str(stat.st_size),
+         str(stat.st_mtime_ns)]).encode('utf-8')).hexdigest()
+
+
+def _read_cached_discovery(key):
+    if key in _discovery_cache:
+        _discovery_cache.move_to_end(key)
+        return _discovery_cache[key]
+    cache_dir = _discovery_cache_dir()
+    if cache_dir is None:
+        return None
+    try:
+        with open(os.path.join(cache_dir, key + '.json')) as f:
+            summary = json.load(f)
+    except (OSError, ValueError):
+        return None
+    _cache_discovery(key, summary, write=False)
+    return summary
+
+
+def _cache_discovery(key, summary, write=True):
+    _discovery_cache[key] = summary
+    while len(_discovery_cache) > DISCOVERY_CACHE_SIZE:
+        _discovery_cache.popitem(last=False)
+    cache_dir = _discovery_cache_dir()
+    if not write or cache_dir is None:
+        return
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Written under another name first, so other workers never read
+        # half of it
+        tmp_path = os.path.join(cache_dir, f'{key}.{os.getpid()}.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(summary, f)
+        os.replace(tmp_path, os.path.join(cache_dir, key + '.json'))
+    except OSError as exc:
+        _log.warning(f'Could not cache discovery: {exc}')
+
+
+def expire_discovery_cache():
+    """
+    Delete the discovery summaries kept on disk longer than
+    DISCOVERY_CACHE_LIFETIME
+    """
+    cache_dir = _discovery_cache_dir()
+    if cache_dir is None or not os.path.isdir(cache_dir):
+        return
+    expired = time.time() - DISCOVERY_CACHE_LIFETIME.total_seconds()
+    for filename in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, filename)
+        try:
+            if os.path.getmtime(path) < expired:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+class GstRuntime:
+    '''
+    GStreamer, initialized once for the process by get_gst_runtime()
+
+    Has the GLib, Gst and GstPbutils modules as attributes, and keeps a
+    Discoverer and pipeline templates for each thread to reuse, as neither
+    is safe to share between threads.
+    '''
+    def __init__(self):
+        # GStreamer might be not installed, so it should not be initialized
+        # on import, or an exception will be raised.
+        import gi
+        gi.require_version('Gst', '1.0')
+        gi.require_version('GstPbutils', '1.0')
+
+        # Keep GStreamer off the command line arguments
+        old_argv = sys.argv
+        sys.argv = []
+        try:
+            from gi.repository import GLib, Gst
+            Gst.init(None)
+            # init before import to work around https://bugzilla.gnome.org/show_bug.cgi?id=736260
+            from gi.repository import GstPbutils
+        finally:
+            sys.argv = old_argv
+
+        self.GLib = GLib
+        self.Gst = Gst
+        self.GstPbutils = GstPbutils
+        self.pid = os.getpid()
+        self._local = threading.local()
+
+    def discoverer(self):
+        '''
+        The Discoverer of this thread
+        '''
+        if not hasattr(self._local, 'discoverer'):
+            self._local.discoverer = self.GstPbutils.Discoverer.new(
+                60 * self.Gst.SECOND)
+        return self._local.discoverer
+
+    def pipeline_template(self, name, build):
+        '''
+        The pipeline template called name of this thread, built by build()
+        the first time.  Whatever build() returned is returned, and the
+        pipelines in it are to be set to the NULL state after each use.
+        '''
+        if not hasattr(self._local, 'templates'):
+            self._local.templates = {}
+        if name not in self._local.templates:
+            self._local.templates[name] = build()
+        return self._local.templates[name]
+
+
+_gst_runtime = None
+_gst_runtime_lock = threading.Lock()
+
+
+def get_gst_runtime():
+    '''
+    Return the GStreamer runtime of this process, initializing GStreamer the
+    first time.  A forked process, like a celery worker, gets one of its own,
+    as the threads of the parent's Discoverers and pipelines don't survive
+    forking.
+    '''
+    global _gst_runtime
+    with _gst_runtime_lock:
+        if _gst_runtime is None or _gst_runtime.pid != os.getpid():
+            _gst_runtime = GstRuntime()
+        return _gst_runtime
+
+
+def preinit_gst_runtime(**kwargs):
+    '''
+    Initialize GStreamer and the Discoverer before the first task needs them
+    '''
+    try:
+        get_gst_runtime().discoverer()
+    except (ImportError, ValueError) as exc:
+        _log.warning(f'Could not initialize GStreamer: {exc}')
+        return
+    _log.debug(f'Initialized GStreamer for worker process {os.getpid()}')
+
+
+def setup_celery(celery_app=None):
+    '''
+    Have each celery worker process initialize GStreamer as it starts
+    '''
+    from celery.signals import worker_process_init
+    worker_process_init.connect(
+        preinit_gst_runtime, weak=False,
+        dispatch_uid='mediagoblin.media_types.tools.preinit_gst_runtime')
+
+
 def discover(src):
     '''
     Discover properties about a media file
+
+    Successful discoveries are summarized and cached by the file's path,
+    size and modification time, in this process and in the workbench
+    directory, so a file is only scanned once by all the tasks and steps
+    processing it.  A DiscoveredInfo of the summary is returned then, the
+    DiscovererInfo itself otherwise.
     '''
-    # GStreamer might be not installed, so it should not be initialized on
-    # import, or an exception will be raised.
-    import gi
-    gi.require_version('Gst', '1.0')
-    from gi.repository import GObject, Gst, GLib
-    Gst.init(None)
-    # init before import to work around https://bugzilla.gnome.org/show_bug.cgi?id=736260
-    from gi.repository import GstPbutils
+    key = _discovery_cache_key(src)
+    summary = _read_cached_discovery(key) if key else None
+    if summary is not None:
+        _log.debug(f'Using cached discovery of {src}')
+        return DiscoveredInfo(summary)
+
+    gst = get_gst_runtime()
 
     _log.info(f'Discovering {src}...')
     uri = f'file://{src}'
-    discoverer = GstPbutils.Discoverer.new(60 * Gst.SECOND)
-    return discoverer.discover_uri(uri)
+    info = gst.discoverer().discover_uri(uri)
+    if key is None or \
+            info.get_result() != gst.GstPbutils.DiscovererResult.OK:
+        return info
+
+    summary = summarize_discovery(info)
+    _cache_discovery(key, summary)
+    return DiscoveredInfo(summary)
@@ -16,6 +16,7 @@
 
 from mediagoblin import mg_globals as mgg
 from mediagoblin.media_types import MediaManagerBase
+from mediagoblin.media_types.tools import setup_celery
 from mediagoblin.media_types.video.processing import (VideoProcessingManager,
         sniff_handler, sniffer)
 
@@ -55,6 +56,7 @@ def type_match_handler(ext):
 hooks = {
     'type_match_handler': type_match_handler,
     'sniff_handler': sniff_handler,
+    'celery_setup': setup_celery,
     ('media_manager', MEDIA_TYPE): lambda: VideoMediaManager,
     ('reprocess_manager', MEDIA_TYPE): lambda: VideoProcessingManager,
 }
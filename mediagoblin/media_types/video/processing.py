@@ -18,27 +18,36 @@ import argparse
 import os.path
 import logging
 import datetime
+import math
 import celery
 
 from celery import group
+try:
+    from PIL import Image
+except ImportError:
+    import Image
 from mediagoblin import mg_globals as mgg
 from mediagoblin.processing import (
     FilenameBuilder, BaseProcessingFail,
     ProgressCallback, MediaProcessor,
     ProcessingManager, request_from_args,
-    get_process_filename, store_public,
+    get_process_filename, store_public, mark_entry_failed,
     copy_original, get_entry_and_processing_manager)
 from mediagoblin.tools.translate import lazy_pass_to_ugettext as _
 from mediagoblin.media_types import MissingComponents
 
 from . import transcoders
-from .util import skip_transcode, ACCEPTED_RESOLUTIONS
+from .util import (
+    skip_transcode, can_remux, remux_resolution, ACCEPTED_RESOLUTIONS)
 
 _log = logging.getLogger(__name__)
 _log.setLevel(logging.DEBUG)
 
 MEDIA_TYPE = 'mediagoblin.media_types.video'
 
+# Long videos get a longer sprite interval rather than more sprites
+MAX_SPRITES = 100
+
 
 class VideoTranscodingFail(BaseProcessingFail):
     '''
@@ -106,13 +115,15 @@ def get_tags(stream_info):
             lambda list, tag: tags.append((tag, list.get_value_index(tag, 0))))
     tags = dict(tags)
 
-    # date/datetime should be converted from GDate/GDateTime to strings
-    if 'date' in tags:
+    # date/datetime should be converted from GDate/GDateTime to strings,
+    # cached discoveries have them converted already
+    if 'date' in tags and not isinstance(tags['date'], str):
         date = tags['date']
         tags['date'] = "{}-{}-{}".format(
                 date.year, date.month, date.day)
 
-    if 'datetime' in tags:
+    if 'datetime' in tags and \
+            not isinstance(tags['datetime'], (str, type(None))):
         # TODO: handle timezone info; gst.get_time_zone_offset +
         # python's tzinfo should help
         dt = tags['datetime']
@@ -173,6 +184,15 @@ def store_metadata(media_entry, metadata):
         media_entry.media_data_init(orig_metadata=stored_metadata)
 
 
+def segment_filepath(entry, name=None):
+    """
+    Where segments of the entry's video are kept until they are joined,
+    the directory of them without a name
+    """
+    dirpath = ['media_entries', entry.queued_task_id, 'segments']
+    return dirpath + [name] if name else dirpath
+
+
 @celery.task()
 def main_task(entry_id, resolution, medium_size, **process_info):
     """
@@ -197,6 +217,30 @@ def main_task(entry_id, resolution, medium_size, **process_info):
     _log.debug('MediaEntry processed')
 
 
+@celery.task()
+def multi_transcode_task(entry_id, resolutions, **process_info):
+    """
+    Celery task to transcode the video to all the resolutions at once,
+    decoding it only once, and store original video metadata.
+    """
+    _log.debug('MediaEntry processing')
+    entry, manager = get_entry_and_processing_manager(entry_id)
+    with CommonVideoProcessor(manager, entry) as processor:
+        processor.common_setup()
+        processor.transcode_resolutions(
+            resolutions,
+            vp8_quality=process_info['vp8_quality'],
+            vp8_threads=process_info['vp8_threads'],
+            vorbis_quality=process_info['vorbis_quality'])
+        processor.generate_thumb(thumb_size=process_info['thumb_size'])
+        processor.store_orig_metadata()
+    # Make state of entry as processed
+    entry.state = 'processed'
+    entry.save()
+    _log.info('MediaEntry ID {} is processed (transcoded to {})'.format(
+        entry.id, ', '.join(resolutions)))
+
+
 @celery.task()
 def complementary_task(entry_id, resolution, medium_size, **process_info):
     """
@@ -214,12 +258,73 @@ def complementary_task(entry_id, resolution, medium_size, **process_info):
 
 
 @celery.task()
-def processing_cleanup(entry_id):
+def segment_task(entry_id, index, start, stop, **process_info):
+    """
+    Celery task to transcode a segment of the video, between start and
+    stop nanoseconds, to all the resolutions, for processing_cleanup to
+    join
+    """
+    entry, manager = get_entry_and_processing_manager(entry_id)
+    if entry.state == 'failed':
+        # Another segment failed already
+        return
+    with CommonVideoProcessor(manager, entry) as processor:
+        processor.common_setup()
+        processor.transcode_segment(
+            index, start, stop, process_info['resolutions'],
+            vp8_quality=process_info['vp8_quality'],
+            vp8_threads=process_info['vp8_threads'])
+        # Every segment is transcoded to the default resolution too
+        progress_callback = ProgressCallback(entry, add_main_progress=True)
+        progress_callback(100 / process_info['segments'],
+                          100 / process_info['segments'])
+        progress_callback.flush()
+    _log.info('MediaEntry ID {} segment {} is transcoded'.format(
+        entry.id, index))
+
+
+@celery.task()
+def audio_track_task(entry_id, **process_info):
+    """
+    Celery task to transcode the audio of a segmented video, for
+    processing_cleanup to join with the segments
+    """
+    entry, manager = get_entry_and_processing_manager(entry_id)
+    with CommonVideoProcessor(manager, entry) as processor:
+        processor.common_setup()
+        processor.transcode_audio_track(
+            vorbis_quality=process_info['vorbis_quality'])
+
+
+@celery.task()
+def segments_failed(entry_id):
+    """
+    Error callback of the tasks of a segmented video: mark the entry as
+    failed and delete the segments transcoded so far
+    """
+    entry, manager = get_entry_and_processing_manager(entry_id)
+    _log.info('MediaEntry ID {} failed to transcode in segments'.format(
+        entry.id))
+    mark_entry_failed(entry.id, VideoTranscodingFail())
+    mgg.queue_store.delete_dir(segment_filepath(entry), recursive=True)
+
+
+@celery.task()
+def processing_cleanup(entry_id, **process_info):
     _log.debug('Entered processing_cleanup')
     entry, manager = get_entry_and_processing_manager(entry_id)
     with CommonVideoProcessor(manager, entry) as processor:
         # no need to specify a resolution here
         processor.common_setup()
+        if process_info.get('segments'):
+            processor.join_segments(
+                process_info['segments'], process_info['resolutions'],
+                vp8_quality=process_info['vp8_quality'],
+                vp8_threads=process_info['vp8_threads'],
+                vorbis_quality=process_info['vorbis_quality'])
+            processor.generate_thumb(thumb_size=process_info['thumb_size'])
+            processor.store_orig_metadata()
+            entry.state = 'processed'
         processor.copy_original()
         processor.keep_best()
         processor.delete_queue_file()
@@ -244,6 +349,7 @@ class CommonVideoProcessor(MediaProcessor):
 
         self.transcoder = transcoders.VideoTranscoder()
         self.did_transcode = False
+        self.resolution = resolution
 
         if resolution:
             self.curr_file = 'webm_' + str(resolution)
@@ -295,8 +401,13 @@ class CommonVideoProcessor(MediaProcessor):
         skip = True
 
         if 'webm' in keyname:
-            if kwargs.get('medium_size') != file_metadata.get('medium_size'):
+            # medium_size comes back from the database as a list
+            if tuple(kwargs.get('medium_size') or ()) != \
+                    tuple(file_metadata.get('medium_size') or ()):
                 skip = False
+            elif file_metadata.get('remuxed'):
+                # The encoder settings don't apply to remuxed videos
+                pass
             elif kwargs.get('vp8_quality') != file_metadata.get('vp8_quality'):
                 skip = False
             elif kwargs.get('vp8_threads') != file_metadata.get('vp8_threads'):
@@ -307,6 +418,10 @@ class CommonVideoProcessor(MediaProcessor):
         elif keyname == 'thumb':
             if kwargs.get('thumb_size') != file_metadata.get('thumb_size'):
                 skip = False
+        elif keyname == 'sprites':
+            for key in ('sprite_interval', 'sprite_width', 'sprite_columns'):
+                if kwargs.get(key) != file_metadata.get(key):
+                    skip = False
 
         return skip
 
@@ -350,6 +465,17 @@ class CommonVideoProcessor(MediaProcessor):
                self.entry.media_files.get(self.curr_file):
                 self.entry.media_files[self.curr_file].delete()
 
+        elif can_remux(metadata, medium_size) and \
+                self.resolution in self.video_config['available_resolutions'] \
+                and self.resolution != remux_resolution(
+                    metadata, self.video_config['available_resolutions']):
+            _log.debug(f'Skipping {self.resolution}, the video is remuxed '
+                       'to a smaller resolution')
+
+        elif can_remux(metadata, medium_size) and \
+                self.remux(self.curr_file, self.part_filename, file_metadata):
+            _log.debug('Remuxed instead of transcoding')
+
         else:
             _log.debug('Entered transcoder')
             video_config = (mgg.global_config['plugins']
@@ -363,16 +489,202 @@ class CommonVideoProcessor(MediaProcessor):
                                       vorbis_quality=vorbis_quality,
                                       progress_callback=progress_callback,
                                       dimensions=tuple(medium_size))
+            progress_callback.flush()
             if self.transcoder.dst_data:
                 # Push transcoded video to public storage
                 _log.debug('Saving medium...')
                 store_public(self.entry, self.curr_file, tmp_dst, self.part_filename)
                 _log.debug('Saved medium')
 
-                self.entry.set_file_metadata(self.curr_file, **file_metadata)
+                self.entry.set_file_metadata(self.curr_file, remuxed=False,
+                                             **file_metadata)
 
                 self.did_transcode = True
 
+    def remux(self, keyname, part_filename, file_metadata):
+        """
+        Put the streams of the video in a WebM file for keyname as they
+        are, returning whether that worked
+        """
+        tmp_dst = os.path.join(self.workbench.dir, part_filename)
+        transcoder = transcoders.VideoTranscoder()
+        transcoder.remux(self.process_filename, tmp_dst)
+        if not transcoder.dst_data:
+            _log.warning(f'Remuxing to {keyname} failed, transcoding instead')
+            return False
+
+        _log.debug(f'Saving remuxed {keyname}...')
+        store_public(self.entry, keyname, tmp_dst, part_filename)
+        self.entry.set_file_metadata(keyname, remuxed=True, **file_metadata)
+        self.did_transcode = True
+        return True
+
+    def transcode_resolutions(self, resolutions, vp8_quality=None,
+                              vp8_threads=None, vorbis_quality=None):
+        """
+        Transcode the video to each of the resolutions in one pass
+        """
+        progress_callback = ProgressCallback(self.entry)
+
+        if not vp8_quality:
+            vp8_quality = self.video_config['vp8_quality']
+        if not vp8_threads:
+            vp8_threads = self.video_config['vp8_threads']
+        if not vorbis_quality:
+            vorbis_quality = self.video_config['vorbis_quality']
+
+        metadata = transcoders.discover(self.process_filename)
+        remux_to = remux_resolution(metadata, resolutions)
+
+        destinations = []
+        for resolution in resolutions:
+            medium_size = ACCEPTED_RESOLUTIONS[resolution]
+            keyname = f'webm_{resolution}'
+            file_metadata = {'medium_size': medium_size,
+                             'vp8_threads': vp8_threads,
+                             'vp8_quality': vp8_quality,
+                             'vorbis_quality': vorbis_quality}
+            if self._skip_processing(keyname, **file_metadata):
+                continue
+            if skip_transcode(metadata, medium_size):
+                _log.debug(f'Skipping transcoding to {resolution}')
+                continue
+            part_filename = self.name_builder.fill(
+                '{basename}.' + str(resolution) + '.webm')
+            if resolution != remux_to and can_remux(metadata, medium_size):
+                _log.debug(f'Skipping {resolution}, the video is remuxed '
+                           f'to {remux_to}')
+                continue
+            if resolution == remux_to and \
+                    self.remux(keyname, part_filename, file_metadata):
+                continue
+            destinations.append((
+                keyname, part_filename,
+                os.path.join(self.workbench.dir, part_filename),
+                file_metadata))
+
+        if not destinations:
+            return
+
+        _log.debug('Entered transcoder')
+        transcoder = transcoders.MultiVideoTranscoder()
+        transcoder.transcode(
+            self.process_filename,
+            [(tmp_dst, file_metadata['medium_size'])
+             for keyname, part_filename, tmp_dst, file_metadata
+             in destinations],
+            vp8_quality=vp8_quality,
+            vp8_threads=vp8_threads,
+            vorbis_quality=vorbis_quality,
+            progress_callback=progress_callback)
+        progress_callback.flush()
+        if not transcoder.dst_data:
+            return
+
+        for keyname, part_filename, tmp_dst, file_metadata in destinations:
+            if not transcoder.dst_data.get(tmp_dst):
+                continue
+            # Push transcoded video to public storage
+            _log.debug(f'Saving {keyname}...')
+            store_public(self.entry, keyname, tmp_dst, part_filename)
+            self.entry.set_file_metadata(keyname, remuxed=False,
+                                         **file_metadata)
+            self.did_transcode = True
+
+    def segment_filepath(self, name=None):
+        return segment_filepath(self.entry, name)
+
+    def transcode_segment(self, index, start, stop, resolutions,
+                          vp8_quality=None, vp8_threads=None):
+        """
+        Transcode the video between start and stop to each of the
+        resolutions, without audio, and put the segments in the queue
+        storage
+        """
+        if not vp8_quality:
+            vp8_quality = self.video_config['vp8_quality']
+        if not vp8_threads:
+            vp8_threads = self.video_config['vp8_threads']
+
+        destinations = [
+            (os.path.join(self.workbench.dir, f'{resolution}-{index:05}.webm'),
+             ACCEPTED_RESOLUTIONS[resolution])
+            for resolution in resolutions]
+        transcoder = transcoders.MultiVideoTranscoder()
+        transcoder.transcode(self.process_filename, destinations,
+                             start=start, stop=stop, audio=False,
+                             vp8_quality=vp8_quality,
+                             vp8_threads=vp8_threads)
+        if not transcoder.dst_data or \
+                not all(transcoder.dst_data.values()):
+            raise VideoTranscodingFail()
+
+        for tmp_dst, size in destinations:
+            mgg.queue_store.copy_local_to_storage(
+                tmp_dst, self.segment_filepath(os.path.basename(tmp_dst)))
+
+    def transcode_audio_track(self, vorbis_quality=None):
+        """
+        Transcode the audio of the video for join_segments()
+        """
+        if not vorbis_quality:
+            vorbis_quality = self.video_config['vorbis_quality']
+
+        tmp_dst = os.path.join(self.workbench.dir, 'audio.webm')
+        transcoder = transcoders.AudioTrackTranscoder()
+        transcoder.transcode(self.process_filename, tmp_dst,
+                             vorbis_quality=vorbis_quality)
+        if not transcoder.dst_data:
+            raise VideoTranscodingFail()
+        mgg.queue_store.copy_local_to_storage(
+            tmp_dst, self.segment_filepath('audio.webm'))
+
+    def join_segments(self, segments, resolutions, vp8_quality=None,
+                      vp8_threads=None, vorbis_quality=None):
+        """
+        Join the segments of each resolution, and the audio track if there
+        is one, into its WebM file, and delete them
+        """
+        if not vp8_quality:
+            vp8_quality = self.video_config['vp8_quality']
+        if not vp8_threads:
+            vp8_threads = self.video_config['vp8_threads']
+        if not vorbis_quality:
+            vorbis_quality = self.video_config['vorbis_quality']
+
+        audio = None
+        audio_filepath = self.segment_filepath('audio.webm')
+        if mgg.queue_store.file_exists(audio_filepath):
+            audio = self.workbench.localized_file(
+                mgg.queue_store, audio_filepath)
+
+        for resolution in resolutions:
+            keyname = f'webm_{resolution}'
+            part_filename = self.name_builder.fill(
+                '{basename}.' + str(resolution) + '.webm')
+            tmp_dst = os.path.join(self.workbench.dir, part_filename)
+            segment_files = [
+                self.workbench.localized_file(
+                    mgg.queue_store,
+                    self.segment_filepath(f'{resolution}-{index:05}.webm'))
+                for index in range(segments)]
+
+            joiner = transcoders.SegmentJoiner()
+            joiner.join(segment_files, tmp_dst, audio=audio)
+            if not joiner.dst_data:
+                raise VideoTranscodingFail()
+
+            store_public(self.entry, keyname, tmp_dst, part_filename)
+            self.entry.set_file_metadata(keyname, **{
+                'medium_size': ACCEPTED_RESOLUTIONS[resolution],
+                'vp8_threads': vp8_threads,
+                'vp8_quality': vp8_quality,
+                'vorbis_quality': vorbis_quality,
+                'remuxed': False})
+            self.did_transcode = True
+
+        mgg.queue_store.delete_dir(self.segment_filepath(), recursive=True)
+
     def generate_thumb(self, thumb_size=None):
         _log.debug("Enter generate_thumb()")
         # Temporary file for the video thumbnail (cleaned up with workbench)
@@ -397,6 +709,9 @@ class CommonVideoProcessor(MediaProcessor):
         if not os.path.exists (tmp_thumb):
             return
 
+        self._store_thumb(tmp_thumb, thumb_size)
+
+    def _store_thumb(self, tmp_thumb, thumb_size):
         # Push the thumbnail to public storage
         _log.debug('Saving thumbnail...')
         store_public(self.entry, 'thumb', tmp_thumb,
@@ -404,6 +719,91 @@ class CommonVideoProcessor(MediaProcessor):
 
         self.entry.set_file_metadata('thumb', thumb_size=thumb_size)
 
+    def generate_sprites(self, sprite_interval=None, sprite_width=None,
+                         sprite_columns=None, thumb_size=None):
+        """
+        Capture frames of the video every sprite_interval seconds into a
+        sprite sheet for scrubbing, with a WebVTT index of them, and the
+        thumbnail in the same pass
+        """
+        if not sprite_interval:
+            sprite_interval = self.video_config['sprite_interval']
+        if not sprite_width:
+            sprite_width = self.video_config['sprite_width']
+        if not sprite_columns:
+            sprite_columns = self.video_config['sprite_columns']
+        if not thumb_size:
+            thumb_size = (mgg.global_config['media:thumb']['max_width'],)
+
+        sprite_settings = {'sprite_interval': sprite_interval,
+                           'sprite_width': sprite_width,
+                           'sprite_columns': sprite_columns}
+        skip_sprites = self._skip_processing('sprites', **sprite_settings)
+        skip_thumb = self._skip_processing('thumb', thumb_size=thumb_size)
+        if skip_sprites and skip_thumb:
+            return
+
+        metadata = transcoders.discover(self.process_filename)
+        duration = metadata.get_duration() / transcoders.Gst.SECOND
+        if not duration:
+            return
+        interval = max(sprite_interval, duration / MAX_SPRITES)
+        times = [idx * interval
+                 for idx in range(math.ceil(duration / interval))]
+
+        # The thumbnail is the last frame, at the middle of the video
+        frames = transcoders.capture_frames(
+            self.process_filename,
+            [time / duration for time in times] + [0.5],
+            width=max(sprite_width, thumb_size[0]))
+        thumb = frames.pop()
+
+        if thumb and not skip_thumb:
+            tmp_thumb = os.path.join(self.workbench.dir,
+                                     self.name_builder.fill(
+                                         '{basename}.thumbnail.jpg'))
+            thumb.resize(
+                (thumb_size[0],
+                 round(thumb.height * thumb_size[0] / thumb.width)),
+                Image.LANCZOS).save(tmp_thumb)
+            self._store_thumb(tmp_thumb, thumb_size)
+
+        if skip_sprites or not any(frames):
+            return
+
+        first = next(frame for frame in frames if frame)
+        sprite_size = (sprite_width,
+                       round(first.height * sprite_width / first.width))
+        columns = min(sprite_columns, len(frames))
+        sheet = Image.new(
+            'RGB', (sprite_size[0] * columns,
+                    sprite_size[1] * math.ceil(len(frames) / columns)))
+
+        sprites_filename = self.name_builder.fill('{basename}.sprites.jpg')
+        vtt_filename = self.name_builder.fill('{basename}.sprites.vtt')
+        cues = ['WEBVTT']
+        for idx, (time, frame) in enumerate(zip(times, frames)):
+            x = sprite_size[0] * (idx % columns)
+            y = sprite_size[1] * (idx // columns)
+            if frame:
+                sheet.paste(frame.resize(sprite_size, Image.LANCZOS), (x, y))
+            end = times[idx + 1] if idx + 1 < len(times) else duration
+            # Relative to the index, which is stored next to the sheet
+            cues.append('{} --> {}\n{}#xywh={},{},{},{}'.format(
+                vtt_timestamp(time), vtt_timestamp(end), sprites_filename,
+                x, y, sprite_size[0], sprite_size[1]))
+
+        tmp_sprites = os.path.join(self.workbench.dir, sprites_filename)
+        sheet.save(tmp_sprites)
+        tmp_vtt = os.path.join(self.workbench.dir, vtt_filename)
+        with open(tmp_vtt, 'w') as vtt:
+            vtt.write('\n\n'.join(cues) + '\n')
+
+        _log.debug('Saving sprite sheet...')
+        store_public(self.entry, 'sprites', tmp_sprites, sprites_filename)
+        store_public(self.entry, 'sprites_vtt', tmp_vtt, vtt_filename)
+        self.entry.set_file_metadata('sprites', **sprite_settings)
+
     def store_orig_metadata(self):
         # Extract metadata and keep a record of it
         metadata = transcoders.discover(self.process_filename)
@@ -415,6 +815,17 @@ class CommonVideoProcessor(MediaProcessor):
         _log.debug("Stored original video metadata")
 
 
+def vtt_timestamp(seconds):
+    """
+    Format seconds as a WebVTT timestamp, hh:mm:ss.ttt
+    """
+    milliseconds = round(seconds * 1000)
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f'{hours:02}:{minutes:02}:{seconds:02}.{milliseconds:03}'
+
+
 class InitialProcessor(CommonVideoProcessor):
     """
     Initial processing steps for new video
@@ -581,12 +992,132 @@ class Transcoder(CommonVideoProcessor):
                        vp8_quality=vp8_quality, vorbis_quality=vorbis_quality)
 
 
+class SpriteSheetCreator(CommonVideoProcessor):
+    """
+    Scrubbing sprite sheet, and thumbnail, steps for processed video
+    """
+    name = 'sprites'
+    description = 'Create a sprite sheet for scrubbing and the thumbnail'
+
+    @classmethod
+    def media_is_eligible(cls, entry=None, state=None):
+        if not state:
+            state = entry.state
+        return state in 'processed'
+
+    @classmethod
+    def generate_parser(cls):
+        parser = argparse.ArgumentParser(
+            description=cls.description,
+            prog=cls.name)
+
+        parser.add_argument(
+            '--sprite_interval',
+            type=int,
+            help='Seconds between the frames of the sprite sheet')
+
+        parser.add_argument(
+            '--sprite_width',
+            type=int)
+
+        parser.add_argument(
+            '--sprite_columns',
+            type=int)
+
+        parser.add_argument(
+            '--thumb_size',
+            nargs=2,
+            metavar=('max_width', 'max_height'),
+            type=int)
+
+        return parser
+
+    @classmethod
+    def args_to_request(cls, args):
+        return request_from_args(
+            args, ['sprite_interval', 'sprite_width', 'sprite_columns',
+                   'thumb_size'])
+
+    def process(self, sprite_interval=None, sprite_width=None,
+                sprite_columns=None, thumb_size=None):
+        self.common_setup()
+        self.generate_sprites(sprite_interval=sprite_interval,
+                              sprite_width=sprite_width,
+                              sprite_columns=sprite_columns,
+                              thumb_size=thumb_size)
+
+
 class VideoProcessingManager(ProcessingManager):
     def __init__(self):
         super().__init__()
         self.add_processor(InitialProcessor)
         self.add_processor(Resizer)
         self.add_processor(Transcoder)
+        self.add_processor(SpriteSheetCreator)
+
+    def plan_segments(self, entry):
+        """
+        Return the (start, stop) times, in nanoseconds, of the segments to
+        transcode the entry's video in and whether it has audio, or None if
+        it is not to be split
+        """
+        video_config = mgg.global_config['plugins'][MEDIA_TYPE]
+        segment_duration = video_config['segment_duration'] * \
+            transcoders.Gst.SECOND
+        if not segment_duration or not entry.queued_media_file:
+            return None
+        try:
+            filename = mgg.queue_store.get_local_path(
+                entry.queued_media_file)
+        except NotImplementedError:
+            return None
+
+        metadata = transcoders.discover(filename)
+        duration = metadata.get_duration()
+        if not metadata.get_video_streams() or \
+                duration < 2 * segment_duration:
+            return None
+        if all(can_remux(metadata, ACCEPTED_RESOLUTIONS[res])
+               for res in video_config['available_resolutions']):
+            # Remuxing is quick enough without splitting the video
+            return None
+        count = math.ceil(duration / segment_duration)
+        return [(idx * segment_duration,
+                 (idx + 1) * segment_duration if idx + 1 < count else None)
+                for idx in range(count)], bool(metadata.get_audio_streams())
+
+    def segmented_workflow(self, entry, segments, has_audio, reprocess_info):
+        """
+        Transcode the segments of the video in tasks of their own, and
+        join them in processing_cleanup.  If any of them fails,
+        segments_failed marks the entry as failed.
+        """
+        video_config = mgg.global_config['plugins'][MEDIA_TYPE]
+        def_res = video_config['default_resolution']
+        process_info = dict(
+            reprocess_info,
+            segments=len(segments),
+            resolutions=[def_res] + [
+                res for res in video_config['available_resolutions']
+                if res != def_res])
+
+        failed_task = segments_failed.signature(
+            args=(entry.id,), queue='default', immutable=True)
+
+        tasks_list = [
+            segment_task.signature(
+                args=(entry.id, idx, start, stop), kwargs=process_info,
+                queue='default', immutable=True).on_error(failed_task)
+            for idx, (start, stop) in enumerate(segments)]
+        if has_audio:
+            tasks_list.append(audio_track_task.signature(
+                args=(entry.id,), kwargs=process_info, queue='default',
+                immutable=True).on_error(failed_task))
+
+        cleanup_task = processing_cleanup.signature(
+            args=(entry.id,), kwargs=process_info, queue='default',
+            immutable=True).on_error(failed_task)
+        return (group(tasks_list), cleanup_task)
 
     def workflow(self, entry, feed_url, reprocess_action, reprocess_info=None):
 
@@ -607,20 +1138,34 @@ class VideoProcessingManager(ProcessingManager):
         if 'thumb_size' not in reprocess_info:
             reprocess_info['thumb_size'] = None
 
-        tasks_list = [main_task.signature(args=(entry.id, def_res,
-                                          ACCEPTED_RESOLUTIONS[def_res]),
-                                          kwargs=reprocess_info, queue='default',
-                                          priority=priority_num, immutable=True)]
-
-        for comp_res in video_config['available_resolutions']:
-            if comp_res != def_res:
-                priority_num += -1
-                tasks_list.append(
-                    complementary_task.signature(args=(entry.id, comp_res,
-                                                 ACCEPTED_RESOLUTIONS[comp_res]),
-                                                 kwargs=reprocess_info, queue='default',
-                                                 priority=priority_num, immutable=True)
-                )
+        plan = self.plan_segments(entry)
+        if plan:
+            return self.segmented_workflow(entry, plan[0], plan[1],
+                                           reprocess_info)
+
+        if not video_config['parallel_transcoding']:
+            # One task decoding the video once for all resolutions
+            resolutions = [def_res] + [
+                res for res in video_config['available_resolutions']
+                if res != def_res]
+            tasks_list = [multi_transcode_task.signature(
+                args=(entry.id, resolutions), kwargs=reprocess_info,
+                queue='default', priority=priority_num, immutable=True)]
+        else:
+            tasks_list = [main_task.signature(args=(entry.id, def_res,
+                                              ACCEPTED_RESOLUTIONS[def_res]),
+                                              kwargs=reprocess_info, queue='default',
+                                              priority=priority_num, immutable=True)]
+
+            for comp_res in video_config['available_resolutions']:
+                if comp_res != def_res:
+                    priority_num += -1
+                    tasks_list.append(
+                        complementary_task.signature(args=(entry.id, comp_res,
+                                                     ACCEPTED_RESOLUTIONS[comp_res]),
+                                                     kwargs=reprocess_info, queue='default',
+                                                     priority=priority_num, immutable=True)
+                    )
 
         transcoding_tasks = group(tasks_list)
         cleanup_task = processing_cleanup.signature(args=(entry.id,),
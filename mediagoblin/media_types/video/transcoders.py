@@ -20,23 +20,14 @@ import sys
 import logging
 import multiprocessing
 
-from mediagoblin.media_types.tools import discover
+from mediagoblin.media_types.tools import discover, get_gst_runtime
 from .util import ACCEPTED_RESOLUTIONS
 
 #os.environ['GST_DEBUG'] = '4,python:4'
 
-old_argv = sys.argv
-sys.argv = []
+_gst = get_gst_runtime()
+GLib, Gst, GstPbutils = _gst.GLib, _gst.Gst, _gst.GstPbutils
 
-import gi
-gi.require_version('Gst', '1.0')
-from gi.repository import GLib, Gst
-Gst.init(None)
-# init before import to work around https://bugzilla.gnome.org/show_bug.cgi?id=736260
-gi.require_version('GstPbutils', '1.0')
-from gi.repository import GstPbutils
-
-sys.argv = old_argv
 import struct
 try:
     from PIL import Image
@@ -55,7 +46,7 @@ except NotImplementedError:
 os.putenv('GST_DEBUG_DUMP_DOT_DIR', '/tmp')
 
 
-def capture_thumb(video_path, dest_path, width=None, height=None, percent=0.5):
+def _build_capture_pipeline():
     def pad_added(element, pad, connect_to):
         '''This is a callback to dynamically add element to pipeline'''
         caps = pad.query_caps(None)
@@ -68,12 +59,40 @@ def capture_thumb(video_path, dest_path, width=None, height=None, percent=0.5):
     # ! CAPS ! appsink
     pipeline = Gst.Pipeline()
     uridecodebin = Gst.ElementFactory.make('uridecodebin', None)
-    uridecodebin.set_property('uri', f'file://{video_path}')
     videoconvert = Gst.ElementFactory.make('videoconvert', None)
     uridecodebin.connect('pad-added', pad_added,
                          videoconvert.get_static_pad('sink'))
     videoscale = Gst.ElementFactory.make('videoscale', None)
 
+    # sink everything to memory
+    appsink = Gst.ElementFactory.make('appsink', None)
+
+    # add everything to pipeline
+    elements = [uridecodebin, videoconvert, videoscale, appsink]
+    for e in elements:
+        pipeline.add(e)
+    videoconvert.link(videoscale)
+    videoscale.link(appsink)
+    return pipeline, uridecodebin, appsink
+
+
+def capture_frames(video_path, positions, width=None, height=None):
+    '''
+    Capture the frames of the video at each of positions, fractions of its
+    duration, as RGB images in a single pipeline.
+
+    Seeks go to the nearest keyframe, so only the keyframes are decoded
+    and not the frames in between.  The images of frames that could not
+    be captured are None, and all of them are if the video could not be
+    played.
+    '''
+    frames = [None] * len(positions)
+
+    # the pipeline is built once per thread and reused for every video
+    pipeline, uridecodebin, appsink = get_gst_runtime().pipeline_template(
+        'capture_frames', _build_capture_pipeline)
+    uridecodebin.set_property('uri', f'file://{video_path}')
+
     # create caps for video scaling
     caps_struct = Gst.Structure.new_empty('video/x-raw')
     caps_struct.set_value('pixel-aspect-ratio', Gst.Fraction(1, 1))
@@ -84,64 +103,70 @@ def capture_thumb(video_path, dest_path, width=None, height=None, percent=0.5):
         caps_struct.set_value('width', width)
     caps = Gst.Caps.new_empty()
     caps.append_structure(caps_struct)
-
-    # sink everything to memory
-    appsink = Gst.ElementFactory.make('appsink', None)
     appsink.set_property('caps', caps)
 
-    # add everything to pipeline
-    elements = [uridecodebin, videoconvert, videoscale, appsink]
-    for e in elements:
-        pipeline.add(e)
-    videoconvert.link(videoscale)
-    videoscale.link(appsink)
-
     # pipeline constructed, starting playing, but first some preparations
-    # seek to 50% of the file is required
+    # seek to each of the positions is required
     pipeline.set_state(Gst.State.PAUSED)
-    # timeout of 3 seconds below was set experimentally
-    state = pipeline.get_state(Gst.SECOND * 3)
-    if state[0] != Gst.StateChangeReturn.SUCCESS:
-        _log.warning(f'state change failed, {state}')
-        return
+    try:
+        # timeout of 3 seconds below was set experimentally
+        state = pipeline.get_state(Gst.SECOND * 3)
+        if state[0] != Gst.StateChangeReturn.SUCCESS:
+            _log.warning(f'state change failed, {state}')
+            return frames
+
+        # get duration
+        (success, duration) = pipeline.query_duration(Gst.Format.TIME)
+        if not success:
+            _log.warning('query_duration failed')
+            return frames
+
+        for idx, position in enumerate(positions):
+            seek_to = int(duration * position)
+            _log.debug('Seeking to {} of {}'.format(
+                    float(seek_to) / Gst.SECOND, float(duration) / Gst.SECOND))
+            seek = pipeline.seek_simple(
+                Gst.Format.TIME,
+                Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT |
+                Gst.SeekFlags.SNAP_NEAREST,
+                seek_to)
+            if not seek:
+                _log.warning('seek failed')
+                continue
+
+            # get sample, retrieve it's format and keep the image
+            sample = appsink.emit("pull-preroll")
+            if not sample:
+                _log.warning('could not get sample')
+                continue
+            caps = sample.get_caps()
+            if not caps:
+                _log.warning('could not get snapshot format')
+                continue
+            structure = caps.get_structure(0)
+            (success, frame_width) = structure.get_int('width')
+            (success, frame_height) = structure.get_int('height')
+            buffer = sample.get_buffer()
+
+            frames[idx] = Image.frombytes(
+                'RGB', (frame_width, frame_height),
+                buffer.extract_dup(0, buffer.get_size()))
+    finally:
+        # cleanup
+        pipeline.set_state(Gst.State.NULL)
+
+    return frames
 
-    # get duration
-    (success, duration) = pipeline.query_duration(Gst.Format.TIME)
-    if not success:
-        _log.warning('query_duration failed')
-        return
 
-    seek_to = int(duration * int(percent * 100) / 100)
-    _log.debug('Seeking to {} of {}'.format(
-            float(seek_to) / Gst.SECOND, float(duration) / Gst.SECOND))
-    seek = pipeline.seek_simple(Gst.Format.TIME, Gst.SeekFlags.FLUSH, seek_to)
-    if not seek:
-        _log.warning('seek failed')
+def capture_thumb(video_path, dest_path, width=None, height=None, percent=0.5):
+    im, = capture_frames(video_path, [percent], width, height)
+    if not im:
         return
 
-    # get sample, retrieve it's format and save
-    sample = appsink.emit("pull-preroll")
-    if not sample:
-        _log.warning('could not get sample')
-        return
-    caps = sample.get_caps()
-    if not caps:
-        _log.warning('could not get snapshot format')
-        return
-    structure = caps.get_structure(0)
-    (success, width) = structure.get_int('width')
-    (success, height) = structure.get_int('height')
-    buffer = sample.get_buffer()
-
-    # get the image from the buffer and save it to disk
-    im = Image.frombytes('RGB', (width, height),
-                         buffer.extract_dup(0, buffer.get_size()))
+    # save the image to disk
     im.save(dest_path)
     _log.info(f'thumbnail saved to {dest_path}')
 
-    # cleanup
-    pipeline.set_state(Gst.State.NULL)
-
 
 class VideoTranscoder:
     '''
@@ -201,6 +226,49 @@ class VideoTranscoder:
         self.loop.run()
 
 
+    def remux(self, src, dst):
+        '''
+        Put the video and audio streams of the SRC Matroska file in a WebM
+        file at DST as they are, without decoding or encoding them.
+
+        Check that they are fit for WebM with util.can_remux() first.
+        '''
+        self.source_path = src
+        self.destination_path = dst
+
+        self.pipeline = Gst.Pipeline.new('VideoRemuxerPipeline')
+        filesrc = Gst.ElementFactory.make('filesrc', 'filesrc')
+        filesrc.set_property('location', src)
+        demux = Gst.ElementFactory.make('matroskademux', 'demux')
+        webmmux = Gst.ElementFactory.make('webmmux', 'webmmux')
+        filesink = Gst.ElementFactory.make('filesink', 'filesink')
+        filesink.set_property('location', dst)
+        for element in (filesrc, demux, webmmux, filesink):
+            self.pipeline.add(element)
+
+        def on_dynamic_pad(demux, pad):
+            caps = pad.query_caps(None).to_string()
+            if caps.startswith(('video/', 'audio/')):
+                sink = Gst.ElementFactory.make('queue', None)
+                self.pipeline.add(sink)
+                sink.link(webmmux)
+            else:
+                # Subtitles and such have no place in WebM
+                sink = Gst.ElementFactory.make('fakesink', None)
+                self.pipeline.add(sink)
+            sink.sync_state_with_parent()
+            pad.link(sink.get_static_pad('sink'))
+
+        demux.connect('pad-added', on_dynamic_pad)
+        filesrc.link(demux)
+        webmmux.link(filesink)
+
+        self._setup_bus()
+        self.pipeline.set_state(Gst.State.PLAYING)
+        _log.info('Remuxing...')
+        self.loop.run()
+
+
     def _setup_pipeline(self):
         _log.debug('Setting up transcoding pipeline')
         # Create the pipeline bin.
@@ -349,7 +417,7 @@ class VideoTranscoder:
     def _on_message(self, bus, message):
         _log.debug((bus, message, message.type))
         if message.type == Gst.MessageType.EOS:
-            self.dst_data = discover(self.destination_path)
+            self._discover_destination()
             self.__stop()
             _log.info('Done')
         elif message.type == Gst.MessageType.ELEMENT:
@@ -364,18 +432,24 @@ class VideoTranscoder:
                         percent = 100
                     percent_increment = percent - self.progress_percentage
                     self.progress_percentage = percent
-                    if self._progress_callback:
-                        if ACCEPTED_RESOLUTIONS[self.default_resolution] == self.destination_dimensions:
-                            self._progress_callback(percent_increment/self.num_of_resolutions, percent)
-                        else:
-                            self._progress_callback(percent_increment/self.num_of_resolutions)
-                    _log.info('{percent}% of {dest} resolution done..'
-                              '.'.format(percent=percent, dest=self.destination_dimensions))
+                    self._report_progress(percent_increment, percent)
         elif message.type == Gst.MessageType.ERROR:
             _log.error(f'Got error: {message.parse_error()}')
             self.dst_data = None
             self.__stop()
 
+    def _discover_destination(self):
+        self.dst_data = discover(self.destination_path)
+
+    def _report_progress(self, percent_increment, percent):
+        if self._progress_callback:
+            if ACCEPTED_RESOLUTIONS[self.default_resolution] == self.destination_dimensions:
+                self._progress_callback(percent_increment/self.num_of_resolutions, percent)
+            else:
+                self._progress_callback(percent_increment/self.num_of_resolutions)
+        _log.info('{percent}% of {dest} resolution done..'
+                  '.'.format(percent=percent, dest=self.destination_dimensions))
+
     def __stop(self):
         _log.debug(self.loop)
 
@@ -397,6 +471,334 @@ class VideoTranscoder:
         self.loop.quit()
 
 
+class MultiVideoTranscoder(VideoTranscoder):
+    '''
+    Video transcoder for several resolutions at once
+
+    Transcodes the SRC video file to a VP8 WebM video file for each of
+    the DST paths and dimensions it is given.  The video is decoded only
+    once and split with a tee into a videoscale, vp8enc and webmmux
+    branch for each destination.  The audio is encoded once and muxed
+    into all of them.
+
+    Given a start (and stop) time, only that segment of the video is
+    transcoded, see _seek_segment().
+    '''
+    def transcode(self, src, destinations, **kwargs):
+        '''
+        Transcode a video file into each of the (path, (width, height))
+        destinations.
+
+        start and stop, in nanoseconds, limit it to a segment of the video,
+        audio=False leaves the audio out.
+
+        dst_data is None if transcoding failed, otherwise a dict of the
+        discovered data of each destination path.
+        '''
+        self.source_path = src
+        self.destinations = [(dst, tuple(dimensions))
+                             for dst, dimensions in destinations]
+        self.segment_start = kwargs.get('start')
+        self.segment_stop = kwargs.get('stop')
+        self.with_audio = kwargs.get('audio', True)
+
+        self.vp8_quality = kwargs.get('vp8_quality', 8)
+        self.vp8_threads = kwargs.get('vp8_threads', CPU_COUNT - 1)
+        if self.vp8_threads == 0:
+            self.vp8_threads = CPU_COUNT
+        self.vorbis_quality = kwargs.get('vorbis_quality', 0.3)
+
+        self._progress_callback = kwargs.get('progress_callback') or None
+
+        self.data = discover(self.source_path)
+        self._setup_pipeline()
+        self._link_elements()
+        if self.segment_start is None:
+            self.pipeline.set_state(Gst.State.PLAYING)
+        else:
+            # Played once seeked to the segment
+            self.pipeline.set_state(Gst.State.PAUSED)
+        _log.info('Transcoding to {} resolutions...'.format(
+            len(self.destinations)))
+        _log.debug('Initializing MainLoop()')
+        self.loop.run()
+
+    def _make(self, factory, name):
+        element = Gst.ElementFactory.make(factory, name)
+        self.pipeline.add(element)
+        return element
+
+    def _setup_pipeline(self):
+        _log.debug('Setting up multi resolution transcoding pipeline')
+        self.pipeline = Gst.Pipeline.new('MultiVideoTranscoderPipeline')
+
+        self.filesrc = self._make('filesrc', 'filesrc')
+        self.filesrc.set_property('location', self.source_path)
+        self.decoder = self._make('decodebin', 'decoder')
+        self.decoder.connect('pad-added', self._on_dynamic_pad)
+
+        # Video elements shared by all resolutions
+        self.videoqueue = self._make('queue', 'videoqueue')
+        self.videorate = self._make('videorate', 'videorate')
+        self.ratefilter = self._make('capsfilter', 'ratefilter')
+        self.ratefilter.set_property(
+            'caps', Gst.Caps.from_string('video/x-raw,framerate=30/1'))
+        self.progressreport = self._make('progressreport', 'progressreport')
+        self.progressreport.set_property('update-freq', 1)
+        self.progressreport.set_property('silent', True)
+        self.videoconvert = self._make('videoconvert', 'videoconvert')
+        self.videotee = self._make('tee', 'videotee')
+
+        # Audio elements shared by all resolutions
+        self.audioqueue = self._make('queue', 'audioqueue')
+        self.audiorate = self._make('audiorate', 'audiorate')
+        self.audiorate.set_property('tolerance', 80000000)
+        self.audioconvert = self._make('audioconvert', 'audioconvert')
+        self.audiocapsfilter = self._make('capsfilter', 'audiocapsfilter')
+        self.audiocapsfilter.set_property(
+            'caps', Gst.Caps.from_string('audio/x-raw'))
+        self.vorbisenc = self._make('vorbisenc', 'vorbisenc')
+        self.vorbisenc.set_property('quality', self.vorbis_quality)
+        self.audiotee = self._make('tee', 'audiotee')
+        self.audiosink = self._make('fakesink', 'audiosink')
+        self.audiosink.set_property('sync', False)
+
+        # One branch per resolution
+        self.branches = []
+        for idx, (dst, dimensions) in enumerate(self.destinations):
+            branch = {
+                'videoqueue': self._make('queue', f'videoqueue{idx}'),
+                'videoscale': self._make('videoscale', f'videoscale{idx}'),
+                'capsfilter': self._make('capsfilter', f'capsfilter{idx}'),
+                'vp8enc': self._make('vp8enc', f'vp8enc{idx}'),
+                'audioqueue': self._make('queue', f'audioqueue{idx}'),
+                'webmmux': self._make('webmmux', f'webmmux{idx}'),
+                'filesink': self._make('filesink', f'filesink{idx}')}
+            branch['capsfilter'].set_property(
+                'caps', self._scale_caps(dimensions))
+            branch['vp8enc'].set_property('threads', self.vp8_threads)
+            branch['filesink'].set_property('location', dst)
+            self.branches.append(branch)
+
+        if self.segment_start is not None:
+            # Nothing is to reach the sinks before the seek, so they must
+            # not wait for it to go to PAUSED
+            for sink in [b['filesink'] for b in self.branches] + \
+                    [self.audiosink]:
+                sink.set_property('async', False)
+            self.segment_flushed = False
+            self.segment_seeked = False
+            self.videoqueue.get_static_pad('sink').add_probe(
+                Gst.PadProbeType.BUFFER | Gst.PadProbeType.EVENT_DOWNSTREAM,
+                self._segment_probe)
+            self.decoder.connect('no-more-pads', self._on_no_more_pads)
+
+    def _scale_caps(self, dimensions):
+        caps_struct = Gst.Structure.new_empty('video/x-raw')
+        caps_struct.set_value('pixel-aspect-ratio', Gst.Fraction(1, 1))
+        video_info = self.data.get_video_streams()[0]
+        if video_info.get_height() > video_info.get_width():
+            # portrait
+            caps_struct.set_value('height', dimensions[1])
+        else:
+            # landscape
+            caps_struct.set_value('width', dimensions[0])
+        caps = Gst.Caps.new_empty()
+        caps.append_structure(caps_struct)
+        return caps
+
+    def _link_elements(self):
+        _log.debug('linking elements')
+        has_audio = bool(self.data.get_audio_streams())
+        self.filesrc.link(self.decoder)
+        self.videoqueue.link(self.videorate)
+        self.videorate.link(self.ratefilter)
+        self.ratefilter.link(self.progressreport)
+        self.progressreport.link(self.videoconvert)
+        self.videoconvert.link(self.videotee)
+        if has_audio and self.with_audio:
+            self.audioqueue.link(self.audiorate)
+            self.audiorate.link(self.audioconvert)
+            self.audioconvert.link(self.audiocapsfilter)
+            self.audiocapsfilter.link(self.vorbisenc)
+            self.vorbisenc.link(self.audiotee)
+        elif has_audio:
+            self.audioqueue.link(self.audiosink)
+        has_audio = has_audio and self.with_audio
+
+        for branch in self.branches:
+            self.videotee.link(branch['videoqueue'])
+            branch['videoqueue'].link(branch['videoscale'])
+            branch['videoscale'].link(branch['capsfilter'])
+            branch['capsfilter'].link(branch['vp8enc'])
+            branch['vp8enc'].link(branch['webmmux'])
+            if has_audio:
+                self.audiotee.link(branch['audioqueue'])
+                branch['audioqueue'].link(branch['webmmux'])
+            branch['webmmux'].link(branch['filesink'])
+
+        self._setup_bus()
+
+    def _on_no_more_pads(self, dbin):
+        # Seek from the main loop, not this streaming thread
+        GLib.idle_add(self._seek_segment)
+
+    def _seek_segment(self):
+        '''
+        Seek to the segment, from where it starts to where it stops
+
+        The seek is accurate, so decoding starts at the keyframe before
+        the start and the frames before it are dropped: segments fit
+        together without gaps, and each one starts with a keyframe of its
+        own.  The seek is sent straight to the decoder, muxers don't pass
+        seeks on.
+        '''
+        _log.debug(f'Seeking to {self.segment_start}-{self.segment_stop}')
+        seek = Gst.Event.new_seek(
+            1.0, Gst.Format.TIME,
+            Gst.SeekFlags.FLUSH | Gst.SeekFlags.ACCURATE,
+            Gst.SeekType.SET, self.segment_start,
+            Gst.SeekType.NONE if self.segment_stop is None
+            else Gst.SeekType.SET,
+            -1 if self.segment_stop is None else self.segment_stop)
+        if not self.videoqueue.get_static_pad('sink').push_event(seek):
+            _log.error('Seeking to the segment failed')
+            self.dst_data = None
+            self.pipeline.set_state(Gst.State.NULL)
+            self.loop.quit()
+            return False
+        self.pipeline.set_state(Gst.State.PLAYING)
+        return False
+
+    def _segment_probe(self, pad, info):
+        '''
+        Drop the frames decoded before the seek to the segment
+        '''
+        if info.type & Gst.PadProbeType.BUFFER:
+            if self.segment_seeked:
+                return Gst.PadProbeReturn.OK
+            return Gst.PadProbeReturn.DROP
+        event = info.get_event()
+        if event.type == Gst.EventType.FLUSH_STOP:
+            self.segment_flushed = True
+        elif event.type == Gst.EventType.SEGMENT and self.segment_flushed:
+            self.segment_seeked = True
+        return Gst.PadProbeReturn.OK
+
+    def _discover_destination(self):
+        self.dst_data = {dst: discover(dst) for dst, dimensions
+                         in self.destinations}
+
+    def _report_progress(self, percent_increment, percent):
+        # All resolutions are done at the same pace
+        if self._progress_callback:
+            self._progress_callback(percent_increment, percent)
+        _log.info(f'{percent}% of all resolutions done...')
+
+
+class AudioTrackTranscoder(VideoTranscoder):
+    '''
+    Transcodes the audio of the SRC video file to a Vorbis WebM file at
+    DST, leaving the video out
+    '''
+    def transcode(self, src, dst, **kwargs):
+        self.source_path = src
+        self.destination_path = dst
+        self.vorbis_quality = kwargs.get('vorbis_quality', 0.3)
+
+        self.pipeline = Gst.Pipeline.new('AudioTrackTranscoderPipeline')
+        elements = {}
+        for name in ('filesrc', 'decodebin', 'audioqueue', 'audiorate',
+                     'audioconvert', 'vorbisenc', 'webmmux', 'filesink',
+                     'videoqueue', 'fakesink'):
+            factory = {'audioqueue': 'queue', 'videoqueue': 'queue'}.get(
+                name, name)
+            elements[name] = Gst.ElementFactory.make(factory, name)
+            self.pipeline.add(elements[name])
+        elements['filesrc'].set_property('location', src)
+        elements['audiorate'].set_property('tolerance', 80000000)
+        elements['vorbisenc'].set_property('quality', self.vorbis_quality)
+        elements['filesink'].set_property('location', dst)
+        elements['fakesink'].set_property('sync', False)
+
+        def on_dynamic_pad(dbin, pad):
+            name = pad.query_caps(None).to_string()
+            if name.startswith('audio'):
+                pad.link(elements['audioqueue'].get_static_pad('sink'))
+            else:
+                pad.link(elements['videoqueue'].get_static_pad('sink'))
+
+        elements['decodebin'].connect('pad-added', on_dynamic_pad)
+        elements['filesrc'].link(elements['decodebin'])
+        for src_name, sink_name in (('audioqueue', 'audiorate'),
+                                    ('audiorate', 'audioconvert'),
+                                    ('audioconvert', 'vorbisenc'),
+                                    ('vorbisenc', 'webmmux'),
+                                    ('webmmux', 'filesink'),
+                                    ('videoqueue', 'fakesink')):
+            elements[src_name].link(elements[sink_name])
+
+        self._setup_bus()
+        self.pipeline.set_state(Gst.State.PLAYING)
+        _log.info('Transcoding audio...')
+        self.loop.run()
+
+
+class SegmentJoiner(VideoTranscoder):
+    '''
+    Joins video-only WebM segments, and optionally a WebM audio track,
+    into a single WebM file without transcoding them again
+    '''
+    def join(self, segments, dst, audio=None):
+        self.destination_path = dst
+
+        self.pipeline = Gst.Pipeline.new('SegmentJoinerPipeline')
+        concat = Gst.ElementFactory.make('concat', 'concat')
+        videoqueue = Gst.ElementFactory.make('queue', 'videoqueue')
+        webmmux = Gst.ElementFactory.make('webmmux', 'webmmux')
+        filesink = Gst.ElementFactory.make('filesink', 'filesink')
+        filesink.set_property('location', dst)
+        for element in (concat, videoqueue, webmmux, filesink):
+            self.pipeline.add(element)
+
+        def link_demuxed(demux, pad, sinkpad):
+            if not sinkpad.is_linked():
+                pad.link(sinkpad)
+
+        for idx, segment in enumerate(segments):
+            filesrc = Gst.ElementFactory.make('filesrc', f'filesrc{idx}')
+            filesrc.set_property('location', segment)
+            demux = Gst.ElementFactory.make('matroskademux', f'demux{idx}')
+            self.pipeline.add(filesrc)
+            self.pipeline.add(demux)
+            filesrc.link(demux)
+            # Concat pads are played in the order they were requested in
+            demux.connect('pad-added', link_demuxed,
+                          concat.get_request_pad('sink_%u'))
+
+        concat.link(videoqueue)
+        videoqueue.link(webmmux)
+
+        if audio:
+            audiosrc = Gst.ElementFactory.make('filesrc', 'audiosrc')
+            audiosrc.set_property('location', audio)
+            audiodemux = Gst.ElementFactory.make('matroskademux', 'audiodemux')
+            audioqueue = Gst.ElementFactory.make('queue', 'audioqueue')
+            for element in (audiosrc, audiodemux, audioqueue):
+                self.pipeline.add(element)
+            audiosrc.link(audiodemux)
+            audiodemux.connect('pad-added', link_demuxed,
+                               audioqueue.get_static_pad('sink'))
+            audioqueue.link(webmmux)
+
+        webmmux.link(filesink)
+
+        self._setup_bus()
+        self.pipeline.set_state(Gst.State.PLAYING)
+        _log.info(f'Joining {len(segments)} segments...')
+        self.loop.run()
+
+
 if __name__ == '__main__':
     os.nice(19)
     from optparse import OptionParser
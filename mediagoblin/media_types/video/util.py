@@ -85,3 +85,60 @@ def skip_transcode(metadata, size):
                 return False
 
     return True
+
+
+def can_remux(metadata, size):
+    '''
+    Checks video metadata against configuration values for remux.
+
+    Returns True if the streams of the video can be put in a WebM file of
+    at most size as they are, without transcoding them.
+    '''
+    config = mgg.global_config['plugins']['mediagoblin.media_types.video']\
+            ['remux']
+
+    if not config['enabled']:
+        return False
+
+    def matches(tags, tag, accepted):
+        if not tags:
+            return False
+        found, value = tags.get_string(tag)
+        return found and any(name in value for name in accepted)
+
+    if not matches(metadata.get_tags(), 'container-format',
+                   config['container_formats']):
+        return False
+
+    video_streams = metadata.get_video_streams()
+    if not video_streams:
+        return False
+
+    for video_info in video_streams:
+        if not matches(video_info.get_tags(), 'video-codec',
+                       config['video_codecs']):
+            return False
+        if not video_info.get_height() <= size[1]:
+            return False
+        if not video_info.get_width() <= size[0]:
+            return False
+
+    for audio_info in metadata.get_audio_streams():
+        if not matches(audio_info.get_tags(), 'audio-codec',
+                       config['audio_codecs']):
+            return False
+
+    return True
+
+
+def remux_resolution(metadata, resolutions):
+    '''
+    Returns the smallest of resolutions the video can be remuxed to, or
+    None.  Remuxing to a larger one would make the very same file, so the
+    video only needs remuxing to this one.
+    '''
+    fitting = [resolution for resolution in resolutions
+               if can_remux(metadata, ACCEPTED_RESOLUTIONS[resolution])]
+    if not fitting:
+        return None
+    return min(fitting, key=lambda resolution: ACCEPTED_RESOLUTIONS[resolution])
@@ -35,4 +35,7 @@ moderation_routes = [
         'mediagoblin.moderation.views:ban_or_unban'),
     ('mediagoblin.moderation.reports_detail',
         '/reports/<int:report_id>/',
-        'mediagoblin.moderation.views:moderation_reports_detail')]
+        'mediagoblin.moderation.views:moderation_reports_detail'),
+    ('mediagoblin.moderation.sql_stats',
+        '/sql_stats/',
+        'mediagoblin.moderation.views:sql_stats')]
@@ -17,6 +17,7 @@
 from mediagoblin import mg_globals
 from mediagoblin.db.models import User, Privilege, UserBan, LocalUser
 from mediagoblin.db.base import Session
+from mediagoblin.db.identity import refresh_bans
 from mediagoblin.tools.mail import send_email
 from mediagoblin.tools.response import redirect
 from datetime import datetime
@@ -182,6 +183,7 @@ def ban_user(user_id, expiration_date=None, reason=None):
         user_id=user_id,
         expiration_date=expiration_date,
         reason=reason)
+    refresh_bans()
     return new_user_ban
 
 def unban_user(user_id):
@@ -198,6 +200,7 @@ def unban_user(user_id):
     if user_ban.count() == 0:
         return False
     user_ban.first().delete()
+    refresh_bans()
     return True
 
 def parse_report_panel_settings(form):
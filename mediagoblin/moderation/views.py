@@ -15,12 +15,16 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+from mediagoblin import mg_globals
+from mediagoblin.db.counters import count_rows, get_media_count
+from mediagoblin.db.instrumentation import get_aggregate_query_stats
 from mediagoblin.db.models import (MediaEntry, User, Report, Privilege,
                                    UserBan, LocalUser)
 from mediagoblin.decorators import (require_admin_or_moderator_login,
                                     active_user_from_url, user_has_privilege,
                                     allow_reporting)
-from mediagoblin.tools.response import render_to_response, redirect
+from mediagoblin.tools.response import (render_to_response, redirect,
+                                        render_404, json_response)
 from mediagoblin.moderation import forms as moderation_forms
 from mediagoblin.moderation.tools import (take_punitive_actions, \
     take_away_privileges, give_privileges, ban_user, unban_user, \
@@ -47,7 +51,9 @@ def moderation_media_processing_panel(request):
         request,
         'mediagoblin/moderation/media_panel.html',
         {'processing_entries': processing_entries,
+         'num_processing': get_media_count('processing'),
          'failed_entries': failed_entries,
+         'num_failed': get_media_count('failed'),
          'processed_entries': processed_entries})
 
 @require_admin_or_moderator_login
@@ -65,7 +71,7 @@ def moderation_users_panel(request):
     user_list = all_user_list.order_by(
         User.created.desc()).offset(
             (current_page-1)*10).limit(10)
-    last_page = int(ceil(all_user_list.count()/10.))
+    last_page = int(ceil(count_rows(all_user_list)/10.))
 
     return render_to_response(
         request,
@@ -133,8 +139,8 @@ def moderation_reports_panel(request):
         Report.created.desc()).offset(
             (closed_settings['current_page']-1)*10).limit(10)
 
-    active_settings['last_page'] = int(ceil(all_active.count()/10.))
-    closed_settings['last_page'] = int(ceil(all_closed.count()/10.))
+    active_settings['last_page'] = int(ceil(count_rows(all_active)/10.))
+    closed_settings['last_page'] = int(ceil(count_rows(all_closed)/10.))
     # Render to response
     return render_to_response(
         request,
@@ -217,3 +223,13 @@ def ban_or_unban(request, url_user):
         request,
         'mediagoblin.moderation.users_detail',
         user=url_user.username)
+
+@user_has_privilege('admin')
+def sql_stats(request):
+    """
+    Running SQL query totals per controller, as collected with sql_stats
+    """
+    if not mg_globals.app_config['sql_stats']:
+        return render_404(request)
+
+    return json_response(get_aggregate_query_stats(), _disable_cors=True)
@@ -16,13 +16,18 @@
 
 import logging
 
+from mediagoblin import mg_globals
 from mediagoblin.db.models import Notification, CommentSubscription, User, \
                                   Comment, GenericModelReference
 from mediagoblin.notifications.task import email_notification_task
 from mediagoblin.notifications.tools import generate_comment_message
+from mediagoblin.tools.cache import TTLCache
 
 _log = logging.getLogger(__name__)
 
+# Unseen notification counts shown in the header of every page, by user id
+_unseen_counts = TTLCache(maxsize=4096)
+
 def trigger_notification(comment, media_entry, request):
     '''
     Send out notifications about a new comment.
@@ -51,6 +56,7 @@ def trigger_notification(comment, media_entry, request):
         )
         cn.obj = comment
         cn.save()
+        _unseen_counts.invalidate(subscription.user_id)
 
         if subscription.send_email:
             message = generate_comment_message(
@@ -67,6 +73,7 @@ def mark_notification_seen(notification):
     if notification:
         notification.seen = True
         notification.save()
+        _unseen_counts.invalidate(notification.user_id)
 
 
 def mark_comment_notification_seen(comment_id, user):
@@ -166,16 +173,18 @@ def get_notifications(user_id, only_unseen=True):
 
 def get_notification_count(user_id, only_unseen=True):
     query = Notification.query.filter_by(user_id=user_id)
-    wants_notifications = User.query.filter_by(id=user_id).first()\
-        .wants_notifications
-
-    if only_unseen:
-        query = query.filter_by(seen=False)
+    # Usually the request's user, so get() avoids another query
+    wants_notifications = User.query.get(user_id).wants_notifications
 
     # If the user doesn't want notifications, don't show any
     if not wants_notifications:
-        count = None
-    else:
-        count = query.count()
+        return None
+
+    if not only_unseen:
+        return query.count()
 
-    return count
+    # New notifications and marking them seen invalidate the cached count,
+    # anything else going around those functions shows up within the TTL
+    return _unseen_counts.get_or_set(
+        user_id, query.filter_by(seen=False).count,
+        mg_globals.app_config['count_cache_ttl'])
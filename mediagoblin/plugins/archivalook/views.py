@@ -16,10 +16,11 @@
 from mediagoblin import mg_globals
 from mediagoblin.db.base import Session
 from mediagoblin.db.models import MediaEntry
+from mediagoblin.db.util import with_gallery_loading
 from mediagoblin.decorators import uses_pagination, user_not_banned,\
                                   user_has_privilege, get_user_media_entry
 from mediagoblin.tools.response import render_to_response, redirect
-from mediagoblin.tools.pagination import Pagination
+from mediagoblin.tools.pagination import KeysetPagination
 
 from mediagoblin.plugins.archivalook.tools import (
                                         split_featured_media_list,
@@ -101,8 +102,11 @@ def recent_media_gallery_view(request, page):
     """
     cursor = MediaEntry.query.filter_by(state='processed').\
         order_by(MediaEntry.created.desc())
+    cursor = with_gallery_loading(cursor)
 
-    pagination = Pagination(page, cursor)
+    pagination = KeysetPagination(
+        page, cursor,
+        before=request.GET.get('before'), after=request.GET.get('after'))
     media_entries = pagination()
     return render_to_response(
         request, 'archivalook/recent_media.html',
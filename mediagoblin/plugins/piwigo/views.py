@@ -14,9 +14,13 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import base64
+import binascii
+import io
 import logging
 import re
 
+from werkzeug.datastructures import FileStorage
 from werkzeug.exceptions import MethodNotAllowed, BadRequest, NotImplemented
 from werkzeug.wrappers import BaseResponse
 
@@ -26,6 +30,11 @@ from mediagoblin.auth.tools import check_login_simple
 from mediagoblin.submit.lib import \
     submit_media, check_file_field, \
     FileUploadLimit, UserUploadLimit, UserPastUploadLimit
+from mediagoblin.submit.chunked import \
+    new_upload_session, get_upload_session, store_chunk, open_upload, \
+    discard_upload_session, ChunkRejected, UploadIncomplete, \
+    UploadVerificationError
+from mediagoblin.media_types import FileTypeNotSupported
 
 from mediagoblin.user_pages.lib import add_media_to_collection
 from mediagoblin.db.models import Collection
@@ -110,34 +119,25 @@ def pwg_images_exist(request):
     return {}
 
 
-@CmdTable("pwg.images.addSimple", True)
-def pwg_images_addSimple(request):
-    form = AddSimpleForm(request.form)
-    if not form.validate():
-        _log.error("addSimple: form failed")
-        raise BadRequest()
-    dump = []
-    for f in form:
-        dump.append(f"{f.name}={f.data!r}")
-    _log.info("addSimple: %r %s %r", request.form, " ".join(dump),
-              request.files)
-
-    if not check_file_field(request, 'image'):
-        raise BadRequest()
-
+def _submit_pwg_media(request, submitted_file, filename, title,
+                      description, collection_ids):
+    """
+    Submit a piwigo upload and add it to the collections it's meant for
+    """
     try:
         entry = submit_media(
             mg_app=request.app, user=request.user,
-            submitted_file=request.files['image'],
-            filename=request.files['image'].filename,
-            title=str(form.name.data),
-            description=str(form.comment.data))
-
-        collection_id = form.category.data
-        if collection_id > 0:
-            collection = Collection.query.get(collection_id)
-            if collection is not None and collection.actor == request.user.id:
-                add_media_to_collection(collection, entry, "")
+            submitted_file=submitted_file,
+            filename=filename,
+            title=title,
+            description=description)
+
+        for collection_id in collection_ids:
+            if collection_id and collection_id > 0:
+                collection = Collection.query.get(collection_id)
+                if collection is not None \
+                        and collection.actor == request.user.id:
+                    add_media_to_collection(collection, entry, "")
 
         return {
             'image_id': entry.id,
@@ -158,6 +158,26 @@ def pwg_images_addSimple(request):
             _('Sorry, you have reached your upload limit.'))
 
 
+@CmdTable("pwg.images.addSimple", True)
+def pwg_images_addSimple(request):
+    form = AddSimpleForm(request.form)
+    if not form.validate():
+        _log.error("addSimple: form failed")
+        raise BadRequest()
+    dump = []
+    for f in form:
+        dump.append(f"{f.name}={f.data!r}")
+    _log.info("addSimple: %r %s %r", request.form, " ".join(dump),
+              request.files)
+
+    if not check_file_field(request, 'image'):
+        raise BadRequest()
+
+    return _submit_pwg_media(
+        request, request.files['image'], request.files['image'].filename,
+        str(form.name.data), str(form.comment.data), [form.category.data])
+
+
 md5sum_matcher = re.compile(r"^[0-9a-fA-F]{32}$")
 
 
@@ -172,6 +192,10 @@ def fetch_md5(request, parm_name, optional_parm=False):
     return val
 
 
+def _pwg_upload_id(request, original_sum):
+    return f"pwg-{request.user.id}-{original_sum.lower()}"
+
+
 @CmdTable("pwg.images.addChunk", True)
 def pwg_images_addChunk(request):
     o_sum = fetch_md5(request, 'original_sum')
@@ -191,6 +215,26 @@ def pwg_images_addChunk(request):
         _log.info("addChunk: Ignoring thumb, because we create our own")
         return True
 
+    if not request.user:
+        return PwgError(401, 'Access denied')
+
+    try:
+        data = base64.b64decode(data, validate=True)
+    except binascii.Error:
+        raise BadRequest("Chunk data is not base64")
+
+    upload_id = _pwg_upload_id(request, o_sum)
+    session = get_upload_session(request.user, upload_id)
+    if session is None:
+        # The file name only comes with pwg.images.add
+        session = new_upload_session(
+            request.user, o_sum, upload_id=upload_id, indexed=True)
+
+    try:
+        store_chunk(request.app.queue_store, session, pos, io.BytesIO(data))
+    except ChunkRejected as e:
+        raise BadRequest(str(e))
+
     return True
 
 
@@ -200,7 +244,48 @@ def pwg_images_add(request):
     form = AddForm(request.form)
     check_form(form)
 
-    return {'image_id': 123456, 'url': ''}
+    if not request.user:
+        return PwgError(401, 'Access denied')
+
+    session = get_upload_session(
+        request.user, _pwg_upload_id(request, form.original_sum.data))
+    if session is None:
+        return PwgError(500, 'No chunks were uploaded for this image')
+
+    # file_sum is the md5 of what was actually sent, which is only
+    # different from the original if the client resized it
+    session.checksum = "md5:{}".format(
+        form.file_sum.data or form.original_sum.data)
+
+    collection_ids = []
+    for category in (form.categories.data or "").split(";"):
+        # "<id>" or "<id>,<rank>"
+        category = category.split(",")[0].strip()
+        if category.lstrip("-").isdigit():
+            collection_ids.append(int(category))
+
+    queue_store = request.app.queue_store
+    try:
+        upload = open_upload(queue_store, session)
+    except UploadIncomplete:
+        return PwgError(500, 'Not all chunks of this image were uploaded')
+
+    filename = form.name.data or form.original_sum.data
+    try:
+        with upload:
+            result = _submit_pwg_media(
+                request, FileStorage(stream=upload, filename=filename),
+                filename, str(form.name.data or ""), "", collection_ids)
+    except UploadVerificationError as e:
+        _log.error("add: %s", e)
+        discard_upload_session(queue_store, session)
+        return PwgError(500, 'Uploaded image is damaged')
+    except FileTypeNotSupported:
+        discard_upload_session(queue_store, session)
+        return PwgError(500, 'Unsupported file type')
+
+    discard_upload_session(queue_store, session)
+    return result
 
 
 @csrf_exempt
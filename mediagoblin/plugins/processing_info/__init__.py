@@ -19,7 +19,7 @@ import logging
 import os
 
 from mediagoblin.tools.pluginapi import get_config
-from mediagoblin.db.models import MediaEntry
+from mediagoblin.db.counters import get_media_count
 from mediagoblin.tools import pluginapi
 
 _log = logging.getLogger(__name__)
@@ -36,12 +36,8 @@ def make_stats(context):
     request = context['request']
     user = request.user
     if user:
-        num_queued = MediaEntry.query.filter_by(
-                actor=user.id, state='processing').count()
-        context['num_queued'] = num_queued
-        num_failed = MediaEntry.query.filter_by(
-                actor=user.id, state='failed').count()
-        context['num_failed'] = num_failed
+        context['num_queued'] = get_media_count('processing', actor=user.id)
+        context['num_failed'] = get_media_count('failed', actor=user.id)
     return context
 
 
@@ -46,7 +46,7 @@ def get_client():
     return client
 
 
-def setup_celery():
+def setup_celery(celery_app=None):
     from raven.contrib.celery import register_signal
 
     client = get_client()
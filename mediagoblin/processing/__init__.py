@@ -21,12 +21,19 @@ try:
 except:
     OrderedDict = None
 
+import copy
 import logging
 import os
+import time
+
+from sqlalchemy import case, func, inspect
 
 from mediagoblin import mg_globals as mgg
+from mediagoblin.db.base import Session
+from mediagoblin.db.counters import count_state_change
 from mediagoblin.db.util import atomic_update
-from mediagoblin.db.models import MediaEntry
+from mediagoblin.db.models import MediaEntry, MediaFile
+from mediagoblin.tools.files import shared_media_files
 from mediagoblin.tools.pluginapi import hook_handle
 from mediagoblin.tools.translate import lazy_pass_to_ugettext as _
 
@@ -34,18 +41,69 @@ _log = logging.getLogger(__name__)
 
 
 class ProgressCallback:
-    def __init__(self, entry):
+    """
+    Add up the transcoding progress of an entry
+
+    Progress messages come in often, so they are written at most every
+    min_interval seconds, once they add up to min_delta percent, and
+    when flush() is called at the end.  Only the progress columns are
+    written, and the increment is added up by the database, so tasks
+    transcoding other resolutions of the same entry at the same time
+    don't undo each other's progress.
+
+    default_quality_progress is the progress of the default resolution
+    so far, or with add_main_progress, another part of it done, for
+    tasks each transcoding part of the default resolution.
+    """
+    min_delta = 1
+    min_interval = 2
+    # The increments are rounded, so this close to 100 percent is done
+    done_margin = 0.5
+
+    def __init__(self, entry, add_main_progress=False):
         self.entry = entry
+        self.add_main_progress = add_main_progress
+        self.pending_progress = 0
+        self.main_progress = None
+        self.last_write = None
 
     def __call__(self, progress, default_quality_progress=None):
         if progress:
-            if 100 - (self.entry.transcoding_progress + progress) < 0.01:
-                self.entry.transcoding_progress = 100
-            else:
-                self.entry.transcoding_progress += round(progress, 2)
-            if default_quality_progress:
-                self.entry.main_transcoding_progress = default_quality_progress
-            self.entry.save()
+            self.pending_progress += progress
+            if default_quality_progress and self.add_main_progress:
+                self.main_progress = \
+                    (self.main_progress or 0) + default_quality_progress
+            elif default_quality_progress:
+                self.main_progress = default_quality_progress
+            if self.main_progress == 100 or (
+                    self.pending_progress >= self.min_delta
+                    and (self.last_write is None
+                         or time.monotonic() - self.last_write
+                         >= self.min_interval)):
+                self.flush()
+
+    def flush(self):
+        """ Write the progress not written yet """
+        if not self.pending_progress and self.main_progress is None:
+            return
+        progress = func.coalesce(MediaEntry.transcoding_progress, 0) \
+            + round(self.pending_progress, 2)
+        values = {MediaEntry.transcoding_progress: case(
+            [(100 - progress < self.done_margin, 100)], else_=progress)}
+        if self.main_progress is not None and self.add_main_progress:
+            main_progress = \
+                func.coalesce(MediaEntry.main_transcoding_progress, 0) \
+                + round(self.main_progress, 2)
+            values[MediaEntry.main_transcoding_progress] = case(
+                [(100 - main_progress < self.done_margin, 100)],
+                else_=main_progress)
+        elif self.main_progress is not None:
+            values[MediaEntry.main_transcoding_progress] = \
+                self.main_progress
+        atomic_update(MediaEntry, {'id': self.entry.id}, values)
+        self.pending_progress = 0
+        self.main_progress = None
+        self.last_write = time.monotonic()
 
 
 def create_pub_filepath(entry, filename):
@@ -322,6 +380,10 @@ def mark_entry_failed(entry_id, exc):
     :param exc: An instance of BaseProcessingFail
 
     """
+    # atomic_update() goes around the ORM, so the counters are adjusted
+    # here rather than by the flush hooks.
+    count_state_change(Session(), entry_id, 'failed')
+
     # Was this a BaseProcessingFail?  In other words, was this a
     # type of error that we know how to handle?
     if isinstance(exc, BaseProcessingFail):
@@ -384,7 +446,9 @@ def store_public(entry, keyname, local_file, target_name=None,
         _log.warn("store_public: keyname %r already used for file %r, "
                   "replacing with %r", keyname,
                   entry.media_files[keyname], target_filepath)
-        if delete_if_exists:
+        # Files shared with a duplicate entry stay for that entry
+        if delete_if_exists and tuple(entry.media_files[keyname]) \
+                not in shared_media_files(entry):
             mgg.public_store.delete_file(entry.media_files[keyname])
     try:
         mgg.public_store.copy_local_to_storage(local_file, target_filepath)
@@ -402,6 +466,57 @@ def copy_original(entry, orig_filename, target_name, keyname="original"):
     store_public(entry, keyname, orig_filename, target_name)
 
 
+def find_duplicate_media(entry):
+    """
+    Find an already processed media entry with the same content as
+    entry, or None
+    """
+    if not entry.content_hash:
+        return None
+    return MediaEntry.query.filter(
+        MediaEntry.content_hash == entry.content_hash,
+        MediaEntry.media_type == entry.media_type,
+        MediaEntry.state == 'processed',
+        MediaEntry.id != entry.id).order_by(MediaEntry.id).first()
+
+
+def reuse_processed_media(entry, original):
+    """
+    Give entry the files and media data of original, which has the same
+    content, instead of processing it again
+
+    Both entries reference the same files in the public store afterwards.
+    Those are marked with the content hash, so they are only deleted
+    along with the last entry using them.
+    """
+    for name, media_file in original.media_files_helper.items():
+        media_file.content_hash = original.content_hash
+        file_metadata = media_file.file_metadata
+        if file_metadata is not None:
+            file_metadata = copy.deepcopy(dict(file_metadata))
+        entry.media_files_helper[name] = MediaFile(
+            name=name,
+            file_path=media_file.file_path,
+            file_metadata=file_metadata,
+            content_hash=original.content_hash)
+
+    media_data = original.media_data
+    if media_data is not None:
+        entry.media_data_init(**{
+            column.key: copy.deepcopy(getattr(media_data, column.key))
+            for column in inspect(media_data).mapper.column_attrs
+            if column.key != 'media_entry'})
+
+    entry.transcoding_progress = original.transcoding_progress
+    entry.main_transcoding_progress = original.main_transcoding_progress
+
+    # The queued upload isn't needed, the original's copy is kept
+    if entry.queued_media_file:
+        mgg.queue_store.delete_file(entry.queued_media_file)
+        mgg.queue_store.delete_dir(entry.queued_media_file[:-1])
+        entry.queued_media_file = []
+
+
 class BaseProcessingFail(Exception):
     """
     Base exception that all other processing failure messages should
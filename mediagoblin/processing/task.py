@@ -24,7 +24,8 @@ from celery.registry import tasks
 from mediagoblin import mg_globals as mgg
 from . import mark_entry_failed, BaseProcessingFail
 from mediagoblin.tools.processing import json_processing_callback
-from mediagoblin.processing import get_entry_and_processing_manager
+from mediagoblin.processing import get_entry_and_processing_manager, \
+    find_duplicate_media, reuse_processed_media
 
 _log = logging.getLogger(__name__)
 logging.basicConfig()
@@ -90,28 +91,38 @@ class ProcessMedia(celery.Task):
 
         # Try to process, and handle expected errors.
         try:
-            processor_class = manager.get_processor(reprocess_action, entry)
-
-            with processor_class(manager, entry) as processor:
-                # Initial state change has to be here because
-                # the entry.state gets recorded on processor_class init
-                entry.state = 'processing'
-                entry.save()
-
-                _log.debug(f'Processing {entry}')
-
-                try:
-                    processor.process(**reprocess_info)
-                except Exception as exc:
-                    if processor.entry_orig_state == 'processed':
-                        _log.error(
-                            'Entry {} failed to process due to the following'
-                            ' error: {}'.format(entry.id, exc))
-                        _log.info(
-                            'Setting entry.state back to "processed"')
-                        pass
-                    else:
-                        raise
+            original = None
+            if reprocess_action == 'initial' \
+                    and mgg.app_config['deduplicate_media']:
+                original = find_duplicate_media(entry)
+
+            if original is not None:
+                _log.info(f'{entry} is a duplicate of {original}, '
+                          'sharing its files')
+                reuse_processed_media(entry, original)
+            else:
+                processor_class = manager.get_processor(reprocess_action, entry)
+
+                with processor_class(manager, entry) as processor:
+                    # Initial state change has to be here because
+                    # the entry.state gets recorded on processor_class init
+                    entry.state = 'processing'
+                    entry.save()
+
+                    _log.debug(f'Processing {entry}')
+
+                    try:
+                        processor.process(**reprocess_info)
+                    except Exception as exc:
+                        if processor.entry_orig_state == 'processed':
+                            _log.error(
+                                'Entry {} failed to process due to the following'
+                                ' error: {}'.format(entry.id, exc))
+                            _log.info(
+                                'Setting entry.state back to "processed"')
+                            pass
+                        else:
+                            raise
 
             # We set the state to processed and save the entry here so there's
             # no need to save at the end of the processing stage, probably ;)
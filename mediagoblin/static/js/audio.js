@@ -210,6 +210,67 @@ var audioPlayer = new Object();
         audioPlayer.imageElement = im;
 
     };
+
+    audioPlayer.drawWaveform = function (url) {
+        /**
+         * Fetch the precomputed waveform peaks at url and draw them over
+         * the spectrogram, once it has its final size
+         */
+        $.getJSON(url, function (waveform) {
+            var im = audioPlayer.imageElement;
+            if (im[0].complete) {
+                drawPeaks(waveform);
+            } else {
+                im.one('load', function () { drawPeaks(waveform); });
+            }
+        });
+    };
+
+    function drawPeaks(waveform) {
+        var canvas = $('.audio-spectrogram .audio-waveform')[0];
+        if (!canvas || !canvas.getContext || !waveform.levels.length) {
+            return;
+        }
+
+        var width = audioPlayer.imageElement.width();
+        var height = audioPlayer.imageElement.height();
+        canvas.width = width;
+        canvas.height = height;
+
+        /*
+         * Levels are finest first, use the coarsest one that still has
+         * a peak for every pixel
+         */
+        var level = waveform.levels[0];
+        for (var i = 1; i < waveform.levels.length; i++) {
+            if (waveform.levels[i].length >= width) {
+                level = waveform.levels[i];
+            }
+        }
+
+        var scale = Math.pow(2, waveform.bits - 1);
+        var middle = height / 2;
+        var context = canvas.getContext('2d');
+        context.fillStyle = 'rgba(255, 255, 255, 0.5)';
+
+        for (var x = 0; x < width; x++) {
+            var start = Math.floor(x * level.length / width);
+            var stop = Math.max(
+                start + 1, Math.floor((x + 1) * level.length / width));
+            var min = scale;
+            var max = -scale;
+            for (var peak = start; peak < stop && peak < level.length; peak++) {
+                min = Math.min(min, level.data[2 * peak]);
+                max = Math.max(max, level.data[2 * peak + 1]);
+            }
+            if (min > max) {
+                continue;
+            }
+            var top = middle - max / scale * middle;
+            var bottom = middle - min / scale * middle;
+            context.fillRect(x, top, 1, Math.max(1, bottom - top));
+        }
+    }
 })(audioPlayer);
 
 $(document).ready(function () {
@@ -222,4 +283,9 @@ $(document).ready(function () {
     audioElements = $('.audio-media .audio-player');
     audioPlayer.init(audioElements[0]);
     audioPlayer.attachToImage($('.audio-spectrogram img')[0]);
+
+    var waveformUrl = $(audioElements[0]).attr('data-waveform');
+    if (waveformUrl && audioPlayer.imageElement.length) {
+        audioPlayer.drawWaveform(waveformUrl);
+    }
 });
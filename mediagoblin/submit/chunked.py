@@ -0,0 +1,358 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Resumable uploads.
+
+A client opens an UploadSession and then sends the file in chunks, in
+any order and as many at a time as it likes.  Each chunk is streamed
+into its own file in the queue store and only recorded in the database
+once all of it has arrived, so an interrupted chunk is simply sent
+again.  When everything is there, open_upload() gives a file-like object
+reading the chunks back in order, which is handed to the usual
+submission code and checked against the size and checksum the client
+announced as it is read.
+"""
+
+import datetime
+import hashlib
+import io
+import logging
+import uuid
+
+from sqlalchemy.exc import IntegrityError
+
+from mediagoblin import mg_globals
+from mediagoblin.db.base import Session
+from mediagoblin.db.models import UploadSession, UploadChunk
+from mediagoblin.storage import NotImplementedError as StorageNotImplemented
+from mediagoblin.submit.lib import get_upload_file_limits, write_queue_file
+
+
+_log = logging.getLogger(__name__)
+
+# Upload sessions nobody has sent anything to for this long are thrown
+# away by collect_garbage
+UPLOAD_SESSION_LIFETIME = datetime.timedelta(days=1)
+
+CHECKSUM_ALGORITHMS = ('md5', 'sha1', 'sha256')
+
+
+class UploadSessionError(Exception):
+    """
+    General exception for problems with a chunked upload
+    """
+    pass
+
+
+class ChunkRejected(UploadSessionError):
+    """
+    A chunk was damaged on the way or doesn't fit the upload
+    """
+    pass
+
+
+class UploadTooLarge(ChunkRejected):
+    """
+    The chunks add up to more than the user may upload
+    """
+    pass
+
+
+class UploadIncomplete(UploadSessionError):
+    """
+    Some parts of the upload haven't arrived yet
+    """
+    pass
+
+
+class UploadVerificationError(UploadSessionError):
+    """
+    The assembled upload isn't the file the client announced
+    """
+    pass
+
+
+def parse_checksum(checksum):
+    """
+    Split an "<algorithm>:<hex digest>" checksum, raising ValueError if
+    it isn't one we can check
+    """
+    algorithm, _, digest = checksum.partition(':')
+    algorithm = algorithm.lower()
+    if algorithm not in CHECKSUM_ALGORITHMS or not digest:
+        raise ValueError(f'Unsupported checksum {checksum!r}')
+    try:
+        int(digest, 16)
+    except ValueError:
+        raise ValueError(f'Checksum {checksum!r} is not hexadecimal')
+    return algorithm, digest.lower()
+
+
+def new_upload_session(user, filename, content_type=None, total_size=None,
+                       chunk_size=None, checksum=None, upload_id=None,
+                       indexed=False):
+    """
+    Start a resumable upload for user
+
+    checksum is an optional "<algorithm>:<hex digest>" of the whole file
+    which the upload is checked against once it is put together.
+    """
+    if checksum is not None:
+        checksum = ':'.join(parse_checksum(checksum))
+
+    session = UploadSession()
+    session.upload_id = upload_id or uuid.uuid4().hex
+    session.actor = user.id
+    session.filename = filename
+    session.content_type = content_type
+    session.total_size = total_size
+    session.chunk_size = chunk_size
+    session.checksum = checksum
+    session.indexed = indexed
+    session.save()
+    return session
+
+
+def get_upload_session(user, upload_id):
+    """ Get one of user's upload sessions, or None """
+    return UploadSession.query.filter_by(
+        upload_id=upload_id, actor=user.id).first()
+
+
+def store_chunk(queue_store, session, position, data, md5=None):
+    """
+    Stream the chunk at position from the file-like data into the queue
+    store and record it on session
+
+    md5 is the hex digest the client claims for the chunk.  Chunks not
+    matching it, or going past the announced end of the upload, are
+    deleted again and ChunkRejected is raised.  So are chunks taking the
+    upload past max_file_size or the user's upload_limit, whether or not
+    its size was announced, with UploadTooLarge.  Sending a chunk for the
+    same position again replaces the earlier one.
+    """
+    if position < 0:
+        raise ChunkRejected('Chunk position must not be negative')
+
+    # Every attempt goes to a file of its own, so a chunk which is being
+    # replaced stays intact until the new one is complete
+    filepath = ['upload_sessions', session.upload_id,
+                f'{position}-{uuid.uuid4().hex}']
+    digest = hashlib.md5()
+    try:
+        size = write_queue_file(
+            queue_store.get_file(filepath, 'wb'), data, [digest])
+    except Exception:
+        queue_store.delete_file(filepath)
+        raise
+
+    problem = None
+    if size == 0:
+        problem = 'Chunk is empty'
+    elif md5 is not None and md5.lower() != digest.hexdigest():
+        problem = 'Chunk does not match its checksum'
+    elif (not session.indexed and session.total_size is not None
+          and position + size > session.total_size):
+        problem = 'Chunk goes past the end of the upload'
+    if problem is not None:
+        queue_store.delete_file(filepath)
+        raise ChunkRejected(problem)
+
+    # Chunks count towards the limits as they arrive, rather than once
+    # the upload is complete, so the queue store can't be filled up
+    stored_size = size + sum(chunk.size for chunk in session.chunks
+                             if chunk.position != position)
+    upload_limit, max_file_size = get_upload_file_limits(session.get_actor)
+    stored_mb = stored_size / (1024.0 * 1024)
+    if max_file_size and stored_mb >= max_file_size:
+        problem = 'Sorry, the file size is too big.'
+    elif upload_limit and \
+            session.get_actor.uploaded + stored_mb >= upload_limit:
+        problem = 'Sorry, uploading this file will put you over your' \
+            ' upload limit.'
+    if problem is not None:
+        queue_store.delete_file(filepath)
+        raise UploadTooLarge(problem)
+
+    chunk = UploadChunk.query.filter_by(
+        session_id=session.id, position=position).first()
+    replaced = None
+    if chunk is None:
+        chunk = UploadChunk(position=position)
+        chunk.session = session
+    else:
+        replaced = chunk.file_path
+    chunk.size = size
+    chunk.md5 = digest.hexdigest()
+    chunk.file_path = filepath
+    session.updated = datetime.datetime.utcnow()
+
+    try:
+        chunk.save()
+    except IntegrityError:
+        # Somebody else stored this position at the very same time
+        Session.rollback()
+        queue_store.delete_file(filepath)
+        raise ChunkRejected('Chunk was sent twice at once')
+
+    if replaced is not None:
+        _delete_queue_file(queue_store, replaced)
+    return chunk
+
+
+def open_upload(queue_store, session):
+    """
+    Get a file-like object reading the complete upload of session
+
+    Raises UploadIncomplete if chunks are still missing.
+    """
+    if not session.is_complete():
+        raise UploadIncomplete()
+    return UploadSessionFile(queue_store, session)
+
+
+def discard_upload_session(queue_store, session):
+    """ Delete session along with the chunks stored so far """
+    for chunk in session.chunks:
+        _delete_queue_file(queue_store, chunk.file_path)
+    try:
+        queue_store.delete_dir(['upload_sessions', session.upload_id])
+    except StorageNotImplemented:
+        pass
+    session.delete()
+
+
+def expire_upload_sessions(queue_store=None,
+                           lifetime=UPLOAD_SESSION_LIFETIME):
+    """
+    Throw away upload sessions which haven't been touched for lifetime
+
+    Returns the number of sessions removed.
+    """
+    queue_store = queue_store or mg_globals.queue_store
+    cutoff = datetime.datetime.utcnow() - lifetime
+    expired = UploadSession.query.filter(UploadSession.updated < cutoff)
+
+    count = 0
+    for session in expired.all():
+        _log.info('Expiring upload session %s', session.upload_id)
+        discard_upload_session(queue_store, session)
+        count += 1
+    return count
+
+
+def _delete_queue_file(queue_store, filepath):
+    try:
+        queue_store.delete_file(filepath)
+    except OSError:
+        _log.warning('Chunk %s was already gone', '/'.join(filepath))
+
+
+class UploadSessionFile:
+    """
+    Read-only file-like object stringing the chunks of an upload together
+
+    Overlapping chunks (from a client which changed its chunk size half
+    way) are fine, the bytes are taken from whichever chunk comes first.
+    Reaching the end checks the size and checksum of what was read and
+    raises UploadVerificationError if they are off.  Only rewinding to
+    the start is supported.
+    """
+    def __init__(self, queue_store, session):
+        self.queue_store = queue_store
+        self.filename = session.filename
+        self.indexed = session.indexed
+        self.total_size = session.total_size
+        self.checksum = None
+        if session.checksum:
+            self.checksum = parse_checksum(session.checksum)
+        self.chunks = [(chunk.position, chunk.size, chunk.file_path)
+                       for chunk in session.chunks]
+        self._file = None
+        self.seek(0)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if offset != 0 or whence != io.SEEK_SET:
+            raise io.UnsupportedOperation('Can only rewind to the start')
+        self.close()
+        self._pending = list(self.chunks)
+        self._position = 0
+        self._digest = None
+        if self.checksum:
+            self._digest = hashlib.new(self.checksum[0])
+        return 0
+
+    def tell(self):
+        return self._position
+
+    def read(self, size=-1):
+        while True:
+            if self._file is None and not self._open_next_chunk():
+                self._verify()
+                return b''
+
+            data = self._file.read(size)
+            if data:
+                self._position += len(data)
+                if self._digest is not None:
+                    self._digest.update(data)
+                return data
+
+            self._file.close()
+            self._file = None
+
+    def _open_next_chunk(self):
+        while self._pending:
+            position, size, filepath = self._pending.pop(0)
+            if self.indexed:
+                skip = 0
+            elif position > self._position:
+                raise UploadIncomplete()
+            else:
+                skip = self._position - position
+                if skip >= size:
+                    continue
+
+            self._file = self.queue_store.get_file(filepath, 'rb')
+            while skip:
+                skipped = self._file.read(min(skip, 64 * 1024))
+                if not skipped:
+                    raise UploadIncomplete()
+                skip -= len(skipped)
+            return True
+        return False
+
+    def _verify(self):
+        if self.total_size is not None and self._position != self.total_size:
+            raise UploadVerificationError(
+                f'Got {self._position} bytes of {self.total_size}')
+        if self._digest is not None:
+            algorithm, expected = self.checksum
+            if self._digest.hexdigest() != expected:
+                raise UploadVerificationError(
+                    f'{algorithm} checksum of {self.filename} does not match')
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
 import logging
 import uuid
 from os.path import splitext
@@ -28,7 +29,8 @@ from mediagoblin.tools.response import json_response
 from mediagoblin.tools.text import convert_to_tag_list_of_dicts
 from mediagoblin.tools.federation import create_activity, create_generator
 from mediagoblin.db.models import Collection, MediaEntry, ProcessingMetaData
-from mediagoblin.processing import mark_entry_failed, get_entry_and_processing_manager
+from mediagoblin.processing import (
+    mark_entry_failed, get_entry_and_processing_manager, find_duplicate_media)
 from mediagoblin.processing.task import ProcessMedia
 from mediagoblin.notifications import add_comment_subscription
 from mediagoblin.media_types import sniff_media
@@ -37,6 +39,9 @@ from mediagoblin.user_pages.lib import add_media_to_collection
 
 _log = logging.getLogger(__name__)
 
+# Uploads are copied into the queue in chunks of this many bytes
+QUEUE_CHUNK_SIZE = 4 * 1024 * 1024
+
 
 def check_file_field(request, field_name):
     """Check if a file field meets minimal criteria"""
@@ -132,13 +137,14 @@ def submit_media(mg_app, user, submitted_file, filename,
     if not all(ord(c) < 128 for c in filename):
         filename = str(uuid.uuid4()) + splitext(filename)[-1]
 
-    # Sniff the submitted media to determine which
-    # media plugin should handle processing
-    media_type, media_manager = sniff_media(submitted_file, filename)
-
     # create entry and save in database
     entry = new_upload_entry(user)
-    entry.media_type = media_type
+
+    # Sniff the submitted media to determine which media plugin should
+    # handle processing, and store it in the queue
+    entry.media_type, file_size = queue_and_sniff_media(
+        mg_app, entry, submitted_file, filename)
+
     entry.title = (title or str(splitext(filename)[0]))
 
     entry.description = description or ""
@@ -153,14 +159,8 @@ def submit_media(mg_app, user, submitted_file, filename,
     # Generate a slug from the title
     entry.generate_slug()
 
-    queue_file = prepare_queue_task(mg_app, entry, filename)
-
-    with queue_file:
-        queue_file.write(submitted_file)
-
     # Get file size and round to 2 decimal places
-    file_size = mg_app.queue_store.get_file_size(
-        entry.queued_media_file) / (1024.0 * 1024)
+    file_size = file_size / (1024.0 * 1024)
     file_size = float(f'{file_size:.2f}')
 
     # Check if file size is over the limit
@@ -221,6 +221,72 @@ def submit_media(mg_app, user, submitted_file, filename,
     return entry
 
 
+def write_queue_file(queue_file, submitted_file, hashes=()):
+    """
+    Stream submitted_file into queue_file, returning the number of bytes
+    written
+
+    Every hashlib object in hashes is fed the data on the way through.
+    """
+    size = 0
+    with queue_file:
+        while True:
+            chunk = submitted_file.read(QUEUE_CHUNK_SIZE)
+            if not chunk:
+                break
+            for digest in hashes:
+                digest.update(chunk)
+            queue_file.write(chunk)
+            size += len(chunk)
+    return size
+
+
+def queue_submitted_file(app, entry, submitted_file, filename):
+    """
+    Write submitted_file into a new queue file for entry, returning the
+    number of bytes written
+
+    The entry's content_hash is worked out on the way.  If reading the
+    upload fails half way the partial queue file is removed again.
+    """
+    queue_file = prepare_queue_task(app, entry, filename)
+    content_hash = hashlib.sha256()
+    try:
+        size = write_queue_file(queue_file, submitted_file, [content_hash])
+    except Exception:
+        app.queue_store.delete_file(entry.queued_media_file)
+        raise
+    entry.content_hash = content_hash.hexdigest()
+    return size
+
+
+def queue_and_sniff_media(app, entry, submitted_file, filename):
+    """
+    Store the submitted file in the queue and work out its media type
+
+    With a local queue store the upload is written exactly once, straight
+    into its queue file, and sniffed there.  Other queue stores need the
+    sniffers to look at a temporary copy first.
+
+    Returns the media type and the size of the file in bytes.
+    """
+    queue_store = app.queue_store
+
+    if not queue_store.local_storage:
+        media_type, media_manager = sniff_media(submitted_file, filename)
+        size = queue_submitted_file(app, entry, submitted_file, filename)
+        return media_type, size
+
+    size = queue_submitted_file(app, entry, submitted_file, filename)
+    try:
+        with queue_store.get_file(entry.queued_media_file, 'rb') as queued:
+            media_type, media_manager = sniff_media(queued, filename)
+    except Exception:
+        queue_store.delete_file(entry.queued_media_file)
+        raise
+    return media_type, size
+
+
 def prepare_queue_task(app, entry, filename):
     """
     Prepare a MediaEntry for the processing queue and get a queue file
@@ -266,7 +332,15 @@ def run_process_media(entry, feed_url=None,
     entry, manager = get_entry_and_processing_manager(entry.id)
 
     try:
-        wf = manager.workflow(entry, feed_url, reprocess_action, reprocess_info)
+        # ProcessMedia gives duplicates the files of their original, media
+        # types processing in a workflow of their own included
+        if reprocess_action == 'initial' and \
+                mg_globals.app_config['deduplicate_media'] and \
+                find_duplicate_media(entry) is not None:
+            wf = None
+        else:
+            wf = manager.workflow(
+                entry, feed_url, reprocess_action, reprocess_info)
         if wf is None:
             ProcessMedia().apply_async(
                 [entry.id, feed_url, reprocess_action, reprocess_info], {},
@@ -295,13 +369,17 @@ def api_upload_request(request, file_data, entry):
     # This will be set later but currently we just don't have enough information
     entry.slug = None
 
+    # Uploads which didn't say what they are get sniffed
+    if entry.media_type is None:
+        entry.media_type, size = queue_and_sniff_media(
+            request.app, entry, file_data, file_data.filename)
+    else:
+        queue_submitted_file(
+            request.app, entry, file_data, file_data.filename)
+
     # This is a MUST.
     entry.get_public_id(request.urlgen)
 
-    queue_file = prepare_queue_task(request.app, entry, file_data.filename)
-    with queue_file:
-        queue_file.write(request.data)
-
     entry.save()
     return json_response(entry.serialize(request))
 
@@ -19,6 +19,8 @@ import datetime
 import pytz
 
 from mediagoblin.db.models import MediaEntry
+from mediagoblin.media_types.tools import expire_discovery_cache
+from mediagoblin.submit.chunked import expire_upload_sessions
 
 @celery.task()
 def collect_garbage():
@@ -36,3 +38,9 @@ def collect_garbage():
 
     for entry in garbage.all():
         entry.delete()
+
+    # Resumable uploads which were given up on
+    expire_upload_sessions()
+
+    # Media discoveries of files long processed
+    expire_discovery_cache()
@@ -13,6 +13,7 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import hashlib
 import json
 
 try:
@@ -25,7 +26,8 @@ from webtest import AppError
 
 from .resources import GOOD_JPG
 from mediagoblin import mg_globals
-from mediagoblin.db.models import User, MediaEntry, TextComment
+from mediagoblin.db.models import User, MediaEntry, TextComment, \
+    UploadSession
 from mediagoblin.tests.tools import fixture_add_user
 from mediagoblin.moderation.tools import take_away_privileges
 
@@ -296,6 +298,84 @@ class TestAPI:
         assert image["content"] == description
         assert image["license"] == license
 
+    def _upload_session(self, test_app, **kwargs):
+        """ Starts a resumable upload, returning its status """
+        with self.mock_oauth():
+            response = test_app.post(
+                f"/api/user/{self.active_user.username}/uploads/sessions",
+                json.dumps(kwargs),
+                headers={"Content-Type": "application/json"}
+            )
+        assert response.status_code == 201
+        return json.loads(response.body.decode())
+
+    def test_chunked_upload(self, test_app):
+        """ Test uploading an image in chunks sent out of order """
+        data = open(GOOD_JPG, "rb").read()
+        half = len(data) // 2
+        session = self._upload_session(
+            test_app, filename="goblin.jpg", contentType="image/jpeg",
+            size=len(data), chunkSize=half,
+            sha256=hashlib.sha256(data).hexdigest())
+        url = f"/api/user/{self.active_user.username}" \
+            f"/uploads/sessions/{session['id']}"
+        assert session["missing"] == [[0, len(data)]]
+
+        with self.mock_oauth():
+            # The second half first, then the first by chunk number
+            response = test_app.put(
+                url, data[half:],
+                headers={"Content-Type": "application/octet-stream",
+                         "Content-Range":
+                         f"bytes {half}-{len(data) - 1}/{len(data)}"})
+            status = json.loads(response.body.decode())
+            assert status["received"] == [[half, len(data)]]
+            assert status["missing"] == [[0, half]]
+
+            # Incomplete uploads can't be finished yet
+            response = test_app.post(url, status=409)
+
+            # Damaged chunks are turned away
+            response = test_app.put(
+                url + "?chunk=0", data[:half],
+                headers={"Content-Type": "application/octet-stream",
+                         "Content-MD5": "0" * 32},
+                status=400)
+
+            response = test_app.put(
+                url + "?chunk=0", data[:half],
+                headers={"Content-Type": "application/octet-stream",
+                         "Content-MD5": hashlib.md5(data[:half]).hexdigest()})
+            status = json.loads(response.body.decode())
+            assert status["complete"]
+
+            response = test_app.post(url)
+            image = json.loads(response.body.decode())
+
+        assert image["objectType"] == "image"
+        entry = MediaEntry.query.filter_by(public_id=image["id"]).first()
+        assert entry.media_type == "mediagoblin.media_types.image"
+        with mg_globals.queue_store.get_file(entry.queued_media_file, "rb") as f:
+            assert f.read() == data
+        assert UploadSession.query.filter_by(
+            upload_id=session["id"]).first() is None
+
+    def test_chunked_upload_checksum(self, test_app):
+        """ Uploads that don't match their checksum are thrown away """
+        data = open(GOOD_JPG, "rb").read()
+        session = self._upload_session(
+            test_app, filename="goblin.jpg",
+            md5=hashlib.md5(b"something else").hexdigest())
+        url = f"/api/user/{self.active_user.username}" \
+            f"/uploads/sessions/{session['id']}"
+
+        with self.mock_oauth():
+            test_app.put(
+                url + "?offset=0", data,
+                headers={"Content-Type": "application/octet-stream"})
+            test_app.post(url, status=400)
+            test_app.get(url, status=404)
+
     def test_only_uploaders_post_image(self, test_app):
         """ Test that only uploaders can upload images """
         # Remove uploader permissions from user
@@ -522,6 +602,11 @@ class TestAPI:
             assert feed["items"][0]["object"]["objectType"] == "image"
             assert feed["items"][0]["object"]["id"] == data["object"]["id"]
 
+            # Pollers get a 304 as long as nothing changed
+            etag = response.headers["ETag"]
+            response = test_app.get(uri, headers={"If-None-Match": etag})
+            assert response.status_code == 304
+
         default_limit = 20
         items_count = default_limit * 2
         for i in range(items_count):
@@ -17,11 +17,14 @@
 import tempfile
 import shutil
 import os
+import threading
 import pytest
 from contextlib import contextmanager
 import logging
 import imghdr
 
+import numpy
+
 #os.environ['GST_DEBUG'] = '4,python:4'
 
 pytest.importorskip("gi.repository.Gst")
@@ -32,6 +35,9 @@ Gst.init(None)
 
 from mediagoblin.media_types.audio.transcoders import (AudioTranscoder,
         AudioThumbnailer)
+from mediagoblin.media_types.audio.audiotospectrogram import (
+        AudioBlocksFFT, SpectrogramColorMap)
+from mediagoblin.media_types.audio.waveform import waveform_peaks
 from mediagoblin.media_types.tools import discover
 
 
@@ -83,6 +89,25 @@ def test_transcoder():
         assert len(info.get_audio_streams()) == 1
 
 
+def test_transcoder_halts():
+    '''
+    AudioTranscoder quits its MainLoop on EOS and on errors
+    '''
+    def transcode_in_thread(src, dst):
+        transcoder = AudioTranscoder()
+        thread = threading.Thread(target=transcoder.transcode,
+                                  args=(src, dst))
+        thread.start()
+        thread.join(30)
+        assert not thread.is_alive()
+        assert not hasattr(transcoder, 'pipeline')
+
+    with create_data_for_test() as (audio_name, result_name):
+        transcode_in_thread(audio_name, result_name)
+        assert len(discover(result_name).get_audio_streams()) == 1
+        transcode_in_thread(result_name + '.missing', result_name)
+
+
 def test_thumbnails():
     '''Test thumbnails generation.
 
@@ -102,3 +127,41 @@ def test_thumbnails():
         thumbnailer.spectrogram(new_name, thumbnail.name, width=100,
                                 fft_size=4096)
         assert imghdr.what(thumbnail.name) == 'jpeg'
+
+
+def test_spectrogram_colors():
+    '''Each pixel gets the palette color of its amplitude, the lowest
+    frequencies at the bottom'''
+    columns = [[-0.5, 0.0, 0.5], [0.25, 0.999, 2.0]]
+    color_map = SpectrogramColorMap(columns)
+    colors = color_map.colors
+    pixels = color_map.getColorData()
+    assert pixels.shape == (3, 2, 3)
+    for x, column in enumerate(columns):
+        for y, amplitude in enumerate(reversed(column)):
+            idx = min(max(int(len(colors) * amplitude), 0), len(colors) - 1)
+            assert tuple(pixels[y][x]) == tuple(colors[idx])
+
+
+def test_spectrogram_blocks():
+    '''The blocks are transformed a buffer at a time, all of them'''
+    with create_audio() as audio_name:
+        blocks = AudioBlocksFFT(audio_name, 1024, overlap=300,
+                                minFreq=20, maxFreq=8000, numBins=500)
+        blocks.BLOCKS_PER_READ = 4
+        amplitudes = numpy.concatenate([a for a, position in blocks])
+        assert amplitudes.shape == (blocks.totalBlocks(), 500)
+        assert amplitudes.max() == blocks.peakFFTAmplitude()
+
+
+def test_waveform_peaks():
+    '''The zoom levels are made in one pass, each a multiple of the
+    finest one'''
+    with create_audio() as audio_name:
+        waveform = waveform_peaks(audio_name, [10, 100])
+    finest, coarsest = waveform['levels']
+    assert finest['length'] <= 100 and coarsest['length'] <= 10
+    assert coarsest['samples_per_pixel'] == 10 * finest['samples_per_pixel']
+    assert len(finest['data']) == 2 * finest['length']
+    assert max(coarsest['data'][1::2]) == max(finest['data'][1::2])
+    assert all(-128 <= value <= 127 for value in finest['data'])
@@ -0,0 +1,116 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from sqlalchemy.sql.expression import Update
+
+from mediagoblin.db.base import Session
+from mediagoblin.db.counters import (
+    adjust_media_counters, get_media_count, cached_count)
+from mediagoblin.db.models import MediaCounter, User
+from mediagoblin.processing import mark_entry_failed
+from mediagoblin.tests.tools import fixture_add_user, fixture_media_entry
+from mediagoblin.tools.cache import TTLCache
+
+
+def test_media_counters(test_app):
+    user = fixture_add_user(username='counted')
+    entry = fixture_media_entry(uploader=user.id, expunge=False)
+    fixture_media_entry(uploader=user.id, state='processed')
+
+    assert get_media_count('unprocessed') == 1
+    assert get_media_count('unprocessed', actor=user.id) == 1
+    assert get_media_count('processed', actor=user.id) == 1
+
+    entry.state = 'processed'
+    entry.tags = [{'name': 'Cats', 'slug': 'cats'}]
+    entry.save()
+    assert get_media_count('unprocessed', actor=user.id) == 0
+    assert get_media_count('processed', actor=user.id) == 2
+    assert get_media_count('processed') == 2
+    assert get_media_count('processed', tag='cats') == 1
+
+    entry.tags = []
+    entry.save()
+    assert get_media_count('processed', tag='cats') == 0
+
+    entry.delete()
+    assert get_media_count('processed', actor=user.id) == 1
+
+
+def test_media_counters_around_orm(test_app):
+    user = fixture_add_user(username='counted')
+    entry = fixture_media_entry(uploader=user.id)
+
+    mark_entry_failed(entry.id, Exception('boom'))
+    assert get_media_count('unprocessed', actor=user.id) == 0
+    assert get_media_count('failed', actor=user.id) == 1
+
+
+def test_media_counter_created_concurrently(test_app):
+    class RacingConnection:
+        """Creates the counter right after the first update missed it"""
+
+        def __init__(self, connection):
+            self.connection = connection
+            self.raced = False
+
+        def __getattr__(self, name):
+            return getattr(self.connection, name)
+
+        def execute(self, statement, *args, **kwargs):
+            result = self.connection.execute(statement, *args, **kwargs)
+            if isinstance(statement, Update) and not self.raced:
+                self.raced = True
+                self.connection.execute(
+                    MediaCounter.__table__.insert().values(
+                        name='state:raced', count=5))
+            return result
+
+    class RacingSession:
+        def __init__(self):
+            self._connection = RacingConnection(Session.connection())
+
+        def connection(self):
+            return self._connection
+
+        def execute(self, statement, *args, **kwargs):
+            return self._connection.execute(statement, *args, **kwargs)
+
+    adjust_media_counters(RacingSession(), {'state:raced': 2})
+    assert get_media_count('raced') == 7
+
+
+def test_cached_count(test_app):
+    fixture_add_user(username='first')
+    assert cached_count(User.query, ttl=60) == 1
+
+    fixture_add_user(username='second')
+    assert cached_count(User.query, ttl=60) == 1
+    assert cached_count(User.query, ttl=0) == 2
+
+
+def test_ttl_cache_lru():
+    cache = TTLCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert cache.get_or_set('b', lambda: 4) == 4
+
+    cache.set('d', 5, ttl=-1)
+    assert cache.get('d') is None
@@ -0,0 +1,119 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+
+import pytest
+
+from werkzeug.datastructures import FileStorage
+
+from .resources import GOOD_JPG
+from mediagoblin import mg_globals
+from mediagoblin.db.models import MediaEntry
+from mediagoblin.processing import task as processing_task
+from mediagoblin.submit import lib as submit_lib
+from mediagoblin.submit.lib import run_process_media, submit_media
+from mediagoblin.tests.tools import fixture_add_user, fixture_media_entry
+
+
+def _submit_good_jpg(user):
+    with open(GOOD_JPG, 'rb') as good_jpg:
+        entry = submit_media(
+            mg_globals.app, user,
+            FileStorage(stream=good_jpg, filename='goblin.jpg'),
+            'goblin.jpg')
+    return MediaEntry.query.get(entry.id)
+
+
+def test_duplicate_uploads_share_files(test_app, monkeypatch):
+    monkeypatch.setitem(mg_globals.app_config, 'deduplicate_media', True)
+    public_store = mg_globals.public_store
+    user = fixture_add_user(privileges=['active', 'uploader'])
+
+    with open(GOOD_JPG, 'rb') as good_jpg:
+        content_hash = hashlib.sha256(good_jpg.read()).hexdigest()
+
+    first = _submit_good_jpg(user)
+    second = _submit_good_jpg(user)
+
+    assert first.content_hash == second.content_hash == content_hash
+    assert first.state == second.state == 'processed'
+    assert dict(second.media_files) == dict(first.media_files)
+    assert second.media_data.width == first.media_data.width
+    assert not second.queued_media_file
+    paths = list(first.media_files.values())
+
+    # The files stay until the last entry using them is gone
+    first.delete()
+    for path in paths:
+        assert public_store.file_exists(path)
+
+    second = MediaEntry.query.get(second.id)
+    second.delete()
+    for path in paths:
+        assert not public_store.file_exists(path)
+
+
+def test_duplicates_processed_without_deduplication(test_app):
+    user = fixture_add_user(privileges=['active', 'uploader'])
+
+    first = _submit_good_jpg(user)
+    second = _submit_good_jpg(user)
+
+    assert first.content_hash == second.content_hash
+    assert set(first.media_files.values()).isdisjoint(
+        second.media_files.values())
+
+
+@pytest.mark.parametrize('media_type', [
+    'mediagoblin.media_types.image', 'mediagoblin.media_types.video'])
+def test_duplicates_with_workflow_share_files(test_app, monkeypatch,
+                                              media_type):
+    # Videos are processed in a workflow of their own, duplicates too
+    if media_type == 'mediagoblin.media_types.video':
+        pytest.importorskip('gi.repository.Gst')
+    monkeypatch.setitem(mg_globals.app_config, 'deduplicate_media', True)
+    user = fixture_add_user(privileges=['active', 'uploader'])
+
+    original = fixture_media_entry(uploader=user.id, state='processed',
+                                   expunge=False)
+    original.media_type = media_type
+    original.content_hash = 'a' * 64
+    original.media_files['webm_480p'] = ['j', 'k', 'l.webm']
+    original.save()
+    entry = fixture_media_entry(uploader=user.id, fake_upload=False,
+                                expunge=False)
+    entry.media_type = media_type
+    entry.content_hash = original.content_hash
+    entry.save()
+
+    class ProcessingManager:
+        def workflow(self, *args):
+            raise AssertionError('duplicate processed again')
+
+    def get_entry_and_processing_manager(media_id):
+        return MediaEntry.query.get(media_id), ProcessingManager()
+
+    for module in (submit_lib, processing_task):
+        monkeypatch.setattr(module, 'get_entry_and_processing_manager',
+                            get_entry_and_processing_manager)
+
+    run_process_media(entry)
+
+    entry = MediaEntry.query.get(entry.id)
+    assert entry.state == 'processed'
+    assert dict(entry.media_files) == dict(
+        MediaEntry.query.get(original.id).media_files)
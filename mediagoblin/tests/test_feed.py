@@ -1,3 +1,4 @@
+from mediagoblin.db.models import MediaEntry
 from mediagoblin.tests.tools import fixture_add_user, fixture_media_entry
 
 
@@ -17,3 +18,28 @@ class TestFeeds:
         res = test_app.get('/u/terence/atom/')
         assert res.status_int == 200
         assert res.content_type == 'application/atom+xml'
+
+
+
+def test_conditional_get(test_app):
+    user = fixture_add_user(username='terence', privileges=['active'])
+    fixture_media_entry(uploader=user.id, state='processed')
+
+    res = test_app.get('/atom/')
+    etag = res.headers['ETag']
+    test_app.get('/atom/', headers={'If-None-Match': etag}, status=304)
+    # Last-Modified can't tell about removed entries, so isn't enough
+    test_app.get(
+        '/atom/',
+        headers={'If-Modified-Since': res.headers['Last-Modified']},
+        status=200)
+
+    second = fixture_media_entry(uploader=user.id, state='processed')
+    res = test_app.get('/atom/', headers={'If-None-Match': etag})
+    assert res.status_int == 200
+    assert res.headers['ETag'] != etag
+
+    MediaEntry.query.get(second.id).delete()
+    res = test_app.get(
+        '/atom/', headers={'If-None-Match': res.headers['ETag']})
+    assert res.status_int == 200
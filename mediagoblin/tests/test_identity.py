@@ -0,0 +1,153 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from datetime import date, timedelta
+
+from sqlalchemy import event
+
+from mediagoblin.db.base import Session
+from mediagoblin.db.identity import get_user, privilege_names
+from mediagoblin.db.models import AccessToken, LocalUser, UserBan
+from mediagoblin.moderation.tools import (
+    ban_user, give_privileges, take_away_privileges, unban_user)
+from mediagoblin.tests.tools import fixture_add_user
+from mediagoblin.tools.request import setup_user_in_request
+from mediagoblin.tools.response import render_user_banned
+
+
+def _count_statements(callback):
+    statements = []
+
+    def count_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = Session().get_bind()
+    event.listen(engine, 'before_cursor_execute', count_statement)
+    try:
+        callback()
+    finally:
+        event.remove(engine, 'before_cursor_execute', count_statement)
+    return statements
+
+
+def test_cached_user_needs_no_queries(test_app):
+    user_id = fixture_add_user('cached', privileges=['active']).id
+    Session.remove()
+    assert get_user(str(user_id)).has_privilege('active')
+    Session.remove()
+
+    def load():
+        user = get_user(user_id)
+        assert user.username == 'cached'
+        assert user.has_privilege('active')
+        assert Session().query(LocalUser).get(user_id) is user
+
+    assert _count_statements(load) == []
+    assert get_user('nonsense') is None
+
+
+def test_cache_forgets_changed_users(test_app):
+    user_id = fixture_add_user('fickle', privileges=['active']).id
+    Session.remove()
+    user = get_user(user_id)
+    assert privilege_names(user) == frozenset(['active'])
+
+    user.bio = 'Likes changes'
+    user.save()
+    give_privileges('fickle', 'commenter')
+    Session().commit()
+    Session.remove()
+    user = get_user(user_id)
+    assert user.bio == 'Likes changes'
+    assert user.has_privilege('commenter')
+
+    take_away_privileges('fickle', 'commenter')
+    assert not user.has_privilege('commenter')
+    Session().commit()
+    Session.remove()
+    assert not get_user(user_id).has_privilege('commenter')
+
+
+def test_setup_user_from_access_token(test_app):
+    user_id = fixture_add_user('tokenised').id
+    token = AccessToken(token='token', secret='secret', actor=user_id)
+    token.save()
+    Session.remove()
+
+    class FakeRequest:
+        headers = {'Authorization':
+                   'OAuth access_token="1", oauth_token="token"'}
+        session = {}
+
+    request = FakeRequest()
+    setup_user_in_request(request)
+    assert request.user.id == user_id
+
+    # Revoking the token
+    AccessToken.query.get('token').delete()
+    Session.remove()
+    setup_user_in_request(request)
+    assert request.user is None
+
+
+def test_privileges_and_bans_checked_once_per_request(test_app):
+    user = fixture_add_user('checked', privileges=['active', 'commenter'])
+    Session.remove()
+    user = get_user(user.id)
+
+    def check():
+        for i in range(3):
+            assert user.has_privilege('commenter')
+            assert not user.has_privilege('admin')
+            assert not user.is_banned()
+
+    # The privileges and the bans are loaded once, then remembered
+    assert len(_count_statements(check)) == 2
+    assert _count_statements(check) == []
+
+    ban_user(user.id, reason='Spam').save()
+    assert user.is_banned()
+    unban_user(user.id)
+    assert not user.is_banned()
+
+
+def test_stale_and_expired_bans(test_app):
+    user = fixture_add_user('stale', privileges=['active'])
+    user_id = user.id
+
+    class FakeRequest:
+        def urlgen(self, *args, **kwargs):
+            return '/'
+
+    request = FakeRequest()
+    request.user = get_user(user_id)
+
+    # Bans that have ended are deleted when the user next comes by
+    ban_user(user_id, reason='Spam',
+             expiration_date=date.today() - timedelta(days=1)).save()
+    assert user.is_banned()
+    assert render_user_banned(request).status_code == 302
+    assert UserBan.query.get(user_id) is None
+    assert not user.is_banned()
+
+    # Lifted by another process, without this one noticing
+    ban_user(user_id, reason='Spam').save()
+    assert user.is_banned()
+    Session.execute(UserBan.__table__.delete())
+    Session.commit()
+    assert user.is_banned()
+    assert render_user_banned(request).status_code == 302
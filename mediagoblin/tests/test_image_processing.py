@@ -0,0 +1,107 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+
+from mediagoblin import mg_globals
+from mediagoblin.db.models import MediaEntry
+from mediagoblin.media_types.image import processing
+from mediagoblin.submit.lib import submit_media
+from mediagoblin.tests.tools import fixture_add_user
+
+
+def test_derivatives_from_one_decode(test_app, tmpdir, monkeypatch):
+    photo = str(tmpdir.join('photo.jpg'))
+    Image.new('RGB', (4000, 3000), 'green').save(photo, quality=90)
+
+    decoded = []
+    open_image = processing.open_image
+
+    def counting_open_image(*args, **kwargs):
+        im, stored_size = open_image(*args, **kwargs)
+        decoded.append(im.size)
+        return im, stored_size
+
+    monkeypatch.setattr(processing, 'open_image', counting_open_image)
+
+    user = fixture_add_user(privileges=['active', 'uploader'])
+    with open(photo, 'rb') as f:
+        entry = submit_media(
+            mg_globals.app, user,
+            FileStorage(stream=f, filename='photo.jpg'), 'photo.jpg')
+    entry = MediaEntry.query.get(entry.id)
+    assert entry.state == 'processed'
+
+    # Decoded once, at half the size
+    assert decoded == [(2000, 1500)]
+
+    public_store = mg_globals.public_store
+    sizes = {}
+    for keyname in ('medium', 'thumb', 'original'):
+        with Image.open(public_store.get_local_path(
+                entry.media_files[keyname])) as im:
+            sizes[keyname] = im.size
+    assert sizes == {
+        'medium': (640, 480), 'thumb': (180, 135), 'original': (4000, 3000)}
+    assert entry.get_file_metadata('original') == {
+        'width': 4000, 'height': 3000}
+
+
+def test_derivative_formats_and_sizes(test_app, tmpdir, monkeypatch):
+    image_config = mg_globals.global_config['plugins'][
+        'mediagoblin.media_types.image']
+    monkeypatch.setitem(image_config, 'srcset_sizes', [1280])
+    monkeypatch.setitem(image_config, 'derivative_formats', ['webp', 'jpeg'])
+    monkeypatch.setitem(image_config, 'progressive_jpeg', True)
+
+    photo = str(tmpdir.join('photo.jpg'))
+    Image.new('RGB', (2000, 1000), 'green').save(photo, quality=90)
+
+    user = fixture_add_user(privileges=['active', 'uploader'])
+    with open(photo, 'rb') as f:
+        entry = submit_media(
+            mg_globals.app, user,
+            FileStorage(stream=f, filename='photo.jpg'), 'photo.jpg')
+    entry = MediaEntry.query.get(entry.id)
+    assert entry.state == 'processed'
+
+    # No JPEG copy of a JPEG
+    assert sorted(entry.media_files) == [
+        'medium', 'medium_webp', 'original', 'scaled_1280',
+        'scaled_1280_webp', 'thumb', 'thumb_webp']
+
+    public_store = mg_globals.public_store
+    with Image.open(public_store.get_local_path(
+            entry.media_files['scaled_1280_webp'])) as im:
+        assert (im.format, im.size) == ('WEBP', (1280, 640))
+    with Image.open(public_store.get_local_path(
+            entry.media_files['medium'])) as im:
+        assert im.info.get('progressive')
+    assert entry.get_file_metadata('thumb_webp') == {
+        'width': 180, 'height': 180, 'quality': 90, 'filter': 'ANTIALIAS',
+        'scaled_width': 180, 'scaled_height': 90, 'mimetype': 'image/webp',
+        'variant_of': 'thumb'}
+
+    url = public_store.file_url
+    assert entry.get_srcsets(['thumb']) == [
+        ('image/webp', f"{url(entry.media_files['thumb_webp'])} 180w"),
+        ('image/jpeg', f"{url(entry.media_files['thumb'])} 180w")]
+    assert entry.get_srcsets()[0] == (
+        'image/webp',
+        f"{url(entry.media_files['thumb_webp'])} 180w, "
+        f"{url(entry.media_files['medium_webp'])} 640w, "
+        f"{url(entry.media_files['scaled_1280_webp'])} 1280w")
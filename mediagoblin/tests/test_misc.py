@@ -14,18 +14,29 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import io
+import os
 import pytz
 import datetime
 
+import pytest
+from sqlalchemy import event
 from werkzeug.datastructures import FileStorage
 
 from .resources import GOOD_JPG
+from mediagoblin import mg_globals
 from mediagoblin.db.base import Session
-from mediagoblin.media_types import sniff_media
-from mediagoblin.submit.lib import new_upload_entry
+from mediagoblin.media_types import FileTypeNotSupported, sniff_media
+from mediagoblin.media_types import tools as media_tools
+from mediagoblin.processing import ProgressCallback
+from mediagoblin.submit.lib import new_upload_entry, queue_and_sniff_media
+from mediagoblin.submit.chunked import (
+    UploadTooLarge, new_upload_session, store_chunk)
 from mediagoblin.submit.task import collect_garbage
-from mediagoblin.db.models import User, MediaEntry, TextComment, Comment
+from mediagoblin.db.models import User, MediaEntry, TextComment, Comment, \
+    UploadSession
 from mediagoblin.tests.tools import fixture_add_user, fixture_media_entry
+from mediagoblin.tools.template import compile_templates, get_jinja_env
 
 
 def test_404_for_non_existent(test_app):
@@ -139,6 +150,53 @@ def test_garbage_collection_task(test_app):
     # Now validate the image has been deleted
     assert MediaEntry.query.filter_by(id=entry_id).first() is None
 
+
+def test_garbage_collection_upload_sessions(test_app):
+    """ Test abandoned resumable uploads are removed by GC task """
+    user = fixture_add_user()
+    queue_store = mg_globals.queue_store
+
+    stale = new_upload_session(user, "stale.jpg")
+    chunk = store_chunk(queue_store, stale, 0, io.BytesIO(b"goblin"))
+    stale.updated = datetime.datetime.utcnow() - datetime.timedelta(days=2)
+    stale.save()
+    fresh = new_upload_session(user, "fresh.jpg")
+
+    collect_garbage()
+
+    assert UploadSession.query.filter_by(id=stale.id).first() is None
+    assert not queue_store.file_exists(chunk.file_path)
+    assert UploadSession.query.filter_by(id=fresh.id).first() is not None
+
+def test_chunks_count_towards_upload_limits(test_app, monkeypatch):
+    """ Uploads of unknown size stop at the limits too """
+    monkeypatch.setitem(mg_globals.app_config, 'max_file_size', 1)
+    user = fixture_add_user()
+    queue_store = mg_globals.queue_store
+    chunk_data = b"g" * (600 * 1024)
+
+    session = new_upload_session(user, "big.jpg")
+    store_chunk(queue_store, session, 0, io.BytesIO(chunk_data))
+    # Sending a chunk again doesn't count it twice
+    store_chunk(queue_store, session, 0, io.BytesIO(chunk_data))
+    with pytest.raises(UploadTooLarge):
+        store_chunk(queue_store, session, len(chunk_data),
+                    io.BytesIO(chunk_data))
+    assert [chunk.position for chunk in session.chunks] == [0]
+    session_dir = queue_store.get_local_path(
+        ['upload_sessions', session.upload_id])
+    assert os.listdir(session_dir) == [session.chunks[0].file_path[-1]]
+
+    monkeypatch.setitem(mg_globals.app_config, 'max_file_size', None)
+    session = new_upload_session(user, "quota.jpg")
+    session.get_actor.upload_limit = 1
+    session.get_actor.uploaded = 0.5
+    session.get_actor.save()
+    with pytest.raises(UploadTooLarge):
+        store_chunk(queue_store, session, 0, io.BytesIO(chunk_data))
+    assert not session.chunks
+
+
 def test_comments_removed_when_graveyarded(test_app):
     """ Checks comments which are tombstones are removed from collection """
     user = fixture_add_user()
@@ -169,3 +227,178 @@ def test_comments_removed_when_graveyarded(test_app):
     # Verify this also deleted the Comment link, ergo there is no comment left.
     assert Comment.query.filter_by(target_id=link.target_id).first() is None
  
+
+
+def test_gallery_query_count_is_bounded(test_app):
+    """Gallery pages shouldn't issue queries per media entry shown."""
+    for username in ('alice', 'bob', 'carol'):
+        user = fixture_add_user(username=username)
+        for i in range(12):
+            entry = fixture_media_entry(
+                title=f'{username} {i}', uploader=user.id,
+                state='processed', expunge=False)
+            entry.tags = [{'name': 'Goblins', 'slug': 'goblins'}]
+            entry.save()
+    Session.remove()
+
+    statements = []
+
+    def count_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = Session().get_bind()
+    event.listen(engine, 'before_cursor_execute', count_statement)
+    try:
+        for url in ('/', '/u/bob/', '/u/bob/gallery/', '/tag/goblins/',
+                    '/atom/', '/tag/goblins/atom/'):
+            del statements[:]
+            test_app.get(url)
+            assert len(statements) <= 8, (url, statements)
+    finally:
+        event.remove(engine, 'before_cursor_execute', count_statement)
+
+
+def test_compile_templates(test_app):
+    app = mg_globals.app
+    compiled, failed = compile_templates(app)
+    assert failed == []
+    assert compiled > 50
+    assert os.listdir(app.app_config['template_cache_dir'])
+
+    # Made up locales share one environment
+    assert (get_jinja_env(app, app.template_loader, 'xx_XX') is
+            get_jinja_env(app, app.template_loader, 'yy_YY'))
+    assert (get_jinja_env(app, app.template_loader, 'en') is not
+            get_jinja_env(app, app.template_loader, 'xx_XX'))
+
+
+def test_queue_and_sniff_media(test_app):
+    app = mg_globals.app
+    user = fixture_add_user()
+    with open(GOOD_JPG, 'rb') as good_jpg:
+        data = good_jpg.read()
+
+    entry = new_upload_entry(user)
+    file_data = FileStorage(
+        stream=io.BytesIO(data), filename='goblin.jpg',
+        content_type='image/jpeg')
+    media_type, size = queue_and_sniff_media(
+        app, entry, file_data, 'goblin.jpg')
+    assert media_type == 'mediagoblin.media_types.image'
+    assert size == len(data)
+    with app.queue_store.get_file(entry.queued_media_file, 'rb') as queued:
+        assert queued.read() == data
+
+    # Files nobody wants don't stay in the queue
+    entry = new_upload_entry(user)
+    file_data = FileStorage(
+        stream=io.BytesIO(b'not really media'), filename='goblin.unknown')
+    with pytest.raises(FileTypeNotSupported):
+        queue_and_sniff_media(app, entry, file_data, 'goblin.unknown')
+    assert not app.queue_store.file_exists(entry.queued_media_file)
+
+
+def test_discovery_cache(test_app, tmpdir):
+    video = tmpdir.join('video.ogv')
+    video.write('not really a video')
+    summary = {
+        'duration': 10 ** 9,
+        'tags': {'container-format': 'Ogg', 'date': '2020-1-2'},
+        'video': [{'width': 640, 'height': 360, 'bitrate': 0, 'depth': 24,
+                   'framerate_num': 30, 'framerate_denom': 1,
+                   'tags': {'video-codec': 'Theora'}}],
+        'audio': []}
+
+    key = media_tools._discovery_cache_key(str(video))
+    media_tools._cache_discovery(key, summary)
+    # Other workers find it on disk
+    media_tools._discovery_cache.clear()
+
+    info = media_tools.discover(str(video))
+    assert info.get_result() == 0
+    assert info.get_duration() == 10 ** 9
+    assert info.get_tags().get_string('container-format') == (True, 'Ogg')
+    assert info.get_tags().get_string('mimetype') == (False, None)
+    assert info.get_audio_streams() == []
+    video_info, = info.get_video_streams()
+    assert (video_info.get_width(), video_info.get_height()) == (640, 360)
+    assert video_info.get_tags().get_string('video-codec') == (True, 'Theora')
+
+    # Changing the file changes its key
+    video.write('still not a video')
+    assert media_tools._discovery_cache_key(str(video)) != key
+
+    cache_file = os.path.join(media_tools._discovery_cache_dir(),
+                              key + '.json')
+    old = datetime.datetime.now() - datetime.timedelta(days=2)
+    os.utime(cache_file, (old.timestamp(), old.timestamp()))
+    collect_garbage()
+    assert not os.path.exists(cache_file)
+
+
+def test_gst_runtime_preinit(monkeypatch):
+    from celery.signals import worker_process_init
+
+    initialized = []
+
+    class FakeRuntime:
+        def discoverer(self):
+            initialized.append(True)
+
+    monkeypatch.setattr(media_tools, 'get_gst_runtime', FakeRuntime)
+    media_tools.setup_celery()
+    # Media types share the one receiver
+    media_tools.setup_celery()
+    try:
+        worker_process_init.send(sender=None)
+        assert initialized == [True]
+
+        # No GStreamer just leaves it to the tasks that need it
+        def no_gstreamer():
+            raise ImportError('No module named gi')
+        monkeypatch.setattr(media_tools, 'get_gst_runtime', no_gstreamer)
+        worker_process_init.send(sender=None)
+    finally:
+        worker_process_init.disconnect(
+            dispatch_uid='mediagoblin.media_types.tools.preinit_gst_runtime')
+
+
+def test_progress_callback(test_app):
+    entry = fixture_media_entry()
+
+    def stored_progress():
+        return MediaEntry.query.with_entities(
+            MediaEntry.transcoding_progress,
+            MediaEntry.main_transcoding_progress).filter_by(
+                id=entry.id).one()
+
+    # Two resolutions transcoded at the same time
+    main = ProgressCallback(entry)
+    other = ProgressCallback(entry)
+    main(0.5, 1)
+    assert stored_progress() == (0, 0)
+    main(0.7, 2)
+    other(1.5)
+    assert stored_progress() == (2.7, 2)
+
+    # Written again once min_interval has passed
+    main(10, 20)
+    other(10)
+    assert stored_progress() == (2.7, 2)
+    main.flush()
+    other.flush()
+    assert stored_progress() == (22.7, 20)
+
+    # Always written when the main resolution is done
+    main(90, 100)
+    assert stored_progress() == (100, 100)
+
+    # Segments each add their share of the default resolution
+    entry = fixture_media_entry()
+    for segment in range(3):
+        segment_progress = ProgressCallback(entry, add_main_progress=True)
+        segment_progress(100 / 3, 100 / 3)
+        segment_progress.flush()
+        if not segment:
+            assert stored_progress() == (33.33, 33.33)
+    assert stored_progress() == (100, 100)
@@ -0,0 +1,152 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import pkg_resources
+import pytest
+from sqlalchemy import event
+
+from mediagoblin.db.base import Session
+from mediagoblin.db.models import MediaEntry
+from mediagoblin.meddleware import page_cache as page_cache_module
+from mediagoblin.meddleware.page_cache import (
+    FileSystemPageCache, MemoryPageCache)
+from mediagoblin.tests.tools import (
+    get_app, fixture_add_user, fixture_media_entry)
+
+
+@pytest.fixture()
+def page_cache_app(request):
+    return get_app(
+        request,
+        mgoblin_config=pkg_resources.resource_filename(
+            'mediagoblin.tests', 'appconfig_page_cache.ini'))
+
+
+def _count_statements(callback):
+    statements = []
+
+    def count_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = Session().get_bind()
+    event.listen(engine, 'before_cursor_execute', count_statement)
+    try:
+        result = callback()
+    finally:
+        event.remove(engine, 'before_cursor_execute', count_statement)
+    return result, statements
+
+
+def test_anonymous_pages_are_cached(page_cache_app):
+    app = page_cache_app
+    user = fixture_add_user(privileges=['active'])
+    entry = fixture_media_entry(
+        title='Cached goblin', uploader=user.id, state='processed',
+        expunge=False)
+    entry_id = entry.id
+    Session.remove()
+
+    first = app.get('/u/chris/')
+    assert 'Cached goblin' in first.text
+    assert first.headers['ETag']
+    assert first.headers['Last-Modified']
+
+    second, statements = _count_statements(lambda: app.get('/u/chris/'))
+    assert statements == []
+    assert second.text == first.text
+    assert second.headers['ETag'] == first.headers['ETag']
+    assert 'Set-Cookie' not in second.headers
+
+    app.get('/u/chris/', headers={'If-None-Match': first.headers['ETag']},
+            status=304)
+
+    # Changing the media throws the cached pages away
+    entry = MediaEntry.query.get(entry_id)
+    entry.title = 'Renamed goblin'
+    entry.save()
+    Session.remove()
+    assert 'Renamed goblin' in app.get('/u/chris/').text
+
+    # Logged in users always get a fresh page
+    app.post('/auth/login/', {'username': 'chris', 'password': 'toast'})
+    assert 'Log out' in app.get('/u/chris/').text
+
+
+def test_filesystem_page_cache(tmpdir):
+    config = {'page_cache_ttl': 300, 'page_cache_dir': str(tmpdir)}
+    page_cache = FileSystemPageCache(config)
+    page = {'status': 200, 'headers': [['Content-Type', 'text/html']],
+            'body': b'<html>\nHi!</html>', 'stored': 0}
+
+    page_cache.set('abc', page)
+    assert page_cache.get('abc') is None  # expired long ago
+
+    page['stored'] = 2 ** 40
+    page_cache.set('abc', page)
+    assert page_cache.get('abc') == page
+    assert FileSystemPageCache(config).get('abc') == page
+
+    # Clearing in one process clears the others too
+    FileSystemPageCache(config).clear()
+    assert page_cache.get('abc') is None
+    assert not tmpdir.join('abc').exists()
+
+    page_cache.set('abc', page)
+    assert page_cache.get('abc') == page
+
+
+def test_invalidated_on_commit(page_cache_app, monkeypatch):
+    user = fixture_add_user(privileges=['active'])
+    entry = fixture_media_entry(uploader=user.id, expunge=False)
+    cleared = []
+    monkeypatch.setattr(
+        page_cache_module, 'invalidate_page_cache',
+        lambda: cleared.append(True))
+
+    entry.title = 'Rolled back'
+    Session.flush()
+    assert cleared == []
+    Session.rollback()
+    Session.commit()
+    assert cleared == []
+
+    entry = MediaEntry.query.get(entry.id)
+    entry.title = 'Committed'
+    with Session.begin_nested():
+        Session.flush()
+    assert cleared == []
+    Session.commit()
+    assert cleared == [True]
+
+
+def test_worker_only_clears_shared_caches(tmpdir, monkeypatch):
+    config = {'page_cache': 'memory', 'page_cache_ttl': 300,
+              'page_cache_size': 10, 'page_cache_dir': str(tmpdir)}
+    created = []
+    monkeypatch.setattr(page_cache_module, '_page_caches', set())
+    monkeypatch.setattr(page_cache_module.mg_globals, 'app_config', config)
+    monkeypatch.setattr(
+        MemoryPageCache, '__init__', lambda self, conf: created.append(self))
+
+    page_cache_module.invalidate_page_cache()
+    assert created == []
+
+    config['page_cache'] = 'filesystem'
+    page = {'status': 200, 'headers': [], 'body': b'', 'stored': 2 ** 40}
+    FileSystemPageCache(config).set('abc', page)
+    page_cache_module.invalidate_page_cache()
+    assert FileSystemPageCache(config).get('abc') is None
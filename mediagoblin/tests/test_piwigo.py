@@ -14,8 +14,13 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import base64
+import hashlib
+
 import pytest
+from .resources import GOOD_JPG
 from .tools import fixture_add_user
+from mediagoblin.db.models import MediaEntry, UploadSession
 
 
 XML_PREFIX = "<?xml version='1.0' encoding='utf-8'?>\n"
@@ -64,3 +69,40 @@ class Test_PWG:
 
         resp = self.do_get("pwg.session.getStatus")
         assert resp.body == (XML_PREFIX + '<rsp stat="ok"><username>guest</username></rsp>').encode('ascii')
+
+    def test_chunked_add(self):
+        self.do_post("pwg.session.login",
+            {"username": self.username, "password": self.password})
+
+        with open(GOOD_JPG, 'rb') as good_jpg:
+            data = good_jpg.read()
+        o_sum = hashlib.md5(data).hexdigest()
+        half = len(data) // 2
+
+        # Chunks can come in any order
+        for position, chunk in ((1, data[half:]), (0, data[:half])):
+            resp = self.do_post("pwg.images.addChunk",
+                {"original_sum": o_sum, "type": "file",
+                 "position": str(position),
+                 "data": base64.b64encode(chunk).decode('ascii')})
+            assert resp.body == (XML_PREFIX + '<rsp stat="ok">1</rsp>').encode('ascii')
+
+        resp = self.do_post("pwg.images.add",
+            {"original_sum": o_sum, "file_sum": o_sum,
+             "name": "goblin.jpg"})
+        assert b'<image_id>' in resp.body
+
+        entry = MediaEntry.query.filter_by(title='goblin.jpg').first()
+        assert entry.media_type == 'mediagoblin.media_types.image'
+        assert UploadSession.query.count() == 0
+
+        # A damaged upload is thrown away
+        self.do_post("pwg.images.addChunk",
+            {"original_sum": o_sum, "type": "file", "position": "0",
+             "data": base64.b64encode(data[:half]).decode('ascii')})
+        resp = self.test_app.post("/api/piwigo/ws.php",
+            {"method": "pwg.images.add",
+             "original_sum": o_sum, "file_sum": o_sum, "name": "broken"},
+            status=500)
+        assert b'stat="fail"' in resp.body
+        assert UploadSession.query.count() == 0
@@ -0,0 +1,74 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+
+import pkg_resources
+import pytest
+from sqlalchemy import create_engine
+
+from mediagoblin.db.instrumentation import (
+    instrument_engine, collect_query_stats, stop_collecting_query_stats,
+    record_query_stats, get_aggregate_query_stats,
+    reset_aggregate_query_stats)
+from mediagoblin.tests.tools import get_app, fixture_add_user
+
+
+def test_query_stats():
+    engine = create_engine('sqlite://')
+    instrument_engine(engine, slow_query_threshold=0)
+
+    engine.execute('SELECT 1')
+    stats = collect_query_stats('some.controller')
+    engine.execute('SELECT 1')
+    engine.execute('SELECT 2')
+    assert stop_collecting_query_stats() is stats
+    engine.execute('SELECT 3')
+
+    assert stats.count == 2
+    assert stats.slow_count == 2
+    assert stats.duration > 0
+    assert stats.server_timing().endswith('desc="2 queries"')
+
+    reset_aggregate_query_stats()
+    record_query_stats(stats)
+    record_query_stats(stats)
+    aggregate = get_aggregate_query_stats()['some.controller']
+    assert aggregate['requests'] == 2
+    assert aggregate['queries'] == 4
+    assert aggregate['avg_queries'] == 2
+
+
+@pytest.fixture()
+def sql_stats_app(request):
+    return get_app(
+        request,
+        mgoblin_config=pkg_resources.resource_filename(
+            'mediagoblin.tests', 'appconfig_sql_stats.ini'))
+
+
+def test_sql_stats_meddleware(sql_stats_app):
+    app = sql_stats_app
+    reset_aggregate_query_stats()
+
+    response = app.get('/')
+    assert response.headers['Server-Timing'].startswith('db;dur=')
+    assert get_aggregate_query_stats()['index']['requests'] == 1
+
+    fixture_add_user(privileges=['active', 'admin'])
+    app.post('/auth/login/', {'username': 'chris', 'password': 'toast'})
+    response = app.get('/mod/sql_stats/')
+    assert 'index' in json.loads(response.body.decode())
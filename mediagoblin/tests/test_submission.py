@@ -53,7 +53,8 @@ from mediagoblin.media_types.image import ImageMediaManager
 from mediagoblin.media_types.pdf.processing import check_prerequisites as pdf_check_prerequisites
 from mediagoblin.media_types.video.processing import (
     VideoProcessingManager, main_task, complementary_task, group,
-    processing_cleanup, CommonVideoProcessor)
+    multi_transcode_task, audio_track_task, processing_cleanup,
+    CommonVideoProcessor)
 from mediagoblin.media_types.video.util import ACCEPTED_RESOLUTIONS
 from mediagoblin.submit.lib import new_upload_entry, run_process_media
 
@@ -527,6 +528,13 @@ class TestSubmissionBasics(BaseTestSubmission):
             actor=self.our_user().id
         ).count() == 3
 
+@pytest.fixture()
+def parallel_transcoding(monkeypatch):
+    video_config = mg_globals.global_config['plugins'][
+        'mediagoblin.media_types.video']
+    monkeypatch.setitem(video_config, 'parallel_transcoding', True)
+
+
 class TestSubmissionVideo(BaseTestSubmission):
     @pytest.fixture(autouse=True)
     def setup(self, video_plugin_app):
@@ -592,6 +600,7 @@ class TestSubmissionVideo(BaseTestSubmission):
                 # check media_file path
                 assert result[i][2] == media_file.file_path
 
+    @pytest.mark.usefixtures('parallel_transcoding')
     @mock.patch('mediagoblin.media_types.video.processing.processing_cleanup.signature')
     @mock.patch('mediagoblin.media_types.video.processing.complementary_task.signature')
     @mock.patch('mediagoblin.media_types.video.processing.main_task.signature')
@@ -638,6 +647,7 @@ class TestSubmissionVideo(BaseTestSubmission):
         # delete the entry
         entry.delete()
 
+    @pytest.mark.usefixtures('parallel_transcoding')
     def test_workflow(self):
         entry = get_sample_entry(self.our_user(), self.media_type)
         manager = VideoProcessingManager()
@@ -677,6 +687,7 @@ class TestSubmissionVideo(BaseTestSubmission):
         assert wf[1] == cleanup_task
         entry.delete()
 
+    @pytest.mark.usefixtures('parallel_transcoding')
     @mock.patch('mediagoblin.submit.lib.ProcessMedia.apply_async')
     @mock.patch('mediagoblin.submit.lib.chord')
     def test_celery_chord(self, mock_chord, mock_process_media):
@@ -710,6 +721,66 @@ class TestSubmissionVideo(BaseTestSubmission):
         mock_chord.assert_called_once_with(transcoding_tasks)
         entry.delete()
 
+    def test_workflow_single_decode(self):
+        entry = get_sample_entry(self.our_user(), self.media_type)
+        manager = VideoProcessingManager()
+        wf = manager.workflow(entry, feed_url=None, reprocess_action='initial')
+
+        video_config = mg_globals.global_config['plugins'][entry.media_type]
+        def_res = video_config['default_resolution']
+        resolutions = [def_res] + [
+            res for res in video_config['available_resolutions']
+            if res != def_res]
+        reprocess_info = {
+            'vorbis_quality': None,
+            'vp8_threads': None,
+            'thumb_size': None,
+            'vp8_quality': None
+        }
+        # A single task for all of the resolutions
+        transcoding_tasks = group([multi_transcode_task.signature(
+            args=(entry.id, resolutions), kwargs=reprocess_info,
+            queue='default',
+            priority=len(video_config['available_resolutions']) + 1,
+            immutable=True)])
+        assert wf[0] == transcoding_tasks
+        assert wf[1] == processing_cleanup.signature(
+            args=(entry.id,), queue='default', immutable=True)
+        entry.delete()
+
+    def test_segmented_workflow(self, monkeypatch):
+        video_config = mg_globals.global_config['plugins'][self.media_type]
+        monkeypatch.setitem(video_config, 'segment_duration', 2)
+        entry = get_sample_entry(self.our_user(), self.media_type)
+        entry.queued_task_id = 'some-task'
+        entry.queued_media_file = ['media_entries', 'some-task', 'video.ogv']
+
+        metadata = mock.Mock()
+        metadata.get_duration.return_value = 5 * 10 ** 9
+        metadata.get_video_streams.return_value = [mock.Mock()]
+        metadata.get_audio_streams.return_value = [mock.Mock()]
+        # An Ogg video, which has to be transcoded rather than remuxed
+        metadata.get_tags.return_value.get_string.return_value = \
+            (True, 'Ogg')
+        with mock.patch('mediagoblin.media_types.video.processing'
+                        '.transcoders.discover', return_value=metadata):
+            wf = VideoProcessingManager().workflow(
+                entry, feed_url=None, reprocess_action='initial')
+
+        # A task per segment, the last one running to the end, and one
+        # for the audio
+        assert [task.args for task in wf[0].tasks] == [
+            (entry.id, 0, 0, 2 * 10 ** 9),
+            (entry.id, 1, 2 * 10 ** 9, 4 * 10 ** 9),
+            (entry.id, 2, 4 * 10 ** 9, None),
+            (entry.id,)]
+        assert wf[0].tasks[-1].task == audio_track_task.name
+        assert wf[1].args == (entry.id,)
+        assert wf[1].kwargs['segments'] == 3
+        assert wf[1].kwargs['resolutions'][0] == \
+            video_config['default_resolution']
+        entry.delete()
+
     def test_accepted_files(self):
         entry = get_sample_entry(self.our_user(), 'mediagoblin.media_types.video')
         manager = VideoProcessingManager()
@@ -14,17 +14,24 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import datetime
 
 try:
     from unittest import mock
 except ImportError:
     import unittest.mock as mock
 
+import pytest
+from werkzeug.exceptions import NotFound
 from werkzeug.wrappers import Request
 from werkzeug.test import EnvironBuilder
 
+from mediagoblin.db.models import MediaEntry
+from mediagoblin.tests.tools import (
+    fixture_add_comment, fixture_add_user, fixture_media_entry)
 from mediagoblin.tools.request import decode_request
-from mediagoblin.tools.pagination import Pagination
+from mediagoblin.tools.pagination import (
+    Pagination, KeysetPagination, decode_keyset_cursor)
 
 class TestDecodeRequest:
     """Test the decode_request function."""
@@ -115,3 +122,102 @@ class TestPagination:
         paginator = self._create_paginator(num_items=31, page=1, per_page=30)
         assert paginator.total_count == 31
         assert paginator.pages == 2
+
+
+class TestJumpToId:
+    def test_jumps_to_page_of_comment(self, test_app):
+        user = fixture_add_user(username='jumper')
+        media = fixture_media_entry(uploader=user.id)
+        for i in range(7):
+            fixture_add_comment(author=user.id, media_entry=media)
+        comments = media.get_comments(ascending=True)
+        link_ids = [comment.id for comment in comments]
+
+        paginator = Pagination(1, comments, 3, link_ids[4])
+        assert paginator.page == 2
+        assert paginator.active_id == link_ids[4]
+        assert link_ids[4] in [comment.id for comment in paginator()]
+
+        paginator = Pagination(
+            1, media.get_comments(ascending=False), 3, link_ids[4])
+        assert paginator.page == 1
+
+    def test_unknown_id_keeps_page(self, test_app):
+        user = fixture_add_user(username='jumper')
+        media = fixture_media_entry(uploader=user.id)
+        fixture_add_comment(author=user.id, media_entry=media)
+
+        paginator = Pagination(1, media.get_comments(), 3, 12345)
+        assert paginator.page == 1
+        assert paginator.active_id is None
+
+
+class TestKeysetPagination:
+    def _create_entries(self, num_items):
+        user = fixture_add_user(username='keyset')
+        base = datetime.datetime(2020, 1, 1)
+        for i in range(num_items):
+            entry = fixture_media_entry(
+                title='entry %d' % i, uploader=user.id, save=False,
+                state='processed', fake_upload=False, expunge=False)
+            # Pairs of entries share a timestamp so ties on created are
+            # broken by id.
+            entry.created = base + datetime.timedelta(minutes=i // 2)
+            entry.save()
+
+    def _cursor(self):
+        return MediaEntry.query.filter_by(state='processed').order_by(
+            MediaEntry.created.desc())
+
+    def test_walk_forwards_and_back(self, test_app):
+        """Walking the cursors visits every entry exactly once."""
+        self._create_entries(7)
+        expected = [e.id for e in self._cursor().order_by(MediaEntry.id.desc())]
+
+        seen = []
+        after = None
+        while True:
+            paginator = KeysetPagination(1, self._cursor(), 3, after=after)
+            seen.extend(entry.id for entry in paginator())
+            if not paginator.has_next:
+                break
+            after = paginator.next_cursor
+        assert seen == expected
+        assert paginator.has_prev
+
+        paginator = KeysetPagination(
+            1, self._cursor(), 3, before=paginator.prev_cursor)
+        assert [entry.id for entry in paginator()] == expected[3:6]
+        assert paginator.has_prev
+        assert paginator.has_next
+
+    def test_counts_only_on_request(self, test_app):
+        self._create_entries(4)
+        paginator = KeysetPagination(1, self._cursor(), 3)
+        assert paginator.total_count is None
+        assert paginator.pages is None
+        assert list(paginator.iter_pages()) == []
+        assert paginator().count() == 3
+
+        paginator = KeysetPagination(1, self._cursor(), 3, exact_count=True)
+        assert paginator.total_count == 4
+        assert list(paginator.iter_pages()) == [1, 2]
+
+    def test_page_number_fallback(self, test_app):
+        """Old ?page= links still land on the right entries."""
+        self._create_entries(5)
+        paginator = KeysetPagination(2, self._cursor(), 3)
+        assert len(paginator()) == 2
+        assert paginator.has_prev
+        assert not paginator.has_next
+
+    def test_cursor_urls(self, test_app):
+        self._create_entries(4)
+        paginator = KeysetPagination(1, self._cursor(), 3)
+        url = paginator.get_next_url_explicit(
+            'http://example.com', {'page': 1})
+        assert url == 'http://example.com?after=' + paginator.next_cursor
+
+    def test_invalid_cursor(self):
+        with pytest.raises(NotFound):
+            decode_keyset_cursor('not a cursor')
@@ -29,10 +29,19 @@ from gi.repository import Gst
 Gst.init(None)
 
 from mediagoblin.media_types.video.transcoders import (capture_thumb,
-        VideoTranscoder)
-from mediagoblin.media_types.video.util import ACCEPTED_RESOLUTIONS
-from mediagoblin.media_types.tools import discover
-from mediagoblin.tests.tools import get_app
+        capture_frames, VideoTranscoder, MultiVideoTranscoder, AudioTrackTranscoder,
+        SegmentJoiner)
+from mediagoblin.media_types.video.util import (
+    ACCEPTED_RESOLUTIONS, can_remux, remux_resolution)
+import pkg_resources
+from celery import signature
+
+from mediagoblin import mg_globals
+from mediagoblin.db.models import MediaEntry
+from mediagoblin.media_types.video.processing import (
+    vtt_timestamp, segment_filepath, VideoProcessingManager)
+from mediagoblin.media_types.tools import discover, get_gst_runtime
+from mediagoblin.tests.tools import get_app, fixture_media_entry
 
 @contextmanager
 def create_data(suffix=None, make_audio=False):
@@ -110,6 +119,36 @@ def test_thumbnails():
         assert imghdr.what(thumbnail_name) == format
 
 
+def test_capture_frames():
+    with create_data() as (video_name, result_name):
+        frames = capture_frames(video_name, [0, 0.5, 0.9], width=64)
+        assert len(frames) == 3
+        for frame in frames:
+            assert frame.size[0] == 64
+    # not a video
+    with tempfile.NamedTemporaryFile() as f:
+        assert capture_frames(f.name, [0, 0.5]) == [None, None]
+
+
+def test_gst_runtime():
+    runtime = get_gst_runtime()
+    assert get_gst_runtime() is runtime
+    assert runtime.discoverer() is runtime.discoverer()
+
+    # The capture pipeline is reused from one video to the next
+    with create_data() as (video_name, result_name):
+        capture_frames(video_name, [0.5], width=64)
+        template = runtime.pipeline_template('capture_frames', None)
+        frame, = capture_frames(video_name, [0.5], width=32)
+        assert frame.size[0] == 32
+        assert runtime.pipeline_template('capture_frames', None) is template
+
+
+def test_vtt_timestamp():
+    assert vtt_timestamp(0) == '00:00:00.000'
+    assert vtt_timestamp(3723.4567) == '01:02:03.457'
+
+
 def test_transcoder():
     # test without audio
     with create_data() as (video_name, result_name):
@@ -135,6 +174,110 @@ def test_transcoder():
         assert len(discover(result_name).get_video_streams()) == 1
         assert len(discover(result_name).get_audio_streams()) == 1
 
+def test_multi_transcoder():
+    # One decode, a file for each resolution
+    with create_data(make_audio=True) as (video_name, result_name):
+        small_name = result_name + '.small'
+        transcoder = MultiVideoTranscoder()
+        transcoder.transcode(
+                video_name,
+                [(result_name, (640, 640)), (small_name, (256, 144))],
+                vp8_quality=8,
+                vp8_threads=0,  # autodetect
+                vorbis_quality=0.3)
+        try:
+            for name, width in ((result_name, 640), (small_name, 256)):
+                data = transcoder.dst_data[name]
+                assert data.get_video_streams()[0].get_width() == width
+                assert len(data.get_audio_streams()) == 1
+        finally:
+            os.remove(small_name)
+
+
+def test_segments():
+    # Transcoded in two segments, then joined with the audio
+    with create_data(make_audio=True) as (video_name, result_name):
+        segments = [result_name + '.0', result_name + '.1']
+        audio_name = result_name + '.audio'
+        try:
+            for segment, (start, stop) in zip(
+                    segments, [(0, Gst.SECOND // 6), (Gst.SECOND // 6, None)]):
+                transcoder = MultiVideoTranscoder()
+                transcoder.transcode(
+                        video_name, [(segment, (256, 144))],
+                        start=start, stop=stop, audio=False)
+                assert transcoder.dst_data[segment]
+                assert not transcoder.dst_data[segment].get_audio_streams()
+            transcoder = AudioTrackTranscoder()
+            transcoder.transcode(video_name, audio_name)
+            assert transcoder.dst_data
+
+            joiner = SegmentJoiner()
+            joiner.join(segments, result_name, audio=audio_name)
+            data = joiner.dst_data
+            assert len(data.get_video_streams()) == 1
+            assert len(data.get_audio_streams()) == 1
+            assert data.get_duration() >= Gst.SECOND // 4
+        finally:
+            for name in segments + [audio_name]:
+                if os.path.exists(name):
+                    os.remove(name)
+
+
+def test_segments_failed(request):
+    # A failing segment marks the entry as failed and drops the segments
+    get_app(request, mgoblin_config=pkg_resources.resource_filename(
+        'mediagoblin.tests', 'test_mgoblin_app_video.ini'))
+    entry = fixture_media_entry(state='processing', expunge=False)
+    entry.queued_task_id = 'segmented-task'
+    entry.save()
+    segment = segment_filepath(entry, '144p-00000.webm')
+    with mg_globals.queue_store.get_file(segment, 'wb') as segment_file:
+        segment_file.write(b'segment')
+
+    header, cleanup = VideoProcessingManager().segmented_workflow(
+        entry, [(0, Gst.SECOND), (Gst.SECOND, None)], True,
+        {'vp8_quality': None, 'vp8_threads': None,
+         'vorbis_quality': None, 'thumb_size': None})
+    assert len(header.tasks) == 3
+    errbacks = [task.options['link_error'] for task in header.tasks]
+    errbacks.append(cleanup.options['link_error'])
+    assert all(len(errback) == 1 for errback in errbacks)
+
+    signature(errbacks[0][0]).apply()
+    entry = MediaEntry.query.get(entry.id)
+    assert entry.state == 'failed'
+    assert not mg_globals.queue_store.file_exists(segment)
+
+
+def test_remux(test_app):
+    # A VP8 and Vorbis WebM only needs its streams put in a new file
+    with create_data(make_audio=True) as (video_name, result_name):
+        assert not can_remux(discover(video_name), (640, 640))
+        webm_name = result_name + '.webm'
+        try:
+            transcoder = VideoTranscoder()
+            transcoder.transcode(
+                    video_name, webm_name, '480p', 1,
+                    dimensions=(256, 144))
+            # Only the width is fixed, so the 4:3 source comes out 256x192
+            assert not can_remux(transcoder.dst_data, (256, 144))
+            assert can_remux(transcoder.dst_data, (480, 360))
+            assert not can_remux(transcoder.dst_data, (128, 72))
+            # Only remuxed once, to the smallest resolution it fits
+            assert remux_resolution(
+                transcoder.dst_data, ['720p', '144p', '360p']) == '360p'
+            assert remux_resolution(transcoder.dst_data, ['144p']) is None
+
+            transcoder = VideoTranscoder()
+            transcoder.remux(webm_name, result_name)
+            data = transcoder.dst_data
+            assert data.get_video_streams()[0].get_width() == 256
+            assert len(data.get_audio_streams()) == 1
+        finally:
+            os.remove(webm_name)
+
+
 def test_accepted_resolutions():
     accepted_resolutions = {
         '144p': (256, 144),
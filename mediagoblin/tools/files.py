@@ -17,15 +17,46 @@
 from mediagoblin import mg_globals
 
 
+def shared_media_files(media):
+    """
+    Get the paths of media's files which other media entries use as well
+
+    Duplicate uploads share their files (see
+    mediagoblin.processing.reuse_processed_media), every MediaFile
+    pointing at a path counts as a reference to it.  Only files marked
+    with a content_hash can be shared, so media without any costs no
+    query.
+    """
+    # Import here due to cyclic imports
+    from mediagoblin.db.models import MediaFile
+
+    content_hashes = {
+        media_file.content_hash
+        for media_file in media.media_files_helper.values()
+        if media_file.content_hash}
+    if not content_hashes:
+        return set()
+
+    references = MediaFile.query.filter(
+        MediaFile.content_hash.in_(content_hashes),
+        MediaFile.media_entry != media.id).with_entities(MediaFile.file_path)
+    return {tuple(file_path) for (file_path,) in references}
+
+
 def delete_media_files(media):
     """
     Delete all files associated with a MediaEntry
 
+    Files still referenced by other media entries are kept.
+
     Arguments:
      - media: A MediaEntry document
     """
+    shared = shared_media_files(media)
     no_such_files = []
     for listpath in media.media_files.values():
+        if tuple(listpath) in shared:
+            continue
         try:
             mg_globals.public_store.delete_file(
                 listpath)
@@ -14,10 +14,13 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import copy
+import base64
+import binascii
+import datetime
 from math import ceil, floor
-from itertools import count
+from sqlalchemy import func, tuple_
 from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import NotFound
 
 import urllib
 
@@ -33,7 +36,7 @@ class Pagination:
     """
 
     def __init__(self, page, cursor, per_page=PAGINATION_DEFAULT_PER_PAGE,
-                 jump_to_id=False):
+                 jump_to_id=False, total_count=None):
         """
         Initializes Pagination
 
@@ -43,22 +46,42 @@ class Pagination:
          - cursor: db cursor
          - jump_to_id: object id, sets the page to the page containing the
            object with id == jump_to_id.
+         - total_count: number of objects in the cursor, if it is already
+           known (eg from mediagoblin.db.counters); counted otherwise.
         """
         self.page = page
         self.per_page = per_page
         self.cursor = cursor
-        self.total_count = self.cursor.count()
+        self._total_count = total_count
         self.active_id = None
 
         if jump_to_id:
-            cursor = copy.copy(self.cursor)
+            position = self._position_of(jump_to_id)
+            if position is not None:
+                self.page = 1 + int(floor(position / self.per_page))
+                self.active_id = jump_to_id
 
-            for (doc, increment) in list(zip(cursor, count(0))):
-                if doc.id == jump_to_id:
-                    self.page = 1 + int(floor(increment / self.per_page))
+    def _position_of(self, obj_id):
+        """
+        Zero-based position of the object with id == obj_id in the cursor,
+        or None if it is not part of it.
+
+        The database numbers the rows following the cursor's own ORDER BY,
+        so only a single row comes back no matter how long the listing is.
+        """
+        entity = self.cursor.column_descriptions[0]['entity']
+        order_by = self.cursor._order_by or (entity.id,)
 
-                    self.active_id = jump_to_id
-                    break
+        ranked = self.cursor.order_by(None).with_entities(
+            entity.id.label('id'),
+            func.row_number().over(order_by=order_by).label('position'),
+        ).subquery()
+
+        position = self.cursor.session.query(ranked.c.position).filter(
+            ranked.c.id == obj_id).scalar()
+        if position is None:
+            return None
+        return position - 1
 
     def __call__(self):
         """
@@ -70,6 +93,15 @@ class Pagination:
             (self.page - 1) * self.per_page,
             self.page * self.per_page)
 
+    @property
+    def total_count(self):
+        """
+        Number of objects in the cursor, counted once on first access.
+        """
+        if self._total_count is None:
+            self._total_count = self.cursor.count()
+        return self._total_count
+
     @property
     def pages(self):
         return int(ceil(self.total_count / float(self.per_page)))
@@ -82,6 +114,10 @@ class Pagination:
     def has_next(self):
         return self.page < self.pages
 
+    @property
+    def has_other_pages(self):
+        return self.pages > 1
+
     def iter_pages(self, left_edge=2, left_current=2,
                    right_current=5, right_edge=2):
         last = 0
@@ -99,14 +135,19 @@ class Pagination:
         """
         Get a page url by adding a page= parameter to the base url
         """
-        if isinstance(get_params, MultiDict):
-            new_get_params = get_params.to_dict()
-        else:
-            new_get_params = dict(get_params) or {}
+        return _url_with_params(base_url, get_params, page=page_no)
 
-        new_get_params['page'] = page_no
-        return "{}?{}".format(
-            base_url, urllib.parse.urlencode(new_get_params))
+    def get_prev_url_explicit(self, base_url, get_params):
+        """
+        Get the url of the previous (newer) page
+        """
+        return self.get_page_url_explicit(base_url, get_params, self.page - 1)
+
+    def get_next_url_explicit(self, base_url, get_params):
+        """
+        Get the url of the next (older) page
+        """
+        return self.get_page_url_explicit(base_url, get_params, self.page + 1)
 
     def get_page_url(self, request, page_no):
         """
@@ -116,3 +157,202 @@ class Pagination:
         """
         return self.get_page_url_explicit(
             request.full_path, request.GET, page_no)
+
+
+class PageItems(list):
+    """
+    The objects of a single page, as returned by KeysetPagination.
+
+    Calling count() without an argument returns the number of objects,
+    so templates written against query slices keep working.
+    """
+    def count(self, *args):
+        if args:
+            return list.count(self, *args)
+        return len(self)
+
+
+class KeysetPagination(Pagination):
+    """
+    Keyset ("seek") pagination for database queries.
+
+    Instead of counting the whole cursor and skipping rows with OFFSET,
+    pages are addressed by opaque before/after cursors encoding the
+    (created, id) key of the first or last object shown, and fetched with
+    a WHERE clause on that key.  Deep pages cost the same as the first
+    one.
+
+    Plain page numbers are still accepted (and generated when
+    exact_count is set) for links that predate the cursors.
+    """
+    def __init__(self, page, cursor, per_page=PAGINATION_DEFAULT_PER_PAGE,
+                 before=None, after=None, exact_count=False):
+        """
+        Initializes KeysetPagination
+
+        Args:
+         - page: requested page, only used if neither before nor after
+           is given
+         - cursor: db cursor over a model with created and id columns
+         - per_page: number of objects per page
+         - before: cursor of the page following the requested one
+         - after: cursor of the page preceding the requested one
+         - exact_count: count the cursor so templates can link to page
+           numbers
+        """
+        super().__init__(page, cursor, per_page)
+        self.exact_count = exact_count
+
+        entity = cursor.column_descriptions[0]['entity']
+        self.key_columns = (entity.created, entity.id)
+
+        self.before = decode_keyset_cursor(before) if before else None
+        self.after = decode_keyset_cursor(after) if after else None
+        if self.before or self.after:
+            # Position in a page-numbered listing is unknown after seeking
+            self.page = None
+
+        self._items = None
+        self._has_prev = None
+        self._has_next = None
+
+    def _fetch(self):
+        created, id = self.key_columns
+        cursor = self.cursor.order_by(None)
+
+        if self.before:
+            cursor = cursor.filter(tuple_(created, id) > self.before)
+            cursor = cursor.order_by(created.asc(), id.asc())
+        else:
+            if self.after:
+                cursor = cursor.filter(tuple_(created, id) < self.after)
+            cursor = cursor.order_by(created.desc(), id.desc())
+            if self.page and self.page > 1:
+                cursor = cursor.offset((self.page - 1) * self.per_page)
+
+        # One extra row tells us whether there is anything beyond this page
+        rows = cursor.limit(self.per_page + 1).all()
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if self.before:
+            rows.reverse()
+            self._has_prev = has_more
+            self._has_next = True
+        else:
+            self._has_prev = bool(self.after) or (self.page or 1) > 1
+            self._has_next = has_more
+
+        self._items = PageItems(rows)
+
+    def __call__(self):
+        """
+        Returns the objects for the requested page
+        """
+        if self._items is None:
+            self._fetch()
+        return self._items
+
+    @property
+    def total_count(self):
+        if not self.exact_count:
+            return None
+        return super().total_count
+
+    @property
+    def pages(self):
+        if not self.exact_count:
+            return None
+        return super().pages
+
+    @property
+    def has_prev(self):
+        if self._items is None:
+            self._fetch()
+        return self._has_prev
+
+    @property
+    def has_next(self):
+        if self._items is None:
+            self._fetch()
+        return self._has_next
+
+    @property
+    def has_other_pages(self):
+        return self.has_prev or self.has_next
+
+    @property
+    def prev_cursor(self):
+        items = self()
+        return encode_keyset_cursor(items[0]) if items else None
+
+    @property
+    def next_cursor(self):
+        items = self()
+        return encode_keyset_cursor(items[-1]) if items else None
+
+    def iter_pages(self, *args, **kwargs):
+        # Page numbers only make sense with a total and a known position
+        if not self.exact_count or self.page is None:
+            return iter(())
+        return super().iter_pages(*args, **kwargs)
+
+    def get_page_url_explicit(self, base_url, get_params, page_no):
+        return _url_with_params(
+            base_url, get_params, page=page_no, before=None, after=None)
+
+    def get_prev_url_explicit(self, base_url, get_params):
+        return _url_with_params(
+            base_url, get_params,
+            page=None, before=self.prev_cursor, after=None)
+
+    def get_next_url_explicit(self, base_url, get_params):
+        return _url_with_params(
+            base_url, get_params,
+            page=None, before=None, after=self.next_cursor)
+
+
+KEYSET_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def encode_keyset_cursor(obj):
+    """
+    Encode the (created, id) key of obj into an opaque url-safe string
+    """
+    key = '{}_{}'.format(obj.created.strftime(KEYSET_TIME_FORMAT), obj.id)
+    encoded = base64.urlsafe_b64encode(key.encode('ascii')).decode('ascii')
+    return encoded.rstrip('=')
+
+
+def decode_keyset_cursor(value):
+    """
+    Decode a cursor made by encode_keyset_cursor() into a (created, id)
+    tuple, raising NotFound on anything we did not produce.
+    """
+    try:
+        value = value + '=' * (-len(value) % 4)
+        key = base64.urlsafe_b64decode(value.encode('ascii')).decode('ascii')
+        created, id = key.rsplit('_', 1)
+        return (datetime.datetime.strptime(created, KEYSET_TIME_FORMAT),
+                int(id))
+    except (binascii.Error, UnicodeError, ValueError):
+        raise NotFound()
+
+
+def _url_with_params(base_url, get_params, **params):
+    """
+    Build base_url?get_params, updated with params (None removes a key)
+    """
+    if isinstance(get_params, MultiDict):
+        new_get_params = get_params.to_dict()
+    else:
+        new_get_params = dict(get_params) or {}
+
+    for key, value in params.items():
+        if value is None:
+            new_get_params.pop(key, None)
+        else:
+            new_get_params[key] = value
+
+    return "{}?{}".format(
+        base_url, urllib.parse.urlencode(new_get_params))
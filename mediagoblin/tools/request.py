@@ -19,7 +19,7 @@ import logging
 
 from werkzeug.http import parse_options_header
 
-from mediagoblin.db.models import User, AccessToken
+from mediagoblin.db.identity import get_access_token, get_user
 from mediagoblin.oauth.tools.request import decode_authorization_header
 
 _log = logging.getLogger(__name__)
@@ -41,9 +41,9 @@ def setup_user_in_request(request):
     if authorization.get("access_token"):
         # Check authorization header.
         token = authorization["oauth_token"]
-        token = AccessToken.query.filter_by(token=token).first()
+        token = get_access_token(token)
         if token is not None:
-            request.user = token.user
+            request.user = get_user(token.actor)
             return
 
 
@@ -51,7 +51,7 @@ def setup_user_in_request(request):
         request.user = None
         return
 
-    request.user = User.query.get(request.session['user_id'])
+    request.user = get_user(request.session['user_id'])
 
     if not request.user:
         # Something's wrong... this user doesn't exist?  Invalidate
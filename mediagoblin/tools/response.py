@@ -21,6 +21,7 @@ from werkzeug.wrappers import Response as wz_Response
 from mediagoblin.tools.template import render_template
 from mediagoblin.tools.translate import (lazy_pass_to_ugettext as _,
                                          pass_to_ugettext)
+from mediagoblin.db.identity import refresh_bans
 from mediagoblin.db.models import UserBan, User
 from datetime import date
 
@@ -80,10 +81,14 @@ def render_user_banned(request):
     and the reason why they have been banned"
     """
     user_ban = UserBan.query.get(request.user.id)
+    # The ban may have been lifted since it was cached
+    if user_ban is None:
+        return redirect(request, 'index')
     if (user_ban.expiration_date is not None and
             date.today()>user_ban.expiration_date):
 
         user_ban.delete()
+        refresh_bans()
         return redirect(request,
             'index')
     return render_to_response(request,
@@ -158,6 +163,30 @@ def json_response(serializable, _disable_cors=False, *args, **kw):
 
     return response
 
+def set_validators(response, etag, last_modified=None):
+    """Set the ETag and Last-Modified headers of a response"""
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
+
+def not_modified(request, etag, last_modified=None):
+    """
+    Return a 304 response if the client's copy of a document with the
+    given validators is still current, otherwise None.
+
+    Use this before building the document, and set_validators() on the
+    response once it is built.
+
+    Only If-None-Match is honoured: last_modified is the newest change of
+    the items still in the document, so removing or unpublishing items
+    doesn't move it, and If-Modified-Since alone always gets the full
+    document.
+    """
+    if request.if_none_match and request.if_none_match.contains(etag):
+        return set_validators(wz_Response(status=304), etag, last_modified)
+    return None
+
 def json_error(error_str, status=400, *args, **kwargs):
     """
         This is like json_response but takes an error message in and formats
@@ -14,6 +14,10 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import gettext
+import logging
+import os
+
 import jinja2
 from jinja2.ext import Extension
 from jinja2.nodes import Include, Const
@@ -24,16 +28,43 @@ from werkzeug.urls import url_quote_plus
 from mediagoblin import mg_globals
 from mediagoblin import messages
 from mediagoblin import _version
-from mediagoblin.tools import common
+from mediagoblin.tools import common, translate
 from mediagoblin.tools.translate import is_rtl
 from mediagoblin.tools.translate import set_thread_locale
 from mediagoblin.tools.pluginapi import get_hook_templates, hook_transform
 from mediagoblin.tools.timesince import timesince
 from mediagoblin.meddleware.csrf import render_csrf_form_token
 
+_log = logging.getLogger(__name__)
+
 SETUP_JINJA_ENVS = {}
 
 
+def _jinja_env_key(template_loader, locale):
+    """
+    Locales babel doesn't know about all share the environment of the
+    translation catalog they fall back to, so that made up locales can't
+    fill up SETUP_JINJA_ENVS.
+    """
+    if not exists(locale):
+        locale = (
+            gettext.find('mediagoblin', translate.TRANSLATIONS_PATH, [locale]),
+            is_rtl(locale))
+    return template_loader, locale
+
+
+def get_bytecode_cache(app_config):
+    """
+    Return the jinja2 bytecode cache in template_cache_dir, or None if
+    compiled templates shouldn't be kept
+    """
+    cache_dir = app_config.get('template_cache_dir')
+    if not cache_dir:
+        return None
+    os.makedirs(cache_dir, exist_ok=True)
+    return jinja2.FileSystemBytecodeCache(cache_dir)
+
+
 def get_jinja_env(app, template_loader, locale):
     """
     Set up the Jinja environment,
@@ -45,8 +76,9 @@ def get_jinja_env(app, template_loader, locale):
 
     # If we have a jinja environment set up with this locale, just
     # return that one.
-    if locale in SETUP_JINJA_ENVS:
-        return SETUP_JINJA_ENVS[locale]
+    env_key = _jinja_env_key(template_loader, locale)
+    if env_key in SETUP_JINJA_ENVS:
+        return SETUP_JINJA_ENVS[env_key]
 
     # The default config does not require a [jinja2] block.
     # You may create one if you wish to enable additional jinja2 extensions,
@@ -59,6 +91,7 @@ def get_jinja_env(app, template_loader, locale):
     template_env = jinja2.Environment(
         loader=template_loader, autoescape=True,
         undefined=jinja2.StrictUndefined,
+        bytecode_cache=get_bytecode_cache(app.app_config),
         extensions=[
             'jinja2.ext.i18n', 'jinja2.ext.autoescape',
             TemplateHookExtension] + local_exts)
@@ -98,12 +131,46 @@ def get_jinja_env(app, template_loader, locale):
     template_env.globals[
         'get_comment_subscription'] = notifications.get_comment_subscription
 
-    if exists(locale):
-        SETUP_JINJA_ENVS[locale] = template_env
+    SETUP_JINJA_ENVS[env_key] = template_env
 
     return template_env
 
 
+def compile_templates(app, locale='en'):
+    """
+    Load every template the app can find, so they are compiled and end
+    up in the bytecode cache.
+
+    Returns the number of templates compiled and a list of (name,
+    exception) tuples for the ones that failed to compile.
+    """
+    template_env = get_jinja_env(app, app.template_loader, locale)
+    compiled = 0
+    failed = []
+    for name in template_env.list_templates():
+        try:
+            template_env.get_template(name)
+        except (jinja2.TemplateError, UnicodeDecodeError) as exc:
+            failed.append((name, exc))
+        else:
+            compiled += 1
+    return compiled, failed
+
+
+def warm_up_templates(app):
+    """
+    Set up the environments of all available locales and compile all
+    templates, rather than doing so on the first requests.
+    """
+    for locale in translate.AVAILABLE_LOCALES or []:
+        get_jinja_env(app, app.template_loader, locale)
+
+    compiled, failed = compile_templates(app)
+    for name, exc in failed:
+        _log.warning('Could not compile template %s: %s', name, exc)
+    _log.debug('Compiled %d templates', compiled)
+
+
 # We'll store context information here when doing unit tests
 TEMPLATE_TEST_CONTEXT = {}
 
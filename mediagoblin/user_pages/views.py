@@ -19,14 +19,17 @@ import datetime
 import json
 
 from mediagoblin import messages, mg_globals
+from mediagoblin.db.counters import get_media_count
+from mediagoblin.db.util import query_validator, with_gallery_loading
 from mediagoblin.db.models import (MediaEntry, MediaTag, Collection,
                                    CollectionItem, LocalUser, Activity)
+from mediagoblin.meddleware.page_cache import page_cacheable
 from mediagoblin.plugins.api.tools import get_media_file_paths
 from mediagoblin.tools.response import render_to_response, render_404, \
-    redirect, redirect_obj
+    redirect, redirect_obj, not_modified, set_validators
 from mediagoblin.tools.text import cleaned_markdown_conversion
 from mediagoblin.tools.translate import pass_to_ugettext as _
-from mediagoblin.tools.pagination import Pagination
+from mediagoblin.tools.pagination import Pagination, KeysetPagination
 from mediagoblin.tools.federation import create_activity
 from mediagoblin.tools.feeds import AtomFeedWithLinks
 from mediagoblin.user_pages import forms as user_forms
@@ -50,6 +53,7 @@ _log = logging.getLogger(__name__)
 _log.setLevel(logging.DEBUG)
 
 
+@page_cacheable
 @user_not_banned
 @uses_pagination
 def user_home(request, page):
@@ -65,8 +69,11 @@ def user_home(request, page):
 
     cursor = MediaEntry.query.\
         filter_by(actor=user.id).order_by(MediaEntry.created.desc())
+    cursor = with_gallery_loading(cursor)
 
-    pagination = Pagination(page, cursor)
+    pagination = KeysetPagination(
+        page, cursor,
+        before=request.GET.get('before'), after=request.GET.get('after'))
     media_entries = pagination()
 
     # if no data is available, return NotFound
@@ -85,6 +92,7 @@ def user_home(request, page):
          'media_entries': media_entries,
          'pagination': pagination})
 
+@page_cacheable
 @user_not_banned
 @active_user_from_url
 @uses_pagination
@@ -100,9 +108,12 @@ def user_gallery(request, page, url_user=None):
         cursor = cursor.filter(
             MediaEntry.tags_helper.any(
                 MediaTag.slug == request.matchdict['tag']))
+    cursor = with_gallery_loading(cursor)
 
     # Paginate gallery
-    pagination = Pagination(page, cursor)
+    pagination = KeysetPagination(
+        page, cursor,
+        before=request.GET.get('before'), after=request.GET.get('after'))
     media_entries = pagination()
 
     #if no data is available, return NotFound
@@ -120,6 +131,7 @@ def user_gallery(request, page, url_user=None):
 
 MEDIA_COMMENTS_PER_PAGE = 50
 
+@page_cacheable
 @user_not_banned
 @get_user_media_entry
 @uses_pagination
@@ -547,7 +559,15 @@ def atom_feed(request):
     link = request.urlgen('mediagoblin.user_pages.user_home',
                           qualified=True, user=request.matchdict['user'])
     cursor = MediaEntry.query.filter_by(actor=user.id, state='processed')
+
+    etag, last_modified = query_validator(
+        cursor, MediaEntry.updated, request.url)
+    response = not_modified(request, etag, last_modified)
+    if response is not None:
+        return response
+
     cursor = cursor.order_by(MediaEntry.created.desc())
+    cursor = with_gallery_loading(cursor)
     cursor = cursor.limit(ATOM_DEFAULT_NR_OF_UPDATED_ITEMS)
 
     """
@@ -600,7 +620,7 @@ def atom_feed(request):
         feed.writeString(encoding='utf-8'),
         mimetype='application/atom+xml'
     )
-    return response
+    return set_validators(response, etag, last_modified)
 
 
 def collection_atom_feed(request):
@@ -619,9 +639,17 @@ def collection_atom_feed(request):
         return render_404(request)
 
     cursor = CollectionItem.query.filter_by(
-                 collection=collection.id) \
-                 .order_by(CollectionItem.added.desc()) \
-                 .limit(ATOM_DEFAULT_NR_OF_UPDATED_ITEMS)
+                 collection=collection.id)
+
+    etag, last_modified = query_validator(
+        cursor, CollectionItem.added, collection.updated, request.url)
+    last_modified = max(filter(None, [last_modified, collection.updated]))
+    response = not_modified(request, etag, last_modified)
+    if response is not None:
+        return response
+
+    cursor = cursor.order_by(CollectionItem.added.desc()) \
+                   .limit(ATOM_DEFAULT_NR_OF_UPDATED_ITEMS)
 
     """
     ATOM feed id is a tag URI (see http://en.wikipedia.org/wiki/Tag_URI)
@@ -670,7 +698,7 @@ def collection_atom_feed(request):
                 'rel': 'alternate',
                 'type': 'text/html'}])
 
-    return feed.get_response()
+    return set_validators(feed.get_response(), etag, last_modified)
 
 @active_user_from_url
 @uses_pagination
@@ -693,16 +721,18 @@ def processing_panel(request, page, url_user):
     # Get media entries which are in-processing
     entries = (MediaEntry.query.filter_by(actor=user.id)
             .order_by(MediaEntry.created.desc()))
+    total_count = None
 
     try:
         state = request.matchdict['state']
         # no exception was thrown, filter entries by state
         entries = entries.filter_by(state=state)
+        total_count = get_media_count(state, actor=user.id)
     except KeyError:
         # show all entries
         pass
 
-    pagination = Pagination(page, entries)
+    pagination = Pagination(page, entries, total_count=total_count)
     pagination.per_page = 30
     entries_on_a_page = pagination()
 
@@ -16,7 +16,9 @@
 
 from mediagoblin import mg_globals
 from mediagoblin.db.models import MediaEntry
-from mediagoblin.tools.pagination import Pagination
+from mediagoblin.db.util import with_gallery_loading
+from mediagoblin.meddleware.page_cache import page_cacheable
+from mediagoblin.tools.pagination import KeysetPagination
 from mediagoblin.tools.pluginapi import hook_handle
 from mediagoblin.tools.response import render_to_response, render_404
 from mediagoblin.decorators import uses_pagination, user_not_banned
@@ -27,8 +29,11 @@ from mediagoblin.decorators import uses_pagination, user_not_banned
 def default_root_view(request, page):
     cursor = request.db.query(MediaEntry).filter_by(state='processed').\
         order_by(MediaEntry.created.desc())
+    cursor = with_gallery_loading(cursor)
 
-    pagination = Pagination(page, cursor)
+    pagination = KeysetPagination(
+        page, cursor,
+        before=request.GET.get('before'), after=request.GET.get('after'))
     media_entries = pagination()
     return render_to_response(
         request, 'mediagoblin/root.html',
@@ -38,6 +43,7 @@ def default_root_view(request, page):
 
 
 
+@page_cacheable
 def root_view(request):
     """
     Proxies to the real root view that's displayed